@@ -1,9 +1,21 @@
+import argparse
+import os
+import sys
+
 import eatpy
 
 # Notes:
 # * If you are running ERGOM, replace total_chlorophyll with msi_ergom1_tot_chla
 # * A simpler example where only SST is assimilated is given in assimilate_sst.py
 
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--localize",
+    action="store_true",
+    help="limit the update to the upper water column, with increments tapered by depth",
+)
+args = parser.parse_args()
+
 experiment = eatpy.models.GOTM(diagnostics_in_state=["total_chlorophyll"])
 
 filter = eatpy.PDAF(eatpy.pdaf.FilterType.ESTKF)
@@ -18,6 +30,23 @@ experiment.add_plugin(
     )
 )
 
+# With --localize, the update is limited to the upper water column, with
+# increments tapered by depth (see localization.py in the repository root)
+if args.localize:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+    import localization
+
+    experiment.add_plugin(
+        localization.Localization(
+            localization.grid("../reference/gotm.yaml"),
+            {
+                "total_chlorophyll[-1]": localization.Taper(
+                    20.0, ["total_chlorophyll", *bgc_variables]
+                ),
+            },
+        )
+    )
+
 # If you comment out the two lines below, you run the ensemble only without assimilation
 experiment.add_observations("total_chlorophyll[-1]", "../observations/cci_chl.dat")
 
@@ -19,6 +19,21 @@ experiment.add_plugin(
     )
 )
 
+# To limit the update to the upper water column, with increments tapered by depth
+# (see localization.py in the repository root), uncomment the lines below
+# import os, sys
+# sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+# import localization
+# experiment.add_plugin(
+#     localization.Localization(
+#         localization.grid("../reference/gotm.yaml"),
+#         {
+#             "temp[-1]": localization.Taper(30.0, ["temp", "salt"]),
+#             "total_chlorophyll[-1]": localization.Taper(20.0, ["total_chlorophyll", *bgc_variables]),
+#         },
+#     )
+# )
+
 # If you comment out the two lines below, you run the ensemble only without assimilation
 experiment.add_observations("temp[-1]", "../observations/cci_sst.dat")
 experiment.add_observations("total_chlorophyll[-1]", "../observations/cci_chl.dat")
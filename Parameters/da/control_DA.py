@@ -1,89 +1,229 @@
-from typing import Mapping, Any
+from typing import Mapping, Any, Iterable, Optional, Tuple
 import eatpy.shared
 import numpy as np
 import datetime
 
 # state variables that the DA scheme is allowed to manipulate
 kept_vars = ["P1_Chl", "P1_c", "P1_p", "P1_n", "P1_s", "instances_P1_parameters_sum"]
-list_positive=kept_vars
+list_positive = kept_vars
 
 # state variables that need to be log-transformed
 logtransformed_vars = []
 
 # parameter/variable which is not allowed t go above/below certain threshold and will be perturbed to maintain ensemble spread
 perturbed_vars = ["instances_P1_parameters_sum"]
-clip_below=True # do you want to put a lower treshold on the parameter value? 
-tresh_below=0.1 # what is it?
-clip_above=True # do you want to put an upper treshold on the parameter value? 
-tresh_above = 5. # what is it?
+clip_below = True  # do you want to put a lower treshold on the parameter value?
+tresh_below = 0.1  # what is it?
+clip_above = True  # do you want to put an upper treshold on the parameter value?
+tresh_above = 5.0  # what is it?
 
+# minimum spread of the perturbed variables, as fraction of the ensemble mean
+MIN_SPREAD = 0.15
+
+# value that negative values of positive variables are replaced by
+SMALL = 1.0e-8
+
+
+def apply_thresholds(
+    data: np.ndarray,
+    clip_below: bool,
+    tresh_below: float,
+    clip_above: bool,
+    tresh_above: float,
+    member_min: float,
+    member_max: float,
+):
+    """Shift the surface ensemble mean of ``data`` (members, depth) back to
+    the nearest threshold if it lies outside [tresh_below, tresh_above],
+    and then bound individual members by member_min or member_max.
+    ``data`` is modified in place."""
+    surface = data[:, -1]
+    mean = surface.mean()
+    if clip_below and mean < tresh_below:
+        surface += tresh_below - mean
+        np.maximum(surface, member_min, out=surface)
+    elif clip_above and mean > tresh_above:
+        surface -= mean - tresh_above
+        np.minimum(surface, member_max, out=surface)
+
+
+def inflate_spread(data: np.ndarray, min_spread: float) -> bool:
+    """Inflate the ensemble ``data`` (members, depth) in place if the mean
+    absolute deviation of members at the surface is less than ``min_spread``
+    times the surface ensemble mean. Each depth is inflated by the same
+    factor relative to its own mean, so the vertical structure of the spread
+    is preserved. Returns whether inflation was applied.
+
+    Members are updated in order and each update uses the ensemble mean
+    *including* the members already inflated. This reproduces the original
+    member-by-member loop exactly, through the closed form of the recurrence
+    d[k+1] = a d[k] + (c - 1) p[k] / N, with d the drift of the ensemble
+    mean, p the original deviations from the mean, c the inflation factor
+    and a = 1 + 1/N.
+    """
+    N = data.shape[0]
+    mean = data.mean(axis=0)
+    position = data - mean
+    spread_surface = np.abs(position[:, -1]).mean()
+    if spread_surface == 0.0 or not spread_surface < min_spread * mean[-1]:
+        # no spread to scale up, or spread already sufficient
+        return False
+    coeff = min_spread * mean / spread_surface
+    a = 1.0 + 1.0 / N
+    k = np.arange(N)[:, np.newaxis]
+    increments = a ** (-k) * (coeff - 1.0) * position / N
+    drift = np.cumsum(increments, axis=0) - increments
+    drift *= a ** (k - 1)
+    data[...] = mean + drift + coeff * position
+    return True
+
+
+class SpreadControl(eatpy.shared.Plugin):
+    """Restrict the state to selected variables, optionally log-transform
+    some of them, keep perturbed variables (typically parameters) within
+    thresholds while maintaining a minimum ensemble spread, optionally clip
+    variables to fixed bounds, and replace negative values of positive
+    variables. All transformations work in place on the state."""
+
+    def __init__(
+        self,
+        kept_vars: Iterable[str] = kept_vars,
+        positive_vars: Iterable[str] = list_positive,
+        logtransformed_vars: Iterable[str] = logtransformed_vars,
+        perturbed_vars: Iterable[str] = perturbed_vars,
+        clip_below: bool = clip_below,
+        tresh_below: float = tresh_below,
+        clip_above: bool = clip_above,
+        tresh_above: float = tresh_above,
+        member_min: Optional[float] = None,
+        member_max: Optional[float] = None,
+        min_spread: float = MIN_SPREAD,
+        small: float = SMALL,
+        bounds: Mapping[str, Tuple[Optional[float], Optional[float]]] = {},
+    ):
+        super().__init__()
+        self.kept_vars = frozenset(kept_vars)
+        self.positive_vars = frozenset(positive_vars)
+        self.logtransformed_vars = frozenset(logtransformed_vars)
+        self.perturbed_vars = frozenset(perturbed_vars)
+        self.clip_below = clip_below
+        self.tresh_below = tresh_below
+        self.clip_above = clip_above
+        self.tresh_above = tresh_above
+
+        # Bounds for individual members after moving the ensemble mean to a
+        # threshold. The upper bound historically derives from tresh_below;
+        # that default is kept to preserve existing results.
+        self.member_min = 0.2 * tresh_below if member_min is None else member_min
+        self.member_max = 5.0 * tresh_below if member_max is None else member_max
+        self.min_spread = min_spread
+        self.small = small
+
+        # Optional (lower, upper) bounds per variable, None for no bound
+        self.bounds = dict(bounds)
+        self._layout = None
 
-class MyPlugin(eatpy.shared.Plugin):
     def initialize(self, variables: Mapping[str, Any], ensemble_size: int):
         self.logvars = []
         self.perturbvars = []
         self.vars = variables
         for name in list(variables):
-            if name not in kept_vars:
+            if name not in self.kept_vars:
                 del variables[name]
-            elif name in logtransformed_vars:
+            elif name in self.logtransformed_vars:
                 self.logvars.append(variables[name])
-            elif name in perturbed_vars:
+            elif name in self.perturbed_vars:
                 self.perturbvars.append(variables[name])
 
-    def before_analysis(self, time: datetime.datetime, state: np.ndarray, iobs: np.ndarray, obs: np.ndarray, obs_sds: np.ndarray, filter: eatpy.shared.Filter):
+    def before_analysis(
+        self,
+        time: datetime.datetime,
+        state: np.ndarray,
+        iobs: np.ndarray,
+        obs: np.ndarray,
+        obs_sds: np.ndarray,
+        filter: eatpy.shared.Filter,
+    ):
         for info in self.logvars:
             start, stop = info["start"], info["stop"]
             affected_obs = (iobs >= start) & (iobs < stop)
             if affected_obs.any():
-                obs[affected_obs] = np.log10(obs[affected_obs])
-            info["data"][...] = np.log10(info["data"])
-               
+                np.log10(obs, out=obs, where=affected_obs)
+            np.log10(info["data"], out=info["data"])
+
+    def _prepare(self, state: np.ndarray):
+        # Column ranges of the positive variables in the state, with adjacent
+        # variables merged into one range, the position of each variable
+        # within its range, and work arrays for the widest range. Computed
+        # once, as the layout of the state does not change during a run.
+        runs, positions = [], []
+        for name, info in self.vars.items():
+            if name in self.positive_vars:
+                start, stop = info["start"], info["start"] + info["length"]
+                if not runs or runs[-1][1] != start:
+                    runs.append([start, start])
+                runs[-1][1] = stop
+                offset = start - runs[-1][0]
+                positions.append((name, len(runs) - 1, offset, offset + info["length"]))
+        width = max([stop - start for start, stop in runs], default=0)
+        self._layout = (
+            [slice(start, stop) for start, stop in runs],
+            positions,
+            np.empty((state.shape[0], width), dtype=bool),
+            np.empty((len(runs), width), dtype=np.intp),
+        )
+
+    def _enforce_positivity(self, state: np.ndarray) -> Mapping[str, int]:
+        # Replace negative values of all positive variables in place.
+        # Returns the number of values replaced per variable.
+        if self._layout is None:
+            self._prepare(state)
+        slices, positions, mask, counts = self._layout
+        for irun, columns in enumerate(slices):
+            width = columns.stop - columns.start
+            block = state[:, columns]
+            np.less(block, 0.0, out=mask[:, :width])
+            np.copyto(block, self.small, where=mask[:, :width])
+            np.sum(mask[:, :width], axis=0, out=counts[irun, :width])
+        return {
+            name: int(counts[irun, start:stop].sum())
+            for name, irun, start, stop in positions
+        }
 
     def after_analysis(self, state: np.ndarray):
         for info in self.logvars:
-            info["data"][...] = 10. ** info["data"]
+            np.power(10.0, info["data"], out=info["data"])
 
-        SMALL=1.0e-8
-        MIN_SPREAD = 0.15
+        for name, (lower, upper) in self.bounds.items():
+            if name in self.vars:
+                data = self.vars[name]["data"]
+                np.clip(data, lower, upper, out=data)
 
         for info in self.perturbvars:
-            start, stop = info["start"], info["stop"]
-#            affected_obs = (iobs >= start) & (iobs < stop)
-
-            if (clip_below) & (np.mean(info["data"][:,-1]) < tresh_below):
-                info["data"][:,-1] += tresh_below - np.mean(info["data"][:,-1])   # move the ensemble mean to the lower treshold if it's lower than that...
-                cond = info["data"][:,-1] < 0.2*tresh_below   # don't allow too low values of ensemble members
-                info["data"][cond,-1] = 0.2*tresh_below  
-            elif (clip_above) & (np.mean(info["data"][:,-1]) > tresh_above):  
-                info["data"][:,-1] -= np.mean(info["data"][:,-1]) - tresh_above   # move the ensemble mean to the upper treshold if it's higher than that...  
-#                info["data"][:,-1] = min(info["data"][:,-1], 10*tresh_above)
-                cond = info["data"][:,-1] > 5.*tresh_below  # don't allow too high values of ensemble members
-                info["data"][cond,-1] = 5.*tresh_below
-
-
-            if len(np.shape(info["data"]))==2:
-                ens_position_surface = info["data"][:,-1] - np.mean(info["data"][:,-1])   # what is the mean spread between ens mem at the surface?
-                if np.mean(np.abs(ens_position_surface)) < MIN_SPREAD*np.mean(info["data"][:,-1]):  # if it's less than 15% of the mean then inflate it to 15%
-                    self.logger.info("Increasing spread of the ensemble")
-                    for depth in range(0,np.shape(info["data"])[1]):
-                        ens_position = info["data"][:,depth] - np.mean(info["data"][:,depth])    # at each depth find the member position relative to the mean 
-                        coeff =  MIN_SPREAD*(np.mean(np.abs(ens_position))/np.mean(np.abs(ens_position_surface)))*np.mean(info["data"][:,depth])/np.mean(np.abs(ens_position))  # this inflates each member to the distance that on average will be N% of the mean, where N scales with depth as the ensemble spread... At the surface by definition N=15.
-                        for mem in range(0,np.shape(info["data"])[0]):
-                            info["data"][mem,depth] = np.mean(info["data"][:,depth]) + coeff*ens_position[mem]   # inflation step
-            elif len(np.shape(info["data"]))==1:
-                ens_position_surface = info["data"] - np.mean(info["data"])   # what is the mean spread between ens mem at the surface
-                if np.mean(np.abs(ens_position_surface)) < MIN_SPREAD*np.mean(info["data"]):  # if it's less than 15% of the mean then inflate it to 15%
-                    self.logger.info("Increasing spread of the ensemble")
-                    coeff =  MIN_SPREAD*np.mean(info["data"])/np.mean(np.abs(ens_position_surface))
-                    for mem in range(0,np.shape(info["data"])[0]):
-                        info["data"][mem] = np.mean(info["data"]) + coeff*ens_position_surface[mem]   # inflation step
-
-
-        for name in self.vars:
-            start=self.vars[name]['start']
-            stop=start + self.vars[name]['length']
-            var = state[:, start:stop]  # note: the first axis is for the ensemble members
-            if name in list_positive:
-                self.logger.info(f"Number of negative values in {name}: {len(var[var<0])}")
-                var[var<0] = SMALL
+            # View as (members, depth); variables without depth get depth 1
+            data = info["data"].reshape(info["data"].shape[0], -1)
+            apply_thresholds(
+                data,
+                self.clip_below,
+                self.tresh_below,
+                self.clip_above,
+                self.tresh_above,
+                self.member_min,
+                self.member_max,
+            )
+            if inflate_spread(data, self.min_spread):
+                self.logger.info("Increasing spread of the ensemble")
+
+        negatives = self._enforce_positivity(state)
+        total = sum(negatives.values())
+        if total:
+            details = ", ".join(f"{n} in {name}" for name, n in negatives.items() if n)
+            self.logger.info(
+                f"Replaced {total} negative values by {self.small} ({details})"
+            )
+        else:
+            self.logger.info("No negative values")
+
+
+# Original name, used by existing run scripts
+MyPlugin = SpreadControl
@@ -3,12 +3,47 @@ import eatpy
 #import keep
 #import plug_propagate
 import control_DA
+
+# Set EAT_PROFILE=1 to time the custom plugins (see profiling.py in the root)
+import os
+import sys
+import argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+import profiling
+import checkpoint
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--resume", action="store_true", help="continue from the latest checkpoint"
+)
+parser.add_argument(
+    "--localize",
+    action="store_true",
+    help="taper the update of the profiles with depth (see localization.py in the root)",
+)
+args = parser.parse_args()
+
+# Checkpoints of the state (including the perturbed parameter) every 10 analyses
+checkpoints = checkpoint.Checkpoint("checkpoints", every=10, resume=args.resume)
+resume = {} if checkpoints.start is None else dict(start=checkpoints.start)
+
 experiment = eatpy.models.GOTM(
 #diagnostics_in_state=["total_chlorophyll"]
-fabm_parameters_in_state=["instances/P1/parameters/sum"]
+fabm_parameters_in_state=["instances/P1/parameters/sum"],
+**resume
 )
+experiment.add_plugin(checkpoints)
 #experiment.add_plugin(cvt.Cvt())
-experiment.add_plugin(control_DA.MyPlugin())
+experiment.add_plugin(profiling.wrap(control_DA.MyPlugin()))
+if args.localize:
+    import localization
+
+    experiment.add_plugin(
+        localization.Localization(
+            localization.grid("../reference/gotm.yaml"),
+            {"P1_Chl[-1]": localization.Taper(15.0)},
+        )
+    )
 #experiment.add_plugin(plug_propagate.PropagateChlTot())
 filter = eatpy.PDAF(eatpy.pdaf.FilterType.ESTKF)
 #experiment.add_observations("total_chlorophyll", "Exp_OC_HT_P_HE_FC.dat")
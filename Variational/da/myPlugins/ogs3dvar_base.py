@@ -8,17 +8,207 @@ from collections import OrderedDict
 #from scipy import interpolate
 
 import sys
+import os
+import hashlib
+
+from .cvt_operator import CvtOperator, time_operator
+
+
+class EOFStore:
+    """Monthly EOFs, interpolated to the model grid.
+
+    The EOFs for all twelve months are interpolated in one go and the
+    resulting stack (month, EOF, model level) is saved as a binary cache
+    file. The cache is keyed by the contents of the EOF files and of the
+    file with EOF depths, and by the model grid, so later runs with the
+    same inputs skip parsing the text files altogether."""
+
+    def __init__(
+        self,
+        eofs_filestring: str,
+        z_file: str,
+        cache_dir: Optional[str] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.eofs_files = [
+            f"{eofs_filestring}{month:02d}.txt" for month in range(1, 13)
+        ]
+        self.z_file = z_file
+        self.cache_dir = (
+            cache_dir if cache_dir is not None else os.path.dirname(eofs_filestring)
+        )
+        self.logger = logger or logging.getLogger("EOFStore")
+
+        # Hash input files now; they are only parsed if the cache is missing.
+        # The number of EOFs is the number of rows in each file.
+        self.hash = hashlib.sha1()
+        neofs = []
+        for path in self.eofs_files + [z_file]:
+            with open(path, "rb") as f:
+                data = f.read()
+            self.hash.update(data)
+            neofs.append(sum(1 for line in data.splitlines() if line.strip()))
+        self.neof = min(neofs[:-1])
+        self.logger.info("Reading z levels from file: {}".format(self.z_file))
+        self.z_eof = np.loadtxt(self.z_file)
+        self.z = None
+        self.Vmat = None
+        self._variance = None
+
+    def explained_variance(self) -> np.ndarray:
+        """Cumulative fraction of variance explained by the leading EOFs
+        (month, number of EOFs - 1), from the squared norm of each EOF."""
+        if self._variance is None:
+            norm2 = np.stack(
+                [
+                    (self._read(path)[: self.neof] ** 2).sum(axis=1)
+                    for path in self.eofs_files
+                ]
+            )
+            self._variance = np.cumsum(norm2, axis=1) / norm2.sum(axis=1, keepdims=True)
+        return self._variance
+
+    def truncation(self, fraction: float) -> np.ndarray:
+        """Number of leading EOFs needed per month to explain at least the
+        given fraction of the variance."""
+        variance = self.explained_variance()
+        return np.minimum((variance < fraction - 1e-12).sum(axis=1) + 1, self.neof)
+
+    def _read(self, path: str) -> np.ndarray:
+        self.logger.info(f"Reading EOFs from file: {path}")
+        return np.loadtxt(path, ndmin=2)
+
+    def load(self, z: np.ndarray) -> np.ndarray:
+        """Return EOFs for all months (month, EOF, level) interpolated to model depths z."""
+        z = np.asarray(z, dtype=float).ravel()
+        if self.Vmat is not None and np.array_equal(z, self.z):
+            return self.Vmat
+        key = self.hash.copy()
+        key.update(z.tobytes())
+        cache_file = os.path.join(
+            self.cache_dir, f"eof_cache_{key.hexdigest()[:16]}.npy"
+        )
+        if os.path.isfile(cache_file):
+            self.logger.info(
+                "Reading interpolated EOFs from cache: {}".format(cache_file)
+            )
+            Vmat = np.load(cache_file)
+        else:
+            Vmat = self._interpolate(z)
+            self.logger.info("Saving interpolated EOFs to cache: {}".format(cache_file))
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                np.save(f, Vmat)
+            os.replace(tmp_file, cache_file)
+        self.z, self.Vmat = z.copy(), Vmat
+        return Vmat
+
+    def _interpolate(self, z: np.ndarray) -> np.ndarray:
+        eofs = np.stack([self._read(path)[: self.neof] for path in self.eofs_files])
+
+        # Linear interpolation is the same for every EOF, so express it as a
+        # (EOF level, model level) weight matrix by interpolating unit vectors.
+        # EOF depths are positive downward, model z is negative upward.
+        weights = np.empty((self.z_eof.size, z.size))
+        unit = np.zeros(self.z_eof.size)
+        for i in range(self.z_eof.size):
+            unit[i] = 1.0
+            weights[i, :] = np.interp(z, -self.z_eof[::-1], unit[::-1])
+            unit[i] = 0.0
+        return np.matmul(eofs, weights)
+
 
 class Chl(eatpy.pdaf.CvtHandler):
     
     # def __init__(self, dim_cvec=26, dim_cvec_ens=3, eofs_filestring: str = 'data/init/eof.', z_file: str = 'data/init/z.txt', name: str = 'OGS-3Dvar'):
     # def __init__(self, dim_cvec: Optional[int] = None, dim_cvec_ens: Optional[int] = None, eofs_filestring: str = 'data/init/eof.', z_file: str = 'data/init/z.txt', name: str = 'OGS-3Dvar'):
-    def __init__(self, dim_cvec: Optional[int] = None, dim_cvec_ens: Optional[int] = None, eofs_filestring: str = '../data/init/eof.', z_file: str = '../data/init/z.txt', name: str = 'OGS-3Dvar'):
-        super().__init__(dim_cvec,dim_cvec_ens)
-        self.dim_cvec=26
+    def __init__(
+        self,
+        dim_cvec: Optional[int] = None,
+        dim_cvec_ens: Optional[int] = None,
+        eofs_filestring: str = "../data/init/eof.",
+        z_file: str = "../data/init/z.txt",
+        name: str = "OGS-3Dvar",
+        cache_dir: Optional[str] = None,
+        explained_variance: Optional[float] = None,
+    ):
+        """The size of the control vector (dim_cvec) is the number of EOFs in
+        the EOF files, optionally limited to dim_cvec if that is provided.
+        If explained_variance is provided (e.g., 0.99), the EOFs of each month
+        are truncated to the smallest number that explains that fraction of
+        the variance, and dim_cvec becomes the largest of these numbers.
+        Months that need fewer EOFs get zeros for the remaining ones."""
+        super().__init__(dim_cvec, dim_cvec_ens)
         self.logger = logging.getLogger(name)
         self.eofs_filestring=eofs_filestring
         self.z_file=z_file
+        self.cache_dir = cache_dir
+        self.explained_variance = explained_variance
+
+        # The control vector size must be known before PDAF is initialized,
+        # so the EOF files are inspected here already
+        self.eofs = EOFStore(
+            self.eofs_filestring, self.z_file, self.cache_dir, self.logger
+        )
+        neof = self.eofs.neof if dim_cvec is None else min(dim_cvec, self.eofs.neof)
+        self.neof = neof
+        self.neof_month = np.full(12, neof)
+        if explained_variance is not None:
+            self.neof_month = np.minimum(self.eofs.truncation(explained_variance), neof)
+            self.report_truncation(neof)
+        self.dim_cvec = int(self.neof_month.max())
+
+        # Time the operator against one with all EOFs at the first analysis
+        self._time_full = self.dim_cvec < neof
+        self.iterations = 0
+
+    def report_truncation(self, neof: int):
+        """Log the number of EOFs per month after truncation, and upper-bound
+        estimates of the reduction in cost relative to using all neof EOFs.
+        Only the control vector size, the largest number of EOFs of any
+        month, counts: months that need fewer get zeros for the remaining
+        EOFs, which does not save anything. The cost of cvt and cvt_adj is at
+        most proportional to the control vector size, and so is the maximum
+        number of iterations of a conjugate gradient minimizer. Measured
+        times of cvt and cvt_adj are logged at the first analysis."""
+        variance = self.eofs.explained_variance()
+        dim_cvec = int(self.neof_month.max())
+        self.logger.info(
+            f"Truncating EOFs to explain {self.explained_variance:.1%} of the variance"
+        )
+        for month, n in enumerate(self.neof_month, start=1):
+            self.logger.info(
+                f"  month {month:02d}: {n} of {neof} EOFs, explaining"
+                f" {variance[month - 1, n - 1]:.1%}"
+                f" (all {neof}: {variance[month - 1, neof - 1]:.1%})"
+            )
+        if dim_cvec == neof:
+            months = np.flatnonzero(self.neof_month == neof) + 1
+            self.logger.info(
+                f"No reduction: the control vector keeps all {neof} EOFs, as"
+                f" month(s) {', '.join(f'{m:02d}' for m in months)} need them all"
+            )
+            return
+        ratio = dim_cvec / neof
+        self.logger.info(f"Control vector size: {dim_cvec} instead of {neof}")
+        self.logger.info(
+            f"Upper-bound estimates of the saving: cost per cvt/cvt_adj call and"
+            f" maximum number of iterations down to {ratio:.0%}, cost of the"
+            f" minimization down to {ratio**2:.0%} of that with all EOFs"
+        )
+
+    def report_timings(self, state: np.ndarray):
+        """Log the measured time of cvt and cvt_adj with the truncated EOFs
+        and with all neof EOFs of the current month, for the given state."""
+        Vmat = self.eofs.load(self.variables["z"]["data"])[self.month - 1, : self.neof]
+        full = CvtOperator(self.variables, self.pvars, state, Vmat)
+        truncated = sum(time_operator(self.operator, number=100))
+        reference = sum(time_operator(full, number=100))
+        self.logger.info(
+            f"Measured cvt + cvt_adj: {truncated * 1e6:.1f} us with {self.dim_cvec}"
+            f" EOFs, {reference * 1e6:.1f} us with all {self.neof}"
+            f" ({truncated / reference:.0%})"
+        )
 
     def initialize(self, variables: MutableMapping[str, Any], ensemble_size: int):
         # Here you might add routines that read the square root of the error covariance matrix (Vmat_p) from file
@@ -35,8 +225,7 @@ class Chl(eatpy.pdaf.CvtHandler):
 
         self.nz = self.variables['z']['length']
             
-        self.logger.info('Reading z levels from file: {}'.format(self.z_file))
-        self.z_eof=np.loadtxt(self.z_file)
+        self.z_eof = self.eofs.z_eof
         self.nz_eof=self.z_eof.size
         
         # self.logger.info('Reading EOFs from file: {}'.format(self.eofs_file))
@@ -55,97 +244,42 @@ class Chl(eatpy.pdaf.CvtHandler):
         filter: eatpy.shared.Filter
         ):
         
+        self.iterations = 0
 
         if time.month!=self.month:
             self.month = time.month
+            self.logger.info(f"Using EOFs for month {self.month:02d}")
+            Vmat = self.eofs.load(self.variables["z"]["data"])
+            self.Vmat_p = Vmat[self.month - 1, : self.dim_cvec, :]
+            n = self.neof_month[self.month - 1]
+            if n < self.dim_cvec:
+                self.logger.info(f"Using {n} of {self.dim_cvec} EOFs")
+                self.Vmat_p = self.Vmat_p.copy()
+                self.Vmat_p[n:, :] = 0.0
 
-            self.eofs_file = f'{self.eofs_filestring}{self.month:02d}.txt'
-            # self.eofs_file = se initlf.eoffilestring + ('%02d' %self.month)
-            self.logger.info('Reading EOFs from file: {}'.format(self.eofs_file))
-            # eofs = readtxt(self.eofs_file, [self.dim_cvec, self.nz_eof])
-            eofs = np.loadtxt(self.eofs_file)
-            
-            #f = interpolate.interp1d(-self.z_eof[::-1],eofs[:,::-1],
-            #                        fill_value=(eofs[:,-1],eofs[:,0]),
-            #                        bounds_error=False,
-            #                        assume_sorted=True,
-            #                        copy=False,
-            #                        )
-
-            self.Vmat_p = np.zeros((self.dim_cvec,self.nz))
-            for ii in range(self.dim_cvec):
-                self.Vmat_p[ii,:] = np.interp(self.variables['z']["data"],-self.z_eof[::-1],eofs[ii,::-1])
-            # self.Vmat_p = readtxt(self.eofs_file, [self.dim_cvec, self.nz])
-            #self.Vmat_p = f(self.variables['z']["data"])
-            # self.logger.info('ANNAAAA Vmat_p shape: {}'.format(self.Vmat_p.shape))
-
+    def after_analysis(self, state: np.ndarray):
+        # Measured counterpart of the estimated iteration count in report_truncation
+        self.logger.info(
+            f"Minimization took {self.iterations} iterations with"
+            f" {self.dim_cvec} EOFs in the control vector"
+        )
 
     def cvt(self, iter: int, state: np.ndarray, v_p: np.ndarray) -> np.ndarray:
         """Forward covariance transformation for parameterized 3D-Var"""
         
-        #self.logger.info('cvt state shape: {}'.format(state.shape))
-        
-        # if True: #iter==1:
-        # self.logger.info(f'ANNA   !!!!! iter = {iter}')
+        # The background state is fixed during the minimization, so the
+        # operator is built only at the first iteration of each analysis.
         if iter==1:
-            # self.totchl=np.zeros(self.nz)
-            self.start = self.variables['total_chlorophyll']['start']
-            self.stop = self.start + self.variables['total_chlorophyll']['length']
-            self.totchl = state[self.start:self.stop]
-            # self.totchl = self.variables['total_chlorophyll']["data"]
-            
-        #if abs(iter)<10:    
-        #    self.logger.info('cvt: state = {}'.format(state[:10]))
-        #    self.logger.info('cvt: chl = {}'.format(self.totchl))
-            
+            self.operator = CvtOperator(self.variables, self.pvars, state, self.Vmat_p)
+            self.totchl = self.operator.totchl
+            if self._time_full:
+                self._time_full = False
+                self.report_timings(state)
+        self.iterations = max(self.iterations, iter)
         
-        #Vertical operator:
-        # self.logger.info('ANNAAAA v_p: {}'.format(v_p.shape))
-        Mv = np.matmul(v_p, self.Vmat_p)
-        
-        #Biogeochemical operator:
-        Vv_p=np.zeros([state.size])
-        Vv_p[self.start:self.stop] = Mv
-        for name in self.pvars:
-            start_p = self.variables[name]['start']
-            stop_p = start_p + self.variables[name]['length']
-            
-            MvOverChl=Mv/self.totchl
-            Vv_p[start_p:stop_p]=np.where(MvOverChl<-0.99, -0.99, MvOverChl)*state[start_p:stop_p]
-        
-        return Vv_p
+        return self.operator.cvt(v_p)
 
     def cvt_adj(self, iter: int, state: np.ndarray, Vv_p: np.ndarray) -> np.ndarray:
         """Adjoint covariance transformation for parameterized 3D-Var"""
         
-        #Biogeochemical operator:
-        Mv=np.zeros([self.nz])
-        for name in self.pvars:
-            start_p = self.variables[name]['start']
-            stop_p = start_p + self.variables[name]['length']
-            
-            Mv+=Vv_p[start_p:stop_p]*state[start_p:stop_p]
-            Mv/=self.totchl
-            
-        # if True: #iter==1:
-        #     self.totchl=np.zeros(self.nz)
-        #     start = self.variables['total_chlorophyll']['start']
-        #     stop = start + self.variables['total_chlorophyll']['length']
-        #     self.totchl = state[start:stop]
-            
-        #if abs(iter)<10:    
-        #    self.logger.info('cvt_adj: state = {}'.format(state[:10]))
-        #    self.logger.info('cvt_adj: chl = {}'.format(self.totchl))
-        
-        Mv+=Vv_p[self.start:self.stop]
-        
-        #Vertical operator:
-        v_p=np.matmul(self.Vmat_p, Mv)
-        
-        return v_p
-
- 
-
-    
-    
-
+        return self.operator.cvt_adj(Vv_p)
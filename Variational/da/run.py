@@ -1,8 +1,21 @@
+import argparse
 import datetime
 import os
+import sys
 import eatpy
 from myPlugins import ogs3dvar_base
 
+# Set EAT_PROFILE=1 to time the custom plugins (see profiling.py in the root)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+import profiling
+import checkpoint
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--resume", action="store_true", help="continue from the latest checkpoint"
+)
+args = parser.parse_args()
+
 
 # Variables for assimilation
 var = "total_chlorophyll"
@@ -17,20 +30,29 @@ start = datetime.datetime(2019, 1, 1)
 stop = datetime.datetime(2019, 12, 31)
 
 
+# Checkpoints every 10 analyses, including the EOFs in use by the 3D-Var plugin
+checkpoints = checkpoint.Checkpoint("checkpoints", every=10, resume=args.resume)
+chl = ogs3dvar_base.Chl()
+checkpoints.register("chl", chl, "month", "Vmat_p")
+
+
 # Set the simulation
 experiment = eatpy.models.GOTM(
     diagnostics_in_state=["total_chlorophyll"],
-    start=start,
+    start=checkpoints.start or start,
     stop=stop,
 )
 
 
 # Plugins
+## checkpoints (first, to save the complete state)
+experiment.add_plugin(checkpoints)
+
 ## select
 experiment.add_plugin(
     eatpy.plugins.select.Select(include=("P?_*", "total_chlorophyll", "z"))
 )
-experiment.add_plugin(ogs3dvar_base.Chl())
+experiment.add_plugin(profiling.wrap(chl))
 
 ## aft bef ouptut
 outfile = "DAout.nc"
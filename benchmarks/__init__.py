@@ -0,0 +1,28 @@
+"""Benchmarks for the post-processing in ``shared`` and the custom DA
+plugins of the example applications. See ``python -m benchmarks --help``."""
+
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directories with the modules under test
+PATHS = (
+    ROOT,
+    os.path.join(ROOT, "Parameters", "da"),
+    os.path.join(ROOT, "Variational", "da"),
+)
+
+
+def setup_paths() -> bool:
+    """Make the modules under test importable. If eatpy is not installed,
+    the stand-in in ``benchmarks/standin`` is used instead. Returns whether
+    the real eatpy is used."""
+    for path in PATHS:
+        if path not in sys.path:
+            sys.path.append(path)
+    if importlib.util.find_spec("eatpy") is not None:
+        return True
+    sys.path.append(os.path.join(os.path.dirname(__file__), "standin"))
+    return False
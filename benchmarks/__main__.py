@@ -0,0 +1,514 @@
+"""Time the readers, ensemble statistics and DA plugins on synthetic data.
+
+For each combination of ensemble size, number of times and number of
+levels, synthetic results are generated in a temporary directory and all
+selected scenarios are timed. Results are appended to a JSON lines file,
+and compared with the most recent earlier record for the same sizes:
+
+    python -m benchmarks --members 10 50 --levels 50 201
+    python -m benchmarks --select 'cvt*' --repeat 20
+"""
+
+import argparse
+import contextlib
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import timeit
+from typing import Callable, Iterable, Iterator, List, Mapping, Optional
+
+import numpy as np
+
+from . import ROOT, analysis, setup_paths, synthetic
+
+USE_EATPY = setup_paths()
+
+import shared  # noqa: E402
+
+DEFAULT_RECORD = os.path.join(os.path.dirname(__file__), "results.jsonl")
+
+# Registered scenarios: name -> context manager factory that receives the
+# benchmark configuration and yields the function to time. A ``note``
+# attribute of that function is shown and recorded with its timing.
+SCENARIOS = {}
+
+
+def scenario(name: str):
+    def register(fn):
+        SCENARIOS[name] = contextlib.contextmanager(fn)
+        return fn
+
+    return register
+
+
+class Config:
+    def __init__(self, directory: str, N: int, nt: int, nz: int, observations: int):
+        self.directory = directory
+        self.N = N
+        self.nt = nt
+        self.nz = nz
+        self.path = synthetic.write_ensemble(directory, N, nt, nz)
+        self.obs_path = os.path.join(directory, "chl.dat")
+        synthetic.write_observations(self.obs_path, observations)
+        self.eofs = synthetic.write_eofs(os.path.join(directory, "eofs"))
+
+
+def _layout(lengths: Mapping[str, int], N: int):
+    # State array (member, state) and eatpy-style variable info for it
+    state = np.empty((N, sum(lengths.values())))
+    variables = {}
+    start = 0
+    for name, length in lengths.items():
+        stop = start + length
+        variables[name] = dict(
+            start=start, length=length, stop=stop, data=state[:, start:stop]
+        )
+        start = stop
+    return state, variables
+
+
+def _uncached(read: Callable) -> Callable:
+    # Time reading from disk rather than the in-memory result cache
+    def call():
+        shared.result_cache.clear()
+        return read()
+
+    return call
+
+
+@scenario("read_result")
+def _(config: Config) -> Iterator[Callable]:
+    yield _uncached(lambda: shared.read_result(config.path, "temp"))
+
+
+@scenario("read_result_surface")
+def _(config: Config) -> Iterator[Callable]:
+    yield _uncached(lambda: shared.read_result(config.path, "temp", level=-1))
+
+
+@scenario("read_result_cached")
+def _(config: Config) -> Iterator[Callable]:
+    shared.read_result(config.path, "temp")
+    yield lambda: shared.read_result(config.path, "temp")
+
+
+@scenario("read_ensemble_results")
+def _(config: Config) -> Iterator[Callable]:
+    names = ["temp", "total_chlorophyll"]
+    yield _uncached(lambda: shared.read_ensemble_results(config.path, names, config.N))
+
+
+@scenario("read_ensemble_results_serial")
+def _(config: Config) -> Iterator[Callable]:
+    names = ["temp", "total_chlorophyll"]
+    yield _uncached(
+        lambda: shared.read_ensemble_results(
+            config.path, names, config.N, max_workers=1
+        )
+    )
+
+
+@scenario("read_ensemble_results_processes")
+def _(config: Config) -> Iterator[Callable]:
+    names = ["temp", "total_chlorophyll"]
+    yield _uncached(
+        lambda: shared.read_ensemble_results(
+            config.path, names, config.N, processes=True
+        )
+    )
+
+
+@scenario("read_ensemble_results_cached")
+def _(config: Config) -> Iterator[Callable]:
+    names = ["temp", "total_chlorophyll"]
+    shared.read_ensemble_results(config.path, names, config.N)
+    yield lambda: shared.read_ensemble_results(config.path, names, config.N)
+
+
+@scenario("read_ensemble_store")
+def _(config: Config) -> Iterator[Callable]:
+    store = shared.consolidate_ensemble(config.path, config.N)
+    names = ["temp", "total_chlorophyll"]
+    try:
+        yield _uncached(
+            lambda: shared.read_ensemble_results(config.path, names, config.N)
+        )
+    finally:
+        os.remove(store)
+
+
+@scenario("ensemble_statistics")
+def _(config: Config) -> Iterator[Callable]:
+    _, _, values, _, _ = shared.read_ensemble_result(config.path, "temp", config.N)
+    yield lambda: shared.ensemble_statistics(values)
+
+
+@scenario("stream_ensemble_statistics")
+def _(config: Config) -> Iterator[Callable]:
+    yield lambda: shared.stream_ensemble_statistics(config.path, "temp", config.N)
+
+
+@scenario("verify")
+def _(config: Config) -> Iterator[Callable]:
+    import verification
+
+    time, _, values, _, _ = shared.read_ensemble_result(
+        config.path, "total_chlorophyll", config.N, level=-1
+    )
+    obs = shared.read_0d_observations(config.obs_path)
+    yield lambda: verification.verify(
+        time, values, obs.time, obs.value, log10=True, obs_log10=True
+    ).scores()
+
+
+@scenario("generate_ensemble")
+def _(config: Config) -> Iterator[Callable]:
+    import ensemble
+
+    spec = os.path.join(ROOT, "Ensemble", "da_phys_bgc", "ensemble.yaml")
+    directory = os.path.join(config.directory, "ensemble")
+    os.makedirs(directory, exist_ok=True)
+
+    def generate():
+        # Remove the manifest so all member files are written
+        manifest = os.path.join(directory, ensemble.MANIFEST)
+        if os.path.isfile(manifest):
+            os.remove(manifest)
+        ensemble.generate(spec, config.N, np.random.default_rng(0), directory)
+
+    yield generate
+
+
+@scenario("generate_ensemble_unchanged")
+def _(config: Config) -> Iterator[Callable]:
+    import ensemble
+
+    spec = os.path.join(ROOT, "Ensemble", "da_phys_bgc", "ensemble.yaml")
+    directory = os.path.join(config.directory, "ensemble")
+    os.makedirs(directory, exist_ok=True)
+    ensemble.generate(spec, config.N, np.random.default_rng(0), directory)
+    yield lambda: ensemble.generate(spec, config.N, np.random.default_rng(0), directory)
+
+
+@scenario("parse_0d_observations")
+def _(config: Config) -> Iterator[Callable]:
+    yield lambda: shared.parse_0d_observations(config.obs_path)
+
+
+@scenario("read_0d_observations")
+def _(config: Config) -> Iterator[Callable]:
+    shared.read_0d_observations(config.obs_path)
+    yield lambda: shared.read_0d_observations(config.obs_path)
+
+
+@scenario("spread_control")
+def _(config: Config) -> Iterator[Callable]:
+    # before_analysis and after_analysis of the Parameters plugin. The
+    # state is restored before every call, which is included in the time.
+    import control_DA
+
+    lengths = {"temp": config.nz, "salt": config.nz}
+    lengths.update({name: config.nz for name in control_DA.kept_vars})
+    lengths["instances_P1_parameters_sum"] = 1
+    state, variables = _layout(lengths, config.N)
+    rng = np.random.default_rng(0)
+    state[...] = rng.normal(0.5, 0.3, state.shape)
+    variables["instances_P1_parameters_sum"]["data"][...] = rng.normal(
+        0.05, 0.001, (config.N, 1)
+    )
+    original = state.copy()
+    plugin = control_DA.SpreadControl()
+    plugin.initialize(variables, config.N)
+    time = datetime.datetime(2020, 1, 1)
+    iobs = np.array([variables["P1_Chl"]["stop"] - 1])
+    obs, obs_sds = np.array([0.3]), np.array([0.1])
+
+    def run():
+        np.copyto(state, original)
+        plugin.before_analysis(time, state, iobs, obs, obs_sds, None)
+        plugin.after_analysis(state)
+
+    yield run
+
+
+def _chl_plugin(config: Config):
+    from myPlugins import ogs3dvar_base
+
+    pvars = [f"P{i}_{c}" for i in range(1, 5) for c in ("c", "n", "p", "Chl", "s")]
+    lengths = {"z": config.nz, "total_chlorophyll": config.nz}
+    lengths.update({name: config.nz for name in pvars})
+    state, variables = _layout(lengths, 1)
+    state[...] = np.random.default_rng(0).uniform(0.01, 1.0, state.shape)
+    variables["z"]["data"][...] = np.linspace(-200.0, 0.0, config.nz)
+    plugin = ogs3dvar_base.Chl(
+        eofs_filestring=config.eofs,
+        z_file=os.path.join(os.path.dirname(config.eofs), "z.txt"),
+    )
+    plugin.initialize(variables, 1)
+    return plugin, state
+
+
+@scenario("chl_before_analysis")
+def _(config: Config) -> Iterator[Callable]:
+    # Month change in the 3D-Var plugin, with interpolated EOFs cached
+    plugin, state = _chl_plugin(config)
+    times = [datetime.datetime(2020, 1, 1), datetime.datetime(2020, 2, 1)]
+
+    def run():
+        for time in times:
+            plugin.before_analysis(time, state, None, None, None, None)
+
+    yield run
+
+
+@scenario("eof_interpolation")
+def _(config: Config) -> Iterator[Callable]:
+    plugin, state = _chl_plugin(config)
+    z = plugin.variables["z"]["data"].ravel()
+    yield lambda: plugin.eofs._interpolate(z)
+
+
+@scenario("cvt_setup")
+def _(config: Config) -> Iterator[Callable]:
+    plugin, state = _chl_plugin(config)
+    plugin.before_analysis(datetime.datetime(2020, 1, 1), state, None, None, None, None)
+    v_p = np.random.default_rng(1).standard_normal(plugin.Vmat_p.shape[0])
+    yield lambda: plugin.cvt(1, state[0], v_p)
+
+
+@scenario("cvt")
+def _(config: Config) -> Iterator[Callable]:
+    plugin, state = _chl_plugin(config)
+    plugin.before_analysis(datetime.datetime(2020, 1, 1), state, None, None, None, None)
+    v_p = np.random.default_rng(1).standard_normal(plugin.Vmat_p.shape[0])
+    plugin.cvt(1, state[0], v_p)
+    yield lambda: plugin.cvt(2, state[0], v_p)
+
+
+@scenario("cvt_adj")
+def _(config: Config) -> Iterator[Callable]:
+    plugin, state = _chl_plugin(config)
+    plugin.before_analysis(datetime.datetime(2020, 1, 1), state, None, None, None, None)
+    v_p = np.random.default_rng(1).standard_normal(plugin.Vmat_p.shape[0])
+    Vv_p = plugin.cvt(1, state[0], v_p).copy()
+    yield lambda: plugin.cvt_adj(2, state[0], Vv_p)
+
+
+def _column_state(config: Config):
+    # State of the Ensemble/da_bgc experiment: physics, chlorophyll and 20
+    # biogeochemical profiles, with a surface chlorophyll observation
+    lengths = {"temp": config.nz, "salt": config.nz, "total_chlorophyll": config.nz}
+    lengths.update({f"bgc{i:02}_c": config.nz for i in range(20)})
+    state, variables = _layout(lengths, config.N)
+    state[...] = np.random.default_rng(0).normal(0.5, 0.1, state.shape)
+    return state, variables
+
+
+@scenario("analysis_full_column")
+def _(config: Config) -> Iterator[Callable]:
+    # Analysis of all levels and variables, for comparison with
+    # analysis_localized. The state is restored before every call.
+    state, variables = _column_state(config)
+    original = state.copy()
+    update = analysis.compact_analysis(state, variables)
+    iobs = np.array([analysis.observation_index(variables, "total_chlorophyll[-1]")])
+    obs, obs_sds = np.array([0.6]), np.array([0.05])
+
+    def run():
+        np.copyto(state, original)
+        update(iobs, obs, obs_sds)
+
+    yield run
+
+
+@scenario("analysis_localized")
+def _(config: Config) -> Iterator[Callable]:
+    # As analysis_full_column, but with the Localization plugin limiting
+    # the update to chlorophyll and biogeochemistry in the upper 40 m of a
+    # 100 m column. The surface chlorophyll analysis, which is not tapered,
+    # must match that of analysis_full_column; the difference is reported.
+    import localization
+
+    state, variables = _column_state(config)
+    original = state.copy()
+    surface = variables["total_chlorophyll"]["stop"] - 1
+    obs, obs_sds = np.array([0.6]), np.array([0.05])
+    analysis.etkf(state, np.array([surface]), obs, obs_sds)
+    reference = state[:, surface].copy()
+
+    bgc = [name for name in variables if name not in ("temp", "salt")]
+    depth = (np.arange(config.nz, 0, -1) - 0.5) * 100.0 / config.nz
+    plugin = localization.Localization(
+        depth, {"total_chlorophyll[-1]": localization.Taper(20.0, bgc)}
+    )
+    plugin.initialize(variables, config.N)
+    update = analysis.compact_analysis(state, variables)
+    iobs = np.array([analysis.observation_index(variables, "total_chlorophyll[-1]")])
+    time = datetime.datetime(2020, 1, 1)
+
+    def run():
+        np.copyto(state, original)
+        plugin.before_analysis(time, state, iobs, obs, obs_sds, None)
+        update(iobs, obs, obs_sds)
+        plugin.after_analysis(state)
+
+    run()
+    difference = float(np.abs(state[:, surface] - reference).max())
+    assert difference < 1e-10, f"surface analysis differs by {difference}"
+    run.note = f"surface chl vs full column: {difference:.1e}"
+    yield run
+
+
+def time_scenario(fn: Callable, repeat: int, min_time: float = 0.2) -> List[float]:
+    """Time ``fn`` like timeit: calls are grouped in loops that take at
+    least ``min_time`` seconds. Returns the time per call for each loop."""
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(1, int(number * min_time / elapsed))
+    return [t / number for t in timer.repeat(repeat, number)]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous(record: str, sizes: Mapping[str, int]) -> Optional[Mapping]:
+    # Most recent recorded run with the same sizes
+    if not os.path.isfile(record):
+        return None
+    previous = None
+    with open(record) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["sizes"] == sizes:
+                previous = entry
+    return previous
+
+
+def run(
+    sizes: Mapping[str, int],
+    names: Iterable[str],
+    repeat: int,
+    observations: int,
+    workdir: Optional[str] = None,
+) -> Mapping:
+    directory = tempfile.mkdtemp(prefix="eat-benchmark-", dir=workdir)
+    try:
+        print(f"Generating synthetic data in {directory}...", flush=True)
+        config = Config(directory, observations=observations, **sizes)
+        timings = {}
+        for name in names:
+            with SCENARIOS[name](config) as fn:
+                times = time_scenario(fn, repeat)
+            timings[name] = dict(best=min(times), median=float(np.median(times)))
+            if hasattr(fn, "note"):
+                timings[name]["note"] = fn.note
+    finally:
+        shutil.rmtree(directory)
+    return timings
+
+
+def _format(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def main(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument(
+        "--members", type=int, nargs="+", default=[10], help="ensemble sizes"
+    )
+    parser.add_argument(
+        "--times", type=int, nargs="+", default=[8760], help="numbers of times"
+    )
+    parser.add_argument(
+        "--levels", type=int, nargs="+", default=[201], help="numbers of layers"
+    )
+    parser.add_argument(
+        "--observations", type=int, default=365, help="number of observations"
+    )
+    parser.add_argument(
+        "--select",
+        nargs="+",
+        default=["*"],
+        help="names or patterns of scenarios to run (default: all)",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats")
+    parser.add_argument(
+        "--record",
+        default=DEFAULT_RECORD,
+        help="JSON lines file to append results to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-record", action="store_true", help="do not save the results"
+    )
+    parser.add_argument("--workdir", help="directory for the synthetic data")
+    parser.add_argument("--list", action="store_true", help="list scenarios and exit")
+    args = parser.parse_args(args)
+
+    if args.list:
+        print("\n".join(SCENARIOS))
+        return
+    names = [
+        name
+        for name in SCENARIOS
+        if any(fnmatch.fnmatch(name, pattern) for pattern in args.select)
+    ]
+    if not names:
+        parser.error(f"No scenarios match {' '.join(args.select)}")
+
+    metadata = dict(
+        date=datetime.datetime.now().isoformat(timespec="seconds"),
+        commit=_git_commit(),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+        eatpy="installed" if USE_EATPY else "standin",
+    )
+    for N in args.members:
+        for nt in args.times:
+            for nz in args.levels:
+                sizes = dict(N=N, nt=nt, nz=nz)
+                print(f"N={N} nt={nt} nz={nz}")
+                previous = _previous(args.record, sizes)
+                timings = run(
+                    sizes, names, args.repeat, args.observations, args.workdir
+                )
+                for name, timing in timings.items():
+                    line = f"  {name:<30} {_format(timing['best']):>10}"
+                    if previous is not None and name in previous["timings"]:
+                        ratio = timing["best"] / previous["timings"][name]["best"]
+                        line += f"  x{ratio:.2f} vs {previous['commit']}"
+                    if "note" in timing:
+                        line += f"  ({timing['note']})"
+                    print(line)
+                if not args.no_record:
+                    with open(args.record, "a") as f:
+                        entry = dict(metadata, sizes=sizes, timings=timings)
+                        f.write(json.dumps(entry) + "\n")
+
+
+if __name__ == "__main__":
+    main()
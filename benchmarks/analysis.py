@@ -0,0 +1,66 @@
+"""A stand-in for the analysis cycle of eatpy with PDAF, to time and test
+plugins that change the part of the state the filter sees.
+
+Plugins receive the complete model state, in which each variable occupies
+columns ``start:stop`` of its entry in ``variables``. The filter works on a
+compact copy of the variables that remain after all plugins initialized,
+in the order of ``variables``, and observations are indexed in that compact
+state (``iobs``).
+"""
+
+import re
+from typing import Callable, Mapping
+
+import numpy as np
+
+
+def observation_index(variables: Mapping[str, Mapping], key: str) -> int:
+    """Index in the compact state of an observed variable and level such as
+    ``temp[-1]``, determined from ``variables`` as eatpy does: the level is
+    counted within the (possibly trimmed) variable"""
+    match = re.fullmatch(r"(\w+)(?:\[(-?\d+)\])?", key)
+    if match is None:
+        raise ValueError(f"Invalid observed variable {key!r}")
+    name, level = match.group(1), int(match.group(2) or 0)
+    offset = 0
+    for other, info in variables.items():
+        if other == name:
+            return offset + range(info["length"])[level]
+        offset += info["length"]
+    raise KeyError(f"Observed variable {name} is not part of the state.")
+
+
+def etkf(state: np.ndarray, iobs: np.ndarray, obs: np.ndarray, obs_sds: np.ndarray):
+    """Ensemble transform Kalman filter analysis of the state (member, state)
+    in place: a stand-in for the ESTKF of PDAF with the same O(N² n) cost"""
+    N = state.shape[0]
+    mean = state.mean(axis=0)
+    perturbations = state - mean
+    HA = perturbations[:, iobs]
+    C = HA / obs_sds**2
+    s, U = np.linalg.eigh((N - 1) * np.eye(N) + C @ HA.T)
+    w = U @ ((U.T @ (C @ (obs - mean[iobs]))) / s)
+    W = (U * np.sqrt((N - 1) / s)) @ U.T
+    np.matmul((W + w[:, np.newaxis]).T, perturbations, out=state)
+    state += mean
+
+
+def compact_analysis(state: np.ndarray, variables: Mapping[str, Mapping]) -> Callable:
+    """Analysis of the variables left by the plugins: they are copied to a
+    compact state for the filter and back, as eatpy does. The returned
+    function takes iobs, obs and obs_sds."""
+    compact = np.empty((state.shape[0], sum(v["length"] for v in variables.values())))
+    copies, offset = [], 0
+    for info in variables.values():
+        stop = offset + info["length"]
+        copies.append((slice(info["start"], info["stop"]), slice(offset, stop)))
+        offset = stop
+
+    def analysis(iobs: np.ndarray, obs: np.ndarray, obs_sds: np.ndarray):
+        for source, target in copies:
+            compact[:, target] = state[:, source]
+        etkf(compact, iobs, obs, obs_sds)
+        for source, target in copies:
+            state[:, source] = compact[:, target]
+
+    return analysis
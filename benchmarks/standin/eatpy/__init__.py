@@ -0,0 +1,10 @@
+"""Minimal stand-in for the parts of eatpy that the plugins in this
+repository use. It is put on the import path by ``benchmarks`` only if the
+real eatpy is not installed, so plugins can be timed outside an EAT
+environment. It does not run models or filters."""
+
+from . import shared
+from . import filter
+from . import pdaf
+
+__version__ = "standin"
@@ -0,0 +1 @@
+from .shared import Filter
@@ -0,0 +1,20 @@
+from typing import Optional
+
+import numpy as np
+
+from . import shared
+
+
+class CvtHandler(shared.Plugin):
+    def __init__(
+        self, dim_cvec: Optional[int] = None, dim_cvec_ens: Optional[int] = None
+    ):
+        super().__init__()
+        self.dim_cvec = dim_cvec
+        self.dim_cvec_ens = dim_cvec_ens
+
+    def cvt(self, iter: int, state: np.ndarray, v_p: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def cvt_adj(self, iter: int, state: np.ndarray, Vv_p: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
@@ -0,0 +1,34 @@
+import datetime
+import logging
+from typing import Any, MutableMapping, Optional
+
+import numpy as np
+
+
+class Filter:
+    pass
+
+
+class Plugin:
+    def __init__(self, name: Optional[str] = None):
+        self.logger = logging.getLogger(name or self.__class__.__name__)
+
+    def initialize(self, variables: MutableMapping[str, Any], ensemble_size: int):
+        pass
+
+    def before_analysis(
+        self,
+        time: datetime.datetime,
+        state: np.ndarray,
+        iobs: np.ndarray,
+        obs: np.ndarray,
+        obs_sds: np.ndarray,
+        filter: Filter,
+    ):
+        pass
+
+    def after_analysis(self, state: np.ndarray):
+        pass
+
+    def finalize(self):
+        pass
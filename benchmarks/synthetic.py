@@ -0,0 +1,173 @@
+"""Synthetic GOTM-like results, observations and EOFs for benchmarking.
+
+The files written here have the layout of the real inputs of the example
+applications (NetCDF result files with dimensions time, z, lat and lon,
+and the tab-separated observation files), but their size is configurable,
+so the post-processing and plugins can be timed for any ensemble size and
+depth resolution without running GOTM:
+
+    python -m benchmarks.synthetic OUTDIR --members 20 --times 8760 --levels 201
+"""
+
+import argparse
+import datetime
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+import netCDF4
+
+# Variables written to every result file: name -> (long name, units)
+PROFILE_VARIABLES = {
+    "temp": ("temperature", "Celsius"),
+    "salt": ("salinity", "PSU"),
+    "total_chlorophyll": ("total chlorophyll", "mg/m^3"),
+    "P1_Chl": ("diatoms chlorophyll", "mg/m^3"),
+}
+SURFACE_VARIABLES = {
+    "sst": ("sea surface temperature", "Celsius"),
+}
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def _profiles(rng: np.random.Generator, nt: int, nz: int):
+    # Seasonal cycle, vertical structure and member-specific noise, in the
+    # range of the real Ensemble results
+    season = np.sin(2 * np.pi * np.arange(nt) / min(nt, 8760))[:, np.newaxis]
+    surface = np.linspace(0.0, 1.0, nz)[np.newaxis, :]
+    temp = 10.0 + 5.0 * season * surface + 8.0 * surface
+    temp += rng.normal(scale=0.2, size=(nt, nz))
+    salt = 35.0 - 0.5 * surface + rng.normal(scale=0.01, size=(nt, nz))
+    chl = 10.0 ** (
+        -0.5 + 0.3 * season - (1.0 - surface) ** 2 + rng.normal(0, 0.1, (nt, nz))
+    )
+    return {
+        "temp": temp,
+        "salt": salt,
+        "total_chlorophyll": chl,
+        "P1_Chl": 0.4 * chl,
+    }
+
+
+def write_result(
+    path: str,
+    nt: int = 8760,
+    nz: int = 201,
+    depth: float = 200.0,
+    dt: float = 3600.0,
+    seed: Optional[int] = None,
+):
+    """Write a GOTM-like result file with ``nt`` times ``dt`` seconds apart
+    and ``nz`` layers evenly distributed over ``depth`` m."""
+    rng = np.random.default_rng(seed)
+    zi = np.linspace(-depth, 0.0, nz + 1)
+    z = 0.5 * (zi[1:] + zi[:-1])
+    with netCDF4.Dataset(path, "w") as nc:
+        nc.createDimension("time", None)
+        nc.createDimension("z", nz)
+        nc.createDimension("zi", nz + 1)
+        nc.createDimension("lat", 1)
+        nc.createDimension("lon", 1)
+        ncvar = nc.createVariable("time", "f8", ("time",))
+        ncvar.units = f"seconds since {START:%Y-%m-%d %H:%M:%S}"
+        ncvar[:] = np.arange(nt) * dt
+        for name, values in (("z", z), ("zi", zi)):
+            ncvar = nc.createVariable(name, "f4", ("time", name, "lat", "lon"))
+            ncvar.long_name = "depth"
+            ncvar.units = "m"
+            ncvar[:] = np.broadcast_to(values[:, None, None], (nt, values.size, 1, 1))
+        profiles = _profiles(rng, nt, nz)
+        for name, (long_name, units) in PROFILE_VARIABLES.items():
+            ncvar = nc.createVariable(name, "f4", ("time", "z", "lat", "lon"))
+            ncvar.long_name = long_name
+            ncvar.units = units
+            ncvar[:] = profiles[name][:, :, None, None]
+        for name, (long_name, units) in SURFACE_VARIABLES.items():
+            ncvar = nc.createVariable(name, "f4", ("time", "lat", "lon"))
+            ncvar.long_name = long_name
+            ncvar.units = units
+            ncvar[:] = profiles["temp"][:, -1, None, None]
+
+
+def write_ensemble(
+    directory: str,
+    N: int,
+    nt: int = 8760,
+    nz: int = 201,
+    seed: int = 0,
+    name: str = "result.nc",
+    **kwargs,
+) -> str:
+    """Write a reference result and ``N`` member results (result_0001.nc,
+    ...) to ``directory``. Returns the path of the reference result, as
+    expected by the readers in ``shared``."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    pathname, pathext = os.path.splitext(path)
+    seeds = np.random.SeedSequence(seed).spawn(N + 1)
+    write_result(path, nt, nz, seed=seeds[0], **kwargs)
+    for i in range(1, N + 1):
+        write_result(f"{pathname}_{i:04}{pathext}", nt, nz, seed=seeds[i], **kwargs)
+    return path
+
+
+def write_observations(
+    path: str,
+    n: int,
+    interval: datetime.timedelta = datetime.timedelta(days=1),
+    log10: bool = True,
+    seed: int = 0,
+):
+    """Write ``n`` surface chlorophyll observations in the format read by
+    ``experiment.add_observations`` and ``shared.read_0d_observations``."""
+    rng = np.random.default_rng(seed)
+    times = np.datetime64(START, "s") + np.arange(n) * np.timedelta64(interval)
+    values = -0.4 + 0.3 * np.sin(np.linspace(0.0, 2 * np.pi, n))
+    values += rng.normal(scale=0.1, size=n)
+    sds = rng.uniform(0.25, 0.35, size=n)
+    if not log10:
+        values = 10.0**values
+        sds = 0.3 * values
+    with open(path, "w") as f:
+        f.write("#time\tchlorophyll\tsd\n")
+        for time, value, sd in zip(times, values, sds):
+            f.write(f"{str(time).replace('T', ' ')}\t{value:.3f}\t{sd:.3f}\n")
+
+
+def write_eofs(
+    directory: str, neof: int = 26, nz_eof: int = 40, depth: float = 200.0
+) -> str:
+    """Write monthly EOF files eof.01.txt to eof.12.txt and z.txt in the
+    layout used by the Variational example. Returns the EOF file prefix."""
+    os.makedirs(directory, exist_ok=True)
+    z_eof = np.linspace(0.5, depth, nz_eof)
+    np.savetxt(os.path.join(directory, "z.txt"), z_eof)
+    rng = np.random.default_rng(0)
+    for month in range(1, 13):
+        eofs = 0.05 * rng.standard_normal((neof, nz_eof))
+        eofs *= np.exp(-z_eof / 50.0)
+        np.savetxt(os.path.join(directory, f"eof.{month:02d}.txt"), eofs)
+    return os.path.join(directory, "eof.")
+
+
+def main(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("outdir", help="directory to write the files to")
+    parser.add_argument("--members", type=int, default=10, help="ensemble size")
+    parser.add_argument("--times", type=int, default=8760, help="number of times")
+    parser.add_argument("--levels", type=int, default=201, help="number of layers")
+    parser.add_argument(
+        "--observations", type=int, default=365, help="number of observations"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args(args)
+    write_ensemble(args.outdir, args.members, args.times, args.levels, args.seed)
+    write_observations(
+        os.path.join(args.outdir, "chl.dat"), args.observations, seed=args.seed
+    )
+    write_eofs(os.path.join(args.outdir, "eofs"))
+
+
+if __name__ == "__main__":
+    main()
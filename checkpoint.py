@@ -0,0 +1,249 @@
+"""Checkpoints of data assimilation runs, to resume them after a failure.
+
+Add the plugin first, so that it sees the complete state before other
+plugins select or transform variables, e.g., in ``run.py``::
+
+    checkpoints = checkpoint.Checkpoint("checkpoints", every=10, resume=args.resume)
+    chl = ogs3dvar_base.Chl()
+    checkpoints.register("chl", chl, "month", "Vmat_p")
+    experiment = eatpy.models.GOTM(start=checkpoints.start or start, ...)
+    experiment.add_plugin(checkpoints)
+    experiment.add_plugin(chl)
+
+Every ``every`` analyses, the ensemble state before the analysis is saved,
+together with the registered attributes of other plugins (their values
+before the analysis too). Only the copy of the state is made during the
+analysis cycle; the checkpoint is written to disk in a background thread.
+The most recent ``keep`` checkpoints are kept.
+
+To resume, the models are started at the time of the latest checkpoint. At
+the first analysis, the state and plugin attributes are restored from the
+latest checkpoint at or before its time, and the analysis is repeated. A
+checkpoint up to ``tolerance`` after the analysis is accepted too. If the
+analysis is more than ``tolerance`` after the checkpoint, a warning is
+logged, as the restored state is older than the models' clock. Analyses
+before all checkpoints leave the state unchanged.
+
+A resumed run is not bitwise identical to an uninterrupted one. GOTM
+restart files are written only at the end of a model run, not by this
+plugin, so model variables that are not part of the state (e.g.,
+turbulence quantities) start again from the initial conditions in
+gotm.yaml. Add variables to the state to carry them over.
+
+The models write their output files anew from the time of the checkpoint.
+Files matching ``outputs`` are therefore renamed when the plugin is created
+with resume=True, e.g., result_0001.nc to
+result_0001.before_20200315000000.nc (named after the checkpoint), and hold
+the output of the interrupted run up to the failure. Create the plugin
+before the model (eatpy.models.GOTM), as above, so that this happens before
+the models open their output.
+"""
+
+import concurrent.futures
+import datetime
+import glob
+import os
+import pickle
+from typing import Any, Iterable, List, Mapping, MutableMapping, Optional, Tuple
+
+import numpy as np
+import eatpy.shared
+
+_PATTERN = "checkpoint_*.pkl"
+_FORMAT = "%Y%m%d%H%M%S"
+
+
+def _path(directory: str, time: datetime.datetime) -> str:
+    return os.path.join(directory, f"checkpoint_{time:{_FORMAT}}.pkl")
+
+
+def _time(path: str) -> datetime.datetime:
+    # Time of a checkpoint, from its file name
+    stamp = os.path.basename(path)[len("checkpoint_") : -len(".pkl")]
+    return datetime.datetime.strptime(stamp, _FORMAT)
+
+
+def checkpoints(directory: str) -> List[str]:
+    """Paths of all checkpoints in ``directory``, oldest first"""
+    return sorted(glob.glob(os.path.join(directory, _PATTERN)))
+
+
+def load(path: str) -> Mapping[str, Any]:
+    """Read a checkpoint: a dictionary with time, ensemble state, variable
+    layout (name -> (start, length)) and plugin attributes"""
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def archive_outputs(
+    time: datetime.datetime, patterns: Iterable[str] = ("result*.nc",)
+) -> List[str]:
+    """Rename output files matching ``patterns`` so that a run resumed from
+    the checkpoint at ``time`` does not overwrite them: <name>.nc becomes
+    <name>.before_<time>.nc, with a counter added if that exists already.
+    Files archived earlier are left alone. Returns the new paths."""
+    label = f".before_{time:{_FORMAT}}"
+    archived = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            stem, ext = os.path.splitext(path)
+            if ".before_" in os.path.basename(stem):
+                continue
+            target, n = f"{stem}{label}{ext}", 1
+            while os.path.lexists(target):
+                target, n = f"{stem}{label}.{n}{ext}", n + 1
+            os.rename(path, target)
+            archived.append(target)
+    return archived
+
+
+def _write(path: str, contents: Mapping[str, Any], keep: int):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(contents, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    for old in checkpoints(os.path.dirname(path))[:-keep]:
+        os.remove(old)
+
+
+class Checkpoint(eatpy.shared.Plugin):
+    """Periodically save the ensemble state and registered plugin attributes,
+    and restore them when resuming a run."""
+
+    def __init__(
+        self,
+        directory: str = "checkpoints",
+        every: int = 1,
+        keep: int = 2,
+        resume: bool = False,
+        tolerance: datetime.timedelta = datetime.timedelta(minutes=1),
+        outputs: Iterable[str] = ("result*.nc",),
+    ):
+        super().__init__()
+        if every < 1 or keep < 1:
+            raise ValueError("every and keep must be at least 1.")
+        self.directory = directory
+        self.every = every
+        self.keep = keep
+        self.tolerance = tolerance
+        self.registered: MutableMapping[str, Tuple[Any, Tuple[str, ...]]] = {}
+        self.analyses = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._pending: Optional[concurrent.futures.Future] = None
+        self._buffers: List[np.ndarray] = []
+
+        # Checkpoints to resume from; the latest is loaded to start the
+        # models at its time and check its layout
+        self.restart = None
+        self._resume_from: List[str] = []
+        if resume:
+            self._resume_from = checkpoints(directory)
+            if not self._resume_from:
+                raise FileNotFoundError(f"No checkpoints found in {directory}.")
+            self.restart = load(self._resume_from[-1])
+            self.logger.info(f"Resuming from {self._resume_from[-1]}")
+            for path in archive_outputs(self.restart["time"], outputs):
+                self.logger.info(f"Output of the interrupted run kept as {path}")
+
+    @property
+    def start(self) -> Optional[datetime.datetime]:
+        """Time to start the models at when resuming, otherwise None"""
+        return None if self.restart is None else self.restart["time"]
+
+    def register(self, name: str, obj: Any, *attributes: str):
+        """Include attributes of ``obj`` (e.g., another plugin) in
+        checkpoints. ``name`` identifies the object in the checkpoint.
+        Register the plugin itself rather than a wrapper around it."""
+        self.registered[name] = (obj, attributes)
+
+    def initialize(self, variables: MutableMapping[str, Any], ensemble_size: int):
+        os.makedirs(self.directory, exist_ok=True)
+        self.layout = {
+            name: (info["start"], info["length"]) for name, info in variables.items()
+        }
+        self.ensemble_size = ensemble_size
+        if self.restart is not None:
+            self._check(self.restart)
+
+    def _check(self, restart: Mapping[str, Any]):
+        if (
+            restart["layout"] != self.layout
+            or restart["state"].shape[0] != self.ensemble_size
+        ):
+            raise ValueError(
+                "The state in the checkpoint does not match that of this run."
+                " Did the configuration or ensemble size change?"
+            )
+
+    def before_analysis(
+        self,
+        time: datetime.datetime,
+        state: np.ndarray,
+        iobs: np.ndarray,
+        obs: np.ndarray,
+        obs_sds: np.ndarray,
+        filter: eatpy.shared.Filter,
+    ):
+        if self.restart is not None:
+            self._restore(time, state)
+            return
+        self.analyses += 1
+        if self.analyses % self.every == 0:
+            self._save(time, state)
+
+    def _restore(self, time: datetime.datetime, state: np.ndarray):
+        # Restore the latest checkpoint at or before the analysis, allowing
+        # for analysis times that differ slightly from the checkpoint's
+        paths = [p for p in self._resume_from if _time(p) <= time + self.tolerance]
+        if not paths:
+            self.logger.info(
+                f"Analysis at {time} precedes all checkpoints; state not restored"
+            )
+            return
+        restart = self.restart
+        if restart["time"] != _time(paths[-1]):
+            restart = load(paths[-1])
+            self._check(restart)
+        self.restart, self._resume_from = None, []
+        if time - restart["time"] > self.tolerance:
+            self.logger.warning(
+                f"No checkpoint at the analysis at {time}; restoring the state of"
+                f" {restart['time']}, the latest before it"
+            )
+        state[...] = restart["state"]
+        for name, values in restart["plugins"].items():
+            obj, _ = self.registered[name]
+            for attribute, value in values.items():
+                setattr(obj, attribute, value)
+        self.logger.info(f"Restored state and plugin attributes of {restart['time']}")
+
+    def _save(self, time: datetime.datetime, state: np.ndarray):
+        # Copy the state into a buffer not used by the write in progress,
+        # and take plugin attributes by value, as both change after this call
+        if not self._buffers:
+            self._buffers = [np.empty_like(state), np.empty_like(state)]
+        buffer = self._buffers[self.analyses // self.every % 2]
+        np.copyto(buffer, state)
+        plugins = pickle.loads(
+            pickle.dumps(
+                {
+                    name: {a: getattr(obj, a) for a in attributes}
+                    for name, (obj, attributes) in self.registered.items()
+                }
+            )
+        )
+        contents = dict(time=time, layout=self.layout, state=buffer, plugins=plugins)
+        self._wait()
+        self._pending = self._executor.submit(
+            _write, _path(self.directory, time), contents, self.keep
+        )
+
+    def _wait(self):
+        # Wait for the previous checkpoint to be written; raises write errors
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def finalize(self):
+        self._wait()
+        self._executor.shutdown()
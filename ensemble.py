@@ -0,0 +1,425 @@
+"""Create ensemble configurations from a specification of perturbations.
+
+The specification is a YAML file that names the template configurations
+and the perturbations to apply to them, e.g.:
+
+    files:
+      gotm.yaml: ../reference/gotm.yaml
+      fabm.yaml:
+        template: ../reference/fabm.yaml
+        referenced_by: gotm.yaml:fabm/yaml_file
+    perturbations:
+    - file: gotm.yaml
+      key: surface/u10/scale_factor
+      distribution: lognormal
+      parameters: {mean: 0.0, sigma: 0.2}
+    - file: fabm.yaml
+      key: instances/phy/parameters/mumax0
+      distribution: uniform
+      parameters: {low: 0.7, high: 1.3}
+      mode: multiplicative
+
+Template paths are relative to the specification. The distribution can be
+any method of numpy.random.Generator, called with the given parameters. By
+default, the drawn value replaces the setting (mode: absolute); with mode:
+multiplicative, the template value is multiplied by it. Values are drawn
+for all members at once, one perturbation at a time in the order listed,
+so a given random seed always produces the same ensemble.
+
+For each perturbed file, member configurations are written as
+<name>_0001.yaml, etc. These keep the text of the template, including
+comments and formatting, and differ from it only in the perturbed values.
+Settings missing from the template are added at the end of their section. If another file references it (referenced_by), that
+file gets one configuration per member too, pointing to the member's file.
+Unperturbed files are linked into the directory rather than copied.
+Member files whose content would not change are not written again, which
+keeps their modification time, so cached results remain valid.
+
+Usage, e.g., from an experiment directory:
+
+    python ../../ensemble.py ensemble.yaml -N 20
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import shutil
+from typing import Any, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+import numpy as np
+import yaml
+
+import shared
+
+MODES = ("absolute", "multiplicative")
+
+# Written to the output directory to record the member files and the
+# hash of the inputs they were generated from
+MANIFEST = ".ensemble.json"
+
+# Part of the hash of member files; increase when their rendering changes
+RENDERING = 2
+
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# Setting of a single member file: key, value and whether to multiply
+_Override = Tuple[str, Any, bool]
+
+
+class Perturbation(NamedTuple):
+    file: str
+    key: str
+    distribution: str
+    parameters: Mapping[str, Any]
+    mode: str = "absolute"
+
+
+class Spec(NamedTuple):
+    """Parsed specification: template path and referring setting (or None)
+    of each file, and the perturbations in order"""
+
+    files: Mapping[str, Tuple[str, Optional[Tuple[str, str]]]]
+    perturbations: List[Perturbation]
+
+    @classmethod
+    def load(cls, path: str) -> "Spec":
+        with open(path) as f:
+            document = yaml.safe_load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        files = {}
+        for name, entry in document.get("files", {}).items():
+            if isinstance(entry, str):
+                entry = dict(template=entry)
+            referenced_by = entry.get("referenced_by")
+            if referenced_by is not None:
+                referenced_by = tuple(referenced_by.split(":", 1))
+                if len(referenced_by) != 2:
+                    raise ValueError(
+                        f"{name}: referenced_by must have the form FILE:KEY,"
+                        f" not {entry['referenced_by']!r}"
+                    )
+            files[name] = (os.path.join(base, entry["template"]), referenced_by)
+        perturbations = []
+        for entry in document.get("perturbations", []):
+            p = Perturbation(
+                entry["file"],
+                entry["key"],
+                entry["distribution"],
+                entry.get("parameters", {}),
+                entry.get("mode", "absolute"),
+            )
+            if p.file not in files:
+                raise ValueError(f"{p.key}: file {p.file} is not listed under files")
+            if p.mode not in MODES:
+                raise ValueError(f"{p.key}: mode must be one of {MODES}, not {p.mode}")
+            perturbations.append(p)
+        return cls(files, perturbations)
+
+
+def draw(spec: Spec, N: int, rng: np.random.Generator) -> List[np.ndarray]:
+    """Draw the values of all perturbations, one array of N values each"""
+    values = []
+    for p in spec.perturbations:
+        method = getattr(rng, p.distribution, None)
+        if method is None or p.distribution.startswith("_"):
+            raise ValueError(f"{p.key}: unknown distribution {p.distribution}")
+        values.append(np.asarray(method(size=N, **p.parameters), dtype=float))
+    return values
+
+
+def _get(document: Mapping, key: str) -> Any:
+    node = document
+    for name in key.split("/"):
+        node = node[name]
+    return node
+
+
+def read_value(path: str, key: str) -> Any:
+    """Read a setting from a YAML file, e.g., ``instances/P1/parameters/sum``"""
+    with open(path) as f:
+        return _get(yaml.load(f, Loader=_Loader), key)
+
+
+def _member_path(name: str, i: int) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}_{i + 1:04}{ext}"
+
+
+# A block mapping key at the start of a line, and the scalar value and
+# trailing comment that follow it
+_KEY = re.compile(r"( *)([\w.-]+|\"[^\"]*\"|'[^']*') *:(?= |$)")
+_VALUE = re.compile(
+    r"( *)(\"(?:[^\"\\]|\\.)*\"|'(?:[^']|'')*'|(?:[^ #].*?)?)( +#.*| *)"
+)
+
+
+def _content(line: str) -> bool:
+    stripped = line.strip()
+    return bool(stripped) and not stripped.startswith("#")
+
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip(" "))
+
+
+def _scalar(value: Any) -> str:
+    # A value as a single-line YAML scalar
+    text = yaml.dump(value, Dumper=_Dumper, default_flow_style=True, width=1e9)
+    return text.splitlines()[0]
+
+
+def _set(lines: List[str], key: str, value: Any):
+    # Set a scalar in the lines of a YAML document in place, keeping all
+    # other text. Mappings missing on the way are added.
+    names = key.split("/")
+    begin, end, indent = 0, len(lines), 0
+    step = min((_indent(s) for s in lines if _content(s) and _indent(s)), default=2)
+    for depth, name in enumerate(names):
+        # Find the setting among the children of the current block
+        children = found = None
+        for i in range(begin, end):
+            if not _content(lines[i]):
+                continue
+            if children is None:
+                children = _indent(lines[i])
+            match = _KEY.match(lines[i])
+            if match and _indent(lines[i]) == children:
+                if match.group(2).strip("\"'") == name:
+                    found = i
+                    break
+        if found is None:
+            # Add the missing settings after the last child of the block
+            last = max(
+                (i for i in range(begin, end) if _content(lines[i])), default=begin - 1
+            )
+            if children is None:
+                children = indent + step if depth else 0
+            new = [
+                f"{' ' * (children + step * k)}{n}:"
+                for k, n in enumerate(names[depth:])
+            ]
+            new[-1] += f" {_scalar(value)}"
+            lines[last + 1 : last + 1] = [line + "\n" for line in new]
+            return
+
+        # Block of the setting: the lines that are indented further
+        line = lines[found].rstrip("\n")
+        match = _KEY.match(line)
+        begin, end, indent = found + 1, found + 1, children
+        while end < len(lines) and (
+            not _content(lines[end]) or _indent(lines[end]) > children
+        ):
+            end += 1
+        lead, old, comment = _VALUE.fullmatch(line[match.end() :]).groups()
+        nested = any(_content(lines[i]) for i in range(begin, end))
+        if depth == len(names) - 1:
+            if nested or old.startswith(("{", "[", "|", ">")):
+                raise ValueError(f"{key} is not a scalar setting")
+            # Keep a trailing comment in its column where possible
+            text = _scalar(value)
+            if comment.strip():
+                pad = len(comment) - len(comment.lstrip(" "))
+                pad = max(1, pad + len(old) - len(text))
+                comment = " " * pad + comment.lstrip(" ")
+            newline = lines[found][len(line) :]
+            lines[found] = f"{line[: match.end()]}{lead or ' '}{text}{comment}{newline}"
+        elif old not in ("", "~", "null", "Null", "NULL"):
+            raise ValueError(f"{'/'.join(names[: depth + 1])} is not a mapping")
+        elif old:
+            # Replace an empty value with the mapping that will be added
+            lines[found] = f"{line[: match.end()]}{lead}{comment}\n"
+
+
+def _render(template: str, document: Mapping, overrides: Iterable[_Override]) -> str:
+    # Apply settings to the text of the template, which is also given parsed
+    lines = template.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    for key, value, multiply in overrides:
+        if multiply:
+            try:
+                original = _get(document, key)
+            except (KeyError, TypeError):
+                raise KeyError(f"{key} must be present to be multiplied") from None
+            value = float(original) * value
+        _set(lines, key, value)
+    return "".join(lines)
+
+
+def _write_members(
+    template_path: str, members: List[Tuple[str, List[_Override]]]
+) -> List[str]:
+    # Write member files based on a single template; runs in worker processes
+    with open(template_path) as f:
+        template = f.read()
+    document = yaml.load(template, Loader=_Loader)
+    for path, overrides in members:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(_render(template, document, overrides))
+        os.replace(tmp, path)
+    return [path for path, _ in members]
+
+
+def _link(template: str, path: str) -> bool:
+    # Link a template into the directory (symbolic link, else hard link,
+    # else copy). Returns False if it already was.
+    target = os.path.relpath(template, os.path.dirname(os.path.abspath(path)))
+    if os.path.islink(path) and os.readlink(path) == target:
+        return False
+    if os.path.lexists(path):
+        os.remove(path)
+    try:
+        os.symlink(target, path)
+    except OSError:
+        try:
+            os.link(template, path)
+        except OSError:
+            shutil.copyfile(template, path)
+    return True
+
+
+class Result(NamedTuple):
+    written: List[str]
+    unchanged: List[str]
+    linked: List[str]
+    removed: List[str]
+
+
+def generate(
+    spec: str,
+    N: int,
+    rng: Optional[np.random.Generator] = None,
+    directory: str = ".",
+    max_workers: Optional[int] = None,
+) -> Result:
+    """Create the configuration of all ``N`` members in ``directory``.
+
+    Perturbations are drawn from ``rng``, by default a generator seeded from
+    seed.dat in ``directory`` (see shared.seed). Member files are written in
+    a pool of worker processes (``max_workers=1`` writes serially).
+    """
+    if rng is None:
+        rng = np.random.default_rng(shared.seed(os.path.join(directory, "seed.dat")))
+    spec = Spec.load(spec)
+    values = draw(spec, N, rng)
+
+    # Settings of each member file. Files referencing a perturbed file are
+    # per-member as well.
+    overrides = {}
+    for p, v in zip(spec.perturbations, values):
+        settings = overrides.setdefault(p.file, [[] for _ in range(N)])
+        multiply = p.mode == "multiplicative"
+        for i in range(N):
+            settings[i].append((p.key, float(v[i]), multiply))
+    for name, (_, referenced_by) in spec.files.items():
+        if name in overrides and referenced_by is not None:
+            parent, key = referenced_by
+            settings = overrides.setdefault(parent, [[] for _ in range(N)])
+            for i in range(N):
+                settings[i].append((key, _member_path(name, i), False))
+
+    manifest_path = os.path.join(directory, MANIFEST)
+    manifest = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    new_manifest = {}
+    result = Result([], [], [], [])
+    tasks = []
+    for name, (template, _) in spec.files.items():
+        if name not in overrides:
+            if _link(template, os.path.join(directory, name)):
+                result.linked.append(name)
+            continue
+        with open(template, "rb") as f:
+            template_hash = hashlib.sha256(f.read()).hexdigest()
+        todo = []
+        for i, settings in enumerate(overrides[name]):
+            member = _member_path(name, i)
+            path = os.path.join(directory, member)
+            digest = hashlib.sha256(
+                json.dumps([RENDERING, template_hash, settings]).encode()
+            ).hexdigest()
+            old = manifest.get(member)
+            if (
+                old is not None
+                and old["hash"] == digest
+                and os.path.isfile(path)
+                and [os.stat(path).st_mtime_ns, os.stat(path).st_size] == old["stat"]
+            ):
+                new_manifest[member] = old
+                result.unchanged.append(member)
+            else:
+                new_manifest[member] = dict(hash=digest)
+                todo.append((path, settings))
+        tasks.append((template, todo))
+
+    # Write member files in chunks of up to 8, in parallel if there are several
+    chunks = []
+    for template, todo in tasks:
+        chunks.extend((template, todo[i : i + 8]) for i in range(0, len(todo), 8))
+    if max_workers is None:
+        max_workers = min(len(chunks), os.cpu_count() or 1)
+    if max_workers > 1 and len(chunks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            written = executor.map(_write_members, *zip(*chunks))
+            paths = [p for chunk in written for p in chunk]
+    else:
+        paths = [p for chunk in chunks for p in _write_members(*chunk)]
+    for path in paths:
+        st = os.stat(path)
+        member = os.path.basename(path)
+        new_manifest[member]["stat"] = [st.st_mtime_ns, st.st_size]
+        result.written.append(member)
+
+    # Remove member files of an earlier, larger or differently perturbed ensemble
+    for member in manifest:
+        if member not in new_manifest:
+            path = os.path.join(directory, member)
+            if os.path.isfile(path):
+                os.remove(path)
+                result.removed.append(member)
+
+    with open(manifest_path, "w") as f:
+        json.dump(new_manifest, f, indent=1)
+    return result
+
+
+def main(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument("spec", help="specification of the perturbations")
+    parser.add_argument("-N", type=int, required=True, help="ensemble size")
+    parser.add_argument(
+        "-C", "--directory", default=".", help="directory to write the ensemble to"
+    )
+    parser.add_argument(
+        "--seed",
+        help="file with the random seed, created if missing (default: seed.dat)",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        help="number of processes writing files (default: all cores)",
+    )
+    args = parser.parse_args(args)
+
+    seed = args.seed or os.path.join(args.directory, "seed.dat")
+    rng = np.random.default_rng(shared.seed(seed))
+    result = generate(args.spec, args.N, rng, args.directory, args.max_workers)
+    print(
+        f"{len(result.written)} files written, {len(result.unchanged)} unchanged,"
+        f" {len(result.linked)} linked, {len(result.removed)} removed"
+    )
+
+
+if __name__ == "__main__":
+    main()
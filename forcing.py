@@ -0,0 +1,381 @@
+"""Compact binary storage for GOTM forcing files.
+
+Two text formats are supported:
+
+* time series: lines "YYYY-MM-DD hh:mm:ss value1 value2 ...",
+  as in meteo.dat, zeta.dat or ext_press.dat
+* profiles: per time, a header "YYYY-MM-DD hh:mm:ss n up_down" followed by
+  n lines "depth value1 value2 ...", as in tprof.dat or *.prof
+
+A converted file is a directory with .npy arrays for the time index and
+values, compressed per-value format codes and a small layout.json. Values
+are stored in single precision if that still reproduces every number in
+the file. The value array is memory-mapped, so selecting a date range reads
+only the records within that range. Converting back reproduces the
+original text byte for byte, including number formatting and whitespace.
+
+Usage from the command line:
+
+    python forcing.py convert FILE [FILE ...]
+    python forcing.py export STORE OUTFILE
+    python forcing.py verify FILE [FILE ...]
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import shutil
+from typing import List, NamedTuple, Optional, Union
+
+import numpy as np
+
+STORE_SUFFIX = ".npystore"
+
+_DATETIME = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+_SPLIT = re.compile(r"(\s+)")
+
+
+class _Formats:
+    """Table of number formats, each identified by a small integer code."""
+
+    def __init__(self, formats: Optional[List[str]] = None):
+        self.formats = list(formats or [])
+        self._codes = {fmt: i for i, fmt in enumerate(self.formats)}
+
+    def code(self, token: str, value: float) -> Optional[int]:
+        """Code of a format that renders value as token, or None"""
+        mantissa, e, _ = token.lower().partition("e")
+        decimals = len(mantissa.partition(".")[2])
+        if e:
+            fmt = f"{{:.{decimals}e}}"
+        elif "." in mantissa:
+            fmt = f"{{:.{decimals}f}}"
+        else:
+            fmt = "{:.0f}"
+        if fmt.format(value) != token:
+            fmt = "{!r}"
+            if repr(value) != token:
+                return None
+        if fmt not in self._codes:
+            self._codes[fmt] = len(self.formats)
+            self.formats.append(fmt)
+        return self._codes[fmt]
+
+    def render(self, code: int, value: float) -> str:
+        return self.formats[code].format(float(value))
+
+
+class _Line(NamedTuple):
+    tokens: List[str]
+    separators: List[str]
+
+
+def _split(line: str) -> _Line:
+    """Split a line into tokens and the whitespace around them, such that
+    line = separators[0] + tokens[0] + separators[1] + ... + separators[-1].
+    A leading "YYYY-MM-DD hh:mm:ss" is kept together as a single token."""
+    m = _DATETIME.match(line)
+    parts = _SPLIT.split(line[m.end() :] if m else line)
+    tokens, separators = parts[0::2], parts[1::2]
+    if m:
+        tokens[0] = m.group() + tokens[0]
+    leading = trailing = ""
+    if tokens[0] == "" and len(tokens) > 1:
+        leading = separators.pop(0)
+        tokens.pop(0)
+    if tokens[-1] == "" and len(tokens) > 1:
+        trailing = separators.pop()
+        tokens.pop()
+    return _Line(tokens, [leading] + separators + [trailing])
+
+
+class ForcingData(NamedTuple):
+    """Contents of a forcing file.
+
+    For time series, ``values`` has one row per time and ``offsets`` is
+    None. For profiles, ``values`` has one row per level (depth followed by
+    the variables), and the levels of record i are
+    ``values[offsets[i]:offsets[i + 1]]``.
+    """
+
+    time: np.ndarray
+    values: np.ndarray
+    offsets: Optional[np.ndarray] = None
+    up_down: Optional[np.ndarray] = None
+
+    @property
+    def is_profile(self) -> bool:
+        return self.offsets is not None
+
+    def profile(self, i: int) -> np.ndarray:
+        return self.values[self.offsets[i] : self.offsets[i + 1]]
+
+
+def _is_profile(lines: List[str]) -> bool:
+    first = _split(lines[0]).tokens
+    if len(first) != 3 or not _DATETIME.fullmatch(first[0]):
+        return False
+    if not all(re.fullmatch(r"[+-]?\d+", t) for t in first[1:]):
+        return False
+    return len(lines) == 1 or _DATETIME.match(lines[1]) is None
+
+
+def _parse(text: str):
+    """Parse text into (ForcingData, codes, layout)"""
+    lines = text.split("\n")
+    final_newline = lines[-1] == ""
+    if final_newline:
+        lines.pop()
+    newline = "\n"
+    if lines and all(l.endswith("\r") for l in lines):
+        newline = "\r\n"
+        lines = [l[:-1] for l in lines]
+
+    layout = {
+        "newline": newline,
+        "final_newline": final_newline,
+        "comments": {},
+        "separators": {},
+        "overrides": {},
+    }
+    records = [(i, l) for i, l in enumerate(lines) if l.strip()[:1] not in "#!"]
+    for i, l in enumerate(lines):
+        if l.strip()[:1] in "#!":
+            layout["comments"][str(i)] = l  # also preserves blank lines
+    if not records:
+        raise ValueError("No data found")
+    profile = _is_profile([l for _, l in records[:2]])
+    layout["kind"] = "profile" if profile else "timeseries"
+
+    formats = _Formats()
+    times, rows, row_codes, offsets, up_down = [], [], [], [], []
+    separators = {"header": None, "data": None}
+
+    def set_separators(kind: str, line_no: int, seps: List[str]):
+        if separators[kind] is None:
+            separators[kind] = seps
+        elif seps != separators[kind]:
+            layout["separators"][str(line_no)] = seps
+
+    def add_row(line_no: int, tokens: List[str], first: int):
+        values = [float(t) for t in tokens[first:]]
+        codes = []
+        for token, value in zip(tokens[first:], values):
+            code = formats.code(token, value)
+            if code is None:
+                layout["overrides"][f"{len(rows)},{len(codes)}"] = token
+                code = 0
+            codes.append(code)
+        if rows and len(values) != len(rows[0]):
+            raise ValueError(f"Line {line_no + 1}: inconsistent number of columns")
+        rows.append(values)
+        row_codes.append(codes)
+
+    it = iter(records)
+    for line_no, l in it:
+        line = _split(l)
+        if not _DATETIME.fullmatch(line.tokens[0]):
+            raise ValueError(f"Line {line_no + 1}: expected date and time")
+        times.append(line.tokens[0])
+        if not profile:
+            set_separators("data", line_no, line.separators)
+            add_row(line_no, line.tokens, 1)
+            continue
+        set_separators("header", line_no, line.separators)
+        n, direction = int(line.tokens[1]), int(line.tokens[2])
+        offsets.append(len(rows))
+        up_down.append(direction)
+        for _ in range(n):
+            line_no, l = next(it)
+            line = _split(l)
+            set_separators("data", line_no, line.separators)
+            add_row(line_no, line.tokens, 0)
+
+    layout["formats"] = formats.formats
+    layout["header_separators"] = separators["header"]
+    layout["data_separators"] = separators["data"]
+    if not formats.formats:
+        formats.formats.append("{!r}")
+
+    time = np.array(times, dtype="datetime64[s]")
+    values = np.array(rows, dtype=float).reshape(len(rows), -1)
+    codes = np.array(row_codes, dtype=np.uint8).reshape(values.shape)
+    data = ForcingData(time, values)
+    if profile:
+        offsets.append(len(rows))
+        data = data._replace(
+            offsets=np.array(offsets, dtype=np.int64),
+            up_down=np.array(up_down, dtype=np.int8),
+        )
+    return data, codes, layout
+
+
+def read_text(path: str) -> ForcingData:
+    """Read a forcing file in GOTM text format"""
+    with open(path, newline="") as f:
+        return _parse(f.read())[0]
+
+
+def convert(path: str, store: Optional[str] = None) -> str:
+    """Convert a text forcing file to a binary store and return the path
+    of the store (by default the file name with suffix .npystore)."""
+    with open(path, newline="") as f:
+        data, codes, layout = _parse(f.read())
+    values32 = data.values.astype(np.float32)
+    formats = _Formats(layout["formats"])
+    if all(
+        formats.render(c, v) == formats.render(c, v32)
+        for c, v, v32 in zip(codes.flat, data.values.flat, values32.flat)
+    ):
+        data = data._replace(values=values32)
+    store = store or path + STORE_SUFFIX
+    tmp = f"{store}.{os.getpid()}.tmp"
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for name, array in data._asdict().items():
+        if array is not None:
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+    np.savez_compressed(os.path.join(tmp, "codes.npz"), codes=codes)
+    with open(os.path.join(tmp, "layout.json"), "w") as f:
+        json.dump(layout, f)
+    if os.path.isdir(store):
+        shutil.rmtree(store)
+    os.replace(tmp, store)
+    return store
+
+
+class ForcingStore:
+    """Binary forcing store created by :func:`convert`"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "layout.json")) as f:
+            self.layout = json.load(f)
+        self.time = np.load(os.path.join(path, "time.npy"))
+        self.is_profile = self.layout["kind"] == "profile"
+        if self.is_profile:
+            self.offsets = np.load(os.path.join(path, "offsets.npy"))
+            self.up_down = np.load(os.path.join(path, "up_down.npy"))
+
+    def _array(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def _range(self, start, stop) -> slice:
+        istart = 0
+        if start is not None:
+            istart = np.searchsorted(self.time, np.datetime64(start, "s"), "left")
+        istop = self.time.size
+        if stop is not None:
+            istop = np.searchsorted(self.time, np.datetime64(stop, "s"), "right")
+        return slice(istart, istop)
+
+    def select(self, start=None, stop=None) -> ForcingData:
+        """Return all records with start <= time <= stop. Only the selected
+        rows are read from disk."""
+        records = self._range(start, stop)
+        time = self.time[records]
+        if not self.is_profile:
+            return ForcingData(time, np.array(self._array("values")[records]))
+        offsets = self.offsets[records.start : records.stop + 1]
+        return ForcingData(
+            time,
+            np.array(self._array("values")[offsets[0] : offsets[-1]]),
+            offsets - offsets[0],
+            self.up_down[records],
+        )
+
+    def write_text(self, out: Union[str, io.TextIOBase]):
+        """Write the store in the original text format"""
+        if isinstance(out, str):
+            with open(out, "w", newline="") as f:
+                return self.write_text(f)
+        layout = self.layout
+        formats = _Formats(layout["formats"])
+        values = self._array("values")
+        with np.load(os.path.join(self.path, "codes.npz")) as npz:
+            codes = npz["codes"]
+        comments = layout["comments"]
+        separators = layout["separators"]
+        overrides = layout["overrides"]
+        newline = layout["newline"]
+        times = np.datetime_as_string(self.time, unit="s")
+        lines: List[str] = []
+
+        def emit(tokens: List[str], default_seps: List[str]):
+            while str(len(lines)) in comments:
+                lines.append(comments[str(len(lines))])
+            seps = separators.get(str(len(lines)), default_seps)
+            parts = [seps[0]]
+            for token, sep in zip(tokens, seps[1:]):
+                parts += [token, sep]
+            lines.append("".join(parts))
+
+        def row_tokens(irow: int) -> List[str]:
+            tokens = []
+            for icol, (c, v) in enumerate(zip(codes[irow], values[irow])):
+                token = overrides.get(f"{irow},{icol}")
+                tokens.append(token if token is not None else formats.render(c, v))
+            return tokens
+
+        for irec, t in enumerate(times):
+            t = t.replace("T", " ")
+            if not self.is_profile:
+                emit([t] + row_tokens(irec), layout["data_separators"])
+                continue
+            start, stop = self.offsets[irec], self.offsets[irec + 1]
+            header = [t, str(stop - start), str(self.up_down[irec])]
+            emit(header, layout["header_separators"])
+            for irow in range(start, stop):
+                emit(row_tokens(irow), layout["data_separators"])
+        while str(len(lines)) in comments:
+            lines.append(comments[str(len(lines))])
+
+        out.write(newline.join(lines))
+        if layout["final_newline"]:
+            out.write(newline)
+
+
+def verify(path: str, store: Optional[str] = None) -> bool:
+    """Check that a store reproduces the original text file exactly"""
+    out = io.StringIO(newline="")
+    ForcingStore(store or path + STORE_SUFFIX).write_text(out)
+    with open(path, newline="") as f:
+        return f.read() == out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p = subparsers.add_parser("convert", help="convert text files to binary stores")
+    p.add_argument("files", nargs="+")
+    p = subparsers.add_parser("export", help="write a binary store as text")
+    p.add_argument("store")
+    p.add_argument("outfile")
+    p = subparsers.add_parser(
+        "verify", help="convert text files and check they round-trip exactly"
+    )
+    p.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        ForcingStore(args.store).write_text(args.outfile)
+        return
+    failed = False
+    for path in args.files:
+        store = convert(path)
+        size = sum(e.stat().st_size for e in os.scandir(store))
+        status = ""
+        if args.command == "verify":
+            ok = verify(path, store)
+            failed = failed or not ok
+            status = " round trip OK" if ok else " ROUND TRIP FAILED"
+        print(f"{path}: {os.path.getsize(path)} -> {size} bytes{status}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
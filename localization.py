@@ -0,0 +1,312 @@
+"""Vertical localization of the analysis in water column models.
+
+In a column, an observation at the surface is often assimilated into a
+state with many variables over the whole depth. Ensemble covariances with
+deep levels and with loosely related variables are mostly sampling noise,
+yet the filter spends most of its time updating those parts of the state.
+This plugin limits the update to the variables and depths that each type
+of observation is allowed to influence, e.g., in ``run.py``::
+
+    localize = localization.Localization(
+        localization.grid("../reference/gotm.yaml"),
+        {
+            "temp[-1]": localization.Taper(30.0, ["temp", "salt"]),
+            "total_chlorophyll[-1]": localization.Taper(20.0, bgc_variables),
+        },
+    )
+    experiment.add_plugin(localize)
+
+Observation types are named as in ``experiment.add_observations``. The
+increment of each variable that a type of observation may update is
+multiplied by the Gaspari-Cohn taper of the distance between the depth of
+a level and that of the observation: 1 at the observation, dropping to 0 at
+twice the taper length. For a single observation per analysis, this is
+equivalent to localizing the covariances between the observation and the
+state. If observations of several types are assimilated in the same
+analysis, each level uses the largest weight among them. Variables without
+depth dimension (e.g., parameters) are updated without tapering.
+
+Variables and levels outside the reach of all observation types are
+removed from the state seen by subsequent plugins and the filter, the same
+way ``eatpy.plugins.select.Select`` removes variables. As they never enter
+the filter, they need no restoring. Add this plugin last, directly before
+the observations, so that it trims the state the filter sees and tapers the
+increments in the space the filter works in (e.g., after log transforms).
+
+The plugin works in two index spaces. Like all plugins, it receives the
+complete state, in which each variable occupies the columns ``start:stop``
+of its original entry in ``variables``. The observation indices ``iobs``
+refer to the compact state of the filter, which holds the variables left
+after all plugins initialized, trimmed and in order. eatpy determines them
+from the trimmed variables, so the level of an observation type counts
+within the levels that are kept. Count levels from the surface (negative,
+e.g., ``temp[-1]``) if levels near the bottom are removed; other levels are
+rejected, as eatpy would observe a different depth than the one tapered
+around. ``obs_index`` holds the index of each type in the compact state.
+"""
+
+import datetime
+import os
+import re
+from typing import (
+    Any,
+    Iterable,
+    List,
+    Mapping,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+import yaml
+import eatpy.shared
+
+
+def gaspari_cohn(r: np.ndarray) -> np.ndarray:
+    """Gaspari and Cohn (1999) fifth-order piecewise rational function of
+    the distance ``r`` relative to the taper length: 1 at r = 0 and 0 for
+    r >= 2"""
+    r = np.abs(np.asarray(r, dtype=float))
+    weights = np.zeros_like(r)
+    near = r <= 1.0
+    far = (r > 1.0) & (r < 2.0)
+    x = r[near]
+    weights[near] = (((-0.25 * x + 0.5) * x + 0.625) * x - 5.0 / 3.0) * x**2 + 1.0
+    x = r[far]
+    weights[far] = (
+        ((((x / 12.0 - 0.5) * x + 0.625) * x + 5.0 / 3.0) * x - 5.0) * x
+        + 4.0
+        - 2.0 / (3.0 * x)
+    )
+    return weights
+
+
+def grid(path: str) -> np.ndarray:
+    """Depth (m, positive downward) of the layer centres of a GOTM
+    configuration, from the bottom up like the profiles in the state.
+    Supports the analytical (optionally zoomed), file_sigma and file_h grid
+    methods. The surface elevation is ignored."""
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    depth = float(config.get("location", {}).get("depth", 100.0))
+    settings = config.get("grid", {})
+    method = settings.get("method", "analytical")
+    if method == "analytical":
+        nlev = int(settings.get("nlev", 100))
+        ddu = float(settings.get("ddu", 0.0))
+        ddl = float(settings.get("ddl", 0.0))
+        i = np.arange(nlev + 1)
+        if ddu <= 0.0 and ddl <= 0.0:
+            sigma = i / nlev - 1.0
+        else:
+            sigma = np.tanh((ddl + ddu) * i / nlev - ddl) + np.tanh(ddl)
+            sigma = sigma / (np.tanh(ddl) + np.tanh(ddu)) - 1.0
+        h = np.diff(sigma) * depth
+    elif method in ("file_sigma", "file_h"):
+        # Layer thicknesses (or fractions of the depth) from the surface down
+        file = os.path.join(os.path.dirname(path), settings["file"])
+        h = np.loadtxt(file, skiprows=1, ndmin=1)[::-1]
+        if method == "file_sigma":
+            h = h * depth
+    else:
+        raise ValueError(f"{path}: unsupported grid method {method}")
+    above = np.cumsum(h[::-1])[::-1] - h
+    return above + 0.5 * h
+
+
+class Taper(NamedTuple):
+    """Localization of one type of observation: the taper length (m) and
+    the variables it may update (None for all)"""
+
+    length: float
+    variables: Optional[Iterable[str]] = None
+
+
+def _parse(key: str) -> Tuple[str, int]:
+    # Observed variable and level of an observation type, e.g. "temp[-1]"
+    match = re.fullmatch(r"\s*(\w+)\s*\[\s*(-?\d+)\s*\]\s*", key)
+    if match is None:
+        raise ValueError(
+            f"Observation type {key!r} must have the form NAME[LEVEL], e.g., temp[-1]"
+        )
+    return match.group(1), int(match.group(2))
+
+
+class _Group(NamedTuple):
+    # Adjacent variables of equal length with the same kept levels and
+    # weights, updated together through a (member, variable, level) view
+    start: int  # first column of the first variable in the complete state
+    count: int
+    length: int
+    lo: int  # first kept level
+    hi: int
+    weights: np.ndarray  # (observation type, level), all levels
+
+
+def _levels(state: np.ndarray, start: int, count: int, length: int, lo: int, hi: int):
+    # View of levels lo:hi of adjacent variables as (member, variable, level)
+    s0, s1 = state.strides
+    return np.lib.stride_tricks.as_strided(
+        state[:, start + lo :],
+        shape=(state.shape[0], count, hi - lo),
+        strides=(s0, length * s1, s1),
+    )
+
+
+class Localization(eatpy.shared.Plugin):
+    """Taper the analysis increments with depth per type of observation, and
+    trim the state to the variables and levels that are updated."""
+
+    def __init__(self, depth: np.ndarray, tapers: Mapping[str, Taper]):
+        super().__init__()
+        self.depth = np.asarray(depth, dtype=float)
+        self.keys = []
+        self.types = []
+        self.tapers = []
+        for key, taper in tapers.items():
+            name, level = _parse(key)
+            if taper.length <= 0.0:
+                raise ValueError(f"{key}: the taper length must be positive.")
+            taper = Taper(
+                taper.length, None if taper.variables is None else set(taper.variables)
+            )
+            if taper.variables is not None and name not in taper.variables:
+                raise ValueError(f"{key}: the observed variable must be updated too.")
+            self.keys.append((key, level))
+            self.types.append((name, level % self.depth.size))
+            self.tapers.append(taper)
+
+        # Columns updated per combination of observation types present in an
+        # analysis; see _plan_for
+        self._plans: MutableMapping[Tuple[bool, ...], List] = {}
+        self._plan = []
+
+    def _weights(self, name: str, length: int) -> np.ndarray:
+        # Weight of each observation type for each level of a variable
+        profile = length == self.depth.size
+        weights = np.zeros((len(self.types), length))
+        for i, ((_, level), taper) in enumerate(zip(self.types, self.tapers)):
+            if taper.variables is None or name in taper.variables:
+                if profile:
+                    distance = self.depth - self.depth[level]
+                    weights[i] = gaspari_cohn(distance / taper.length)
+                else:
+                    weights[i] = 1.0
+        return weights
+
+    def initialize(self, variables: MutableMapping[str, Any], ensemble_size: int):
+        self.ensemble_size = ensemble_size
+        self._groups: List[_Group] = []
+        kept_levels = {}
+        total = 0
+        for name in list(variables):
+            info = variables[name]
+            total += info["length"]
+            weights = self._weights(name, info["length"])
+            active = np.flatnonzero(weights.any(axis=0))
+            if active.size == 0:
+                del variables[name]
+                continue
+            lo, hi = int(active[0]), int(active[-1]) + 1
+            if hi - lo < info["length"]:
+                variables[name] = dict(
+                    info,
+                    start=info["start"] + lo,
+                    length=hi - lo,
+                    stop=info["start"] + hi,
+                    data=info["data"][:, lo:hi],
+                )
+            kept_levels[name] = lo
+            last = self._groups[-1] if self._groups else None
+            if (
+                last is not None
+                and last.start + last.count * last.length == info["start"]
+                and (last.length, last.lo, last.hi) == (info["length"], lo, hi)
+                and np.array_equal(last.weights, weights)
+            ):
+                self._groups[-1] = last._replace(count=last.count + 1)
+            else:
+                group = _Group(info["start"], 1, info["length"], lo, hi, weights)
+                self._groups.append(group)
+
+        # Index of each observation type in the compact state of the filter,
+        # with the level counted within the kept levels as eatpy does
+        offsets, start = {}, 0
+        for name, info in variables.items():
+            offsets[name] = start
+            start += info["length"]
+        self.logger.info(f"State trimmed from {total} to {start} values per member")
+        self.obs_index = np.empty(len(self.types), dtype=int)
+        for i, ((key, level), (name, full_level)) in enumerate(
+            zip(self.keys, self.types)
+        ):
+            if name not in offsets:
+                raise KeyError(f"Observed variable {name} is not part of the state.")
+            kept = variables[name]["length"]
+            if (
+                not -kept <= level < kept
+                or kept_levels[name] + level % kept != full_level
+            ):
+                raise ValueError(
+                    f"{key}: levels are counted within the {kept} levels of {name}"
+                    f" that are kept. Count from the surface, e.g., {name}[-1]."
+                )
+            self.obs_index[i] = offsets[name] + level % kept
+
+    def _plan_for(
+        self, present: np.ndarray
+    ) -> List[Tuple[Tuple, np.ndarray, np.ndarray]]:
+        # For each group, the levels to taper (those with weight below 1),
+        # buffers for their prior and updated values and their weights.
+        # Cached, as the weights do not change during a run.
+        key = tuple(present)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = []
+            for g in self._groups:
+                weights = g.weights[present].max(axis=0, initial=0.0)[g.lo : g.hi]
+                tapered = np.flatnonzero(weights < 1.0)
+                if tapered.size:
+                    lo, hi = g.lo + tapered[0], g.lo + tapered[-1] + 1
+                    shape = (self.ensemble_size, g.count, hi - lo)
+                    buffers = np.empty(shape), np.empty(shape)
+                    weights = weights[lo - g.lo : hi - g.lo]
+                    plan.append(
+                        ((g.start, g.count, g.length, lo, hi), buffers, weights)
+                    )
+            self._plans[key] = plan
+        return plan
+
+    def before_analysis(
+        self,
+        time: datetime.datetime,
+        state: np.ndarray,
+        iobs: np.ndarray,
+        obs: np.ndarray,
+        obs_sds: np.ndarray,
+        filter: eatpy.shared.Filter,
+    ):
+        matches = self.obs_index[:, np.newaxis] == iobs
+        if not matches.any(axis=0).all():
+            unknown = np.asarray(iobs)[~matches.any(axis=0)]
+            raise ValueError(
+                f"No localization configured for the observations at state"
+                f" indices {unknown.tolist()}."
+            )
+        self._plan = self._plan_for(matches.any(axis=1))
+        for levels, (prior, _), _ in self._plan:
+            np.copyto(prior, _levels(state, *levels))
+
+    def after_analysis(self, state: np.ndarray):
+        # state = prior + weights * (state - prior). This is computed in a
+        # contiguous buffer, as arithmetic on the strided view is several
+        # times slower than copying to and from it.
+        for levels, (prior, data), weights in self._plan:
+            view = _levels(state, *levels)
+            np.copyto(data, view)
+            data -= prior
+            data *= weights
+            data += prior
+            np.copyto(view, data)
@@ -0,0 +1,266 @@
+"""Timing of custom plugins in data assimilation runs.
+
+Wrap a plugin before adding it to the experiment, e.g., in ``run.py``::
+
+    experiment.add_plugin(profiling.wrap(ogs3dvar_base.Chl()))
+
+If profiling is disabled (the default), :func:`wrap` returns the plugin
+itself, so there is no overhead at all. Set the environment variable
+``EAT_PROFILE=1`` to enable it. Each wrapped plugin then writes a table
+with one line per analysis step to ``profile_<plugin name>.txt`` in the
+working directory, followed by a summary when the run ends.
+
+Per analysis step, the table contains the time spent in the plugin
+(``before_analysis``, ``after_analysis`` and, for 3D-Var, ``cvt`` and
+``cvt_adj``), the number of 3D-Var inner iterations, and the wall time
+between plugin calls: from the previous ``after_analysis`` to this
+``before_analysis`` (model forecast) and from ``before_analysis`` to
+``after_analysis`` (filter, including any ``cvt`` and ``cvt_adj`` calls).
+These intervals include the time spent in other plugins.
+"""
+
+import atexit
+import datetime
+import logging
+import os
+import sys
+from time import perf_counter
+from typing import Any, MutableMapping, Optional
+
+import numpy as np
+import eatpy.shared
+import eatpy.pdaf
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory is then not reported
+    resource = None
+
+ENVIRONMENT_VARIABLE = "EAT_PROFILE"
+
+
+def enabled() -> bool:
+    """Whether profiling is switched on through the environment"""
+    return os.environ.get(ENVIRONMENT_VARIABLE, "0").lower() not in ("", "0", "false")
+
+
+def _peak_memory() -> Optional[float]:
+    # Peak resident memory of this process in MB
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kB elsewhere
+    return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 2**10
+
+
+class _Timer:
+    __slots__ = ("calls", "total")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+
+    def add(self, elapsed: float):
+        self.calls += 1
+        self.total += elapsed
+
+
+_COLUMNS = (
+    ("time", 19),
+    ("model", 9),
+    ("before", 9),
+    ("filter", 9),
+    ("cvt", 9),
+    ("cvt_adj", 9),
+    ("iter", 5),
+    ("after", 9),
+    ("peak MB", 9),
+)
+
+
+class Profiler(eatpy.shared.Plugin):
+    """Wrapper that times all calls to another plugin. Attributes of the
+    wrapped plugin remain accessible through the wrapper."""
+
+    def __init__(self, plugin: eatpy.shared.Plugin, path: Optional[str] = None):
+        # The wrapped plugin must be set first, as attribute lookups and the
+        # properties of CvtProfiler rely on it. The constructor of
+        # CvtHandler is skipped as the wrapped handler holds the dimensions.
+        self.plugin = plugin
+        eatpy.shared.Plugin.__init__(self)
+        self.logger = logging.getLogger(f"profile.{plugin.__class__.__name__}")
+        self.path = path or f"profile_{plugin.__class__.__name__}.txt"
+        self.file = None
+        self.timers = {
+            name: _Timer()
+            for name in (
+                "initialize",
+                "before_analysis",
+                "after_analysis",
+                "cvt",
+                "cvt_adj",
+                "model",
+                "filter",
+            )
+        }
+        self.analyses = 0
+        self.iterations = 0
+        self._step = None
+        self._last = None
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not found on the wrapper itself
+        if name == "plugin":
+            raise AttributeError(name)
+        return getattr(self.plugin, name)
+
+    def initialize(self, variables: MutableMapping[str, Any], ensemble_size: int):
+        start = perf_counter()
+        self.plugin.initialize(variables, ensemble_size)
+        self._last = perf_counter()
+        self.timers["initialize"].add(self._last - start)
+        self.file = open(self.path, "w")
+        self.file.write(" ".join(f"{name:>{width}}" for name, width in _COLUMNS) + "\n")
+        self.file.flush()
+        atexit.register(self._close)
+
+    def before_analysis(
+        self,
+        time: datetime.datetime,
+        state: np.ndarray,
+        iobs: np.ndarray,
+        obs: np.ndarray,
+        obs_sds: np.ndarray,
+        filter: eatpy.shared.Filter,
+    ):
+        start = perf_counter()
+        step = self._step = dict(time=time, cvt=0.0, cvt_adj=0.0, iter=0)
+        if self._last is not None:
+            step["model"] = start - self._last
+            self.timers["model"].add(step["model"])
+        self.plugin.before_analysis(time, state, iobs, obs, obs_sds, filter)
+        self._last = perf_counter()
+        step["before"] = self._last - start
+        self.timers["before_analysis"].add(step["before"])
+
+    def after_analysis(self, state: np.ndarray):
+        start = perf_counter()
+        step = self._step or dict(time=None, cvt=0.0, cvt_adj=0.0, iter=0)
+        step["filter"] = start - self._last
+        self.timers["filter"].add(step["filter"])
+        self.plugin.after_analysis(state)
+        self._last = perf_counter()
+        step["after"] = self._last - start
+        self.timers["after_analysis"].add(step["after"])
+        step["peak MB"] = _peak_memory()
+        self.analyses += 1
+        self.iterations += step["iter"]
+        self._write(step)
+        self._step = None
+
+    def _write(self, step: dict):
+        fields = []
+        for name, width in _COLUMNS:
+            value = step.get(name)
+            if value is None:
+                fields.append(f"{'-':>{width}}")
+            elif name == "time":
+                fields.append(f"{value:%Y-%m-%d %H:%M:%S}")
+            elif name == "iter":
+                fields.append(f"{value:>{width}d}")
+            elif name == "peak MB":
+                fields.append(f"{value:>{width}.1f}")
+            else:
+                fields.append(f"{value:>{width}.4f}")
+        self.file.write(" ".join(fields) + "\n")
+        self.file.flush()
+
+    def summary(self) -> str:
+        lines = [f"Analyses: {self.analyses}"]
+        if self.timers["cvt"].calls:
+            lines.append(
+                f"3D-Var inner iterations: {self.iterations}"
+                f" ({self.iterations / max(self.analyses, 1):.1f} per analysis)"
+            )
+        lines.append(f"{'':<16}{'calls':>8}{'total (s)':>12}{'mean (s)':>12}")
+        for name, timer in self.timers.items():
+            if timer.calls:
+                mean = timer.total / timer.calls
+                lines.append(
+                    f"{name:<16}{timer.calls:>8d}{timer.total:>12.3f}{mean:>12.6f}"
+                )
+        peak = _peak_memory()
+        if peak is not None:
+            lines.append(f"Peak memory: {peak:.1f} MB")
+        return "\n".join(lines)
+
+    def finalize(self):
+        finalize = getattr(self.plugin, "finalize", None)
+        if finalize is not None:
+            start = perf_counter()
+            finalize()
+            self.timers.setdefault("finalize", _Timer()).add(perf_counter() - start)
+        self._close()
+
+    def _close(self):
+        # Also registered to run at exit, in case finalize is never called
+        if self.file is None:
+            return
+        summary = self.summary()
+        self.file.write("\n" + summary + "\n")
+        self.file.close()
+        self.file = None
+        atexit.unregister(self._close)
+        self.logger.info(f"Timings written to {self.path}\n{summary}")
+
+
+class CvtProfiler(Profiler, eatpy.pdaf.CvtHandler):
+    """Wrapper for 3D-Var covariance transformation handlers that also
+    times ``cvt`` and ``cvt_adj`` and counts inner iterations."""
+
+    # PDAF reads the control vector dimensions from the handler
+    dim_cvec = property(
+        lambda self: self.plugin.dim_cvec,
+        lambda self, value: setattr(self.plugin, "dim_cvec", value),
+    )
+    dim_cvec_ens = property(
+        lambda self: self.plugin.dim_cvec_ens,
+        lambda self, value: setattr(self.plugin, "dim_cvec_ens", value),
+    )
+
+    def cvt(self, iter: int, state: np.ndarray, v_p: np.ndarray) -> np.ndarray:
+        start = perf_counter()
+        result = self.plugin.cvt(iter, state, v_p)
+        elapsed = perf_counter() - start
+        self.timers["cvt"].add(elapsed)
+        if self._step is not None:
+            self._step["cvt"] += elapsed
+            self._step["iter"] = max(self._step["iter"], iter)
+        return result
+
+    def cvt_adj(self, iter: int, state: np.ndarray, Vv_p: np.ndarray) -> np.ndarray:
+        start = perf_counter()
+        result = self.plugin.cvt_adj(iter, state, Vv_p)
+        elapsed = perf_counter() - start
+        self.timers["cvt_adj"].add(elapsed)
+        if self._step is not None:
+            self._step["cvt_adj"] += elapsed
+        return result
+
+
+def wrap(
+    plugin: eatpy.shared.Plugin,
+    enable: Optional[bool] = None,
+    path: Optional[str] = None,
+) -> eatpy.shared.Plugin:
+    """Return a profiling wrapper for ``plugin`` if profiling is enabled,
+    otherwise the plugin itself. By default, profiling is enabled through
+    the environment variable EAT_PROFILE."""
+    if enable is None:
+        enable = enabled()
+    if not enable:
+        return plugin
+    if isinstance(plugin, eatpy.pdaf.CvtHandler):
+        return CvtProfiler(plugin, path)
+    return Profiler(plugin, path)
@@ -0,0 +1,359 @@
+"""Render the figures of an application without a notebook frontend.
+
+The figures are produced by the code in the application's notebook
+(experiment.ipynb), which is not executed as a whole. Instead, each code
+cell that saves a figure with ``savefig("name.png", ...)`` becomes a job
+that executes that cell, preceded by only those statements of earlier
+cells that define the names it uses (recursively). Statements with side
+effects only, such as model runs (``!mpiexec ...``), ensemble generation
+or file copies, are therefore never executed. ``%cd`` magics set the
+directory a statement runs in; all other magics and shell commands are
+skipped.
+
+Jobs run in a pool of worker processes with Matplotlib's non-interactive
+Agg backend. A figure is only rendered again if the statements producing
+it, shared.py, or any file they reference (e.g., result.nc, including
+member results and the consolidated store, or observation files) changed
+since it was last rendered. This is recorded in .report.json in the
+application directory.
+
+Usage, from the repository root:
+
+    python report.py Ensemble
+    python report.py Parameters --force --jobs 2
+"""
+
+import argparse
+import ast
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+import shared
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Written to the application directory to record what each figure was
+# rendered from
+MANIFEST = ".report.json"
+
+
+class Statement(NamedTuple):
+    cell: int
+    source: str  # padded with empty lines to preserve line numbers
+    cwd: str  # relative to the notebook directory
+    defines: Set[str]
+    uses: Set[str]
+    binds: Set[str]  # defined unconditionally, replacing any earlier value
+
+
+class Job(NamedTuple):
+    cell: int
+    outputs: List[str]  # relative to the notebook directory
+    statements: List[Statement]
+
+
+def _base_name(node: ast.AST) -> Optional[str]:
+    # Name of the variable that an attribute or item assignment modifies
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _names(node: ast.AST) -> Tuple[Set[str], Set[str]]:
+    # Names defined and used by a top-level statement
+    defines, uses = set(), set()
+    for n in ast.walk(node):
+        if isinstance(n, ast.Name):
+            (defines if isinstance(n.ctx, ast.Store) else uses).add(n.id)
+        elif isinstance(n, (ast.Import, ast.ImportFrom)):
+            for alias in n.names:
+                defines.add((alias.asname or alias.name).split(".")[0])
+        elif isinstance(n, (ast.FunctionDef, ast.ClassDef)):
+            defines.add(n.name)
+        elif isinstance(n, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+            targets = n.targets if isinstance(n, ast.Assign) else [n.target]
+            for target in targets:
+                if isinstance(target, (ast.Attribute, ast.Subscript)):
+                    name = _base_name(target)
+                    if name is not None:
+                        defines.add(name)
+    return defines, uses
+
+
+def _targets(node: ast.AST) -> Set[str]:
+    # Names bound by an assignment target, including tuple unpacking
+    if isinstance(node, ast.Name):
+        return {node.id}
+    if isinstance(node, ast.Starred):
+        return _targets(node.value)
+    if isinstance(node, (ast.Tuple, ast.List)):
+        return set().union(*(_targets(e) for e in node.elts))
+    return set()
+
+
+def _binds(node: ast.AST) -> Set[str]:
+    # Names a top-level statement always binds anew. Definitions inside
+    # if/for/while/try/with, augmented assignments and changes to attributes
+    # or items may keep an earlier value, which is then needed too.
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return {(a.asname or a.name).split(".")[0] for a in node.names}
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return {node.name}
+    if isinstance(node, ast.Assign):
+        return set().union(*(_targets(t) for t in node.targets))
+    if isinstance(node, ast.AnnAssign) and node.value is not None:
+        return _targets(node.target)
+    return set()
+
+
+def _savefig_outputs(node: ast.AST) -> List[str]:
+    # File names passed as literal to savefig calls
+    outputs = []
+    for n in ast.walk(node):
+        if (
+            isinstance(n, ast.Call)
+            and isinstance(n.func, ast.Attribute)
+            and n.func.attr == "savefig"
+            and n.args
+            and isinstance(n.args[0], ast.Constant)
+            and isinstance(n.args[0].value, str)
+        ):
+            outputs.append(n.args[0].value)
+    return outputs
+
+
+def parse_notebook(path: str) -> List[Job]:
+    """Find the figures saved by a notebook and the statements they need"""
+    with open(path, encoding="utf-8") as f:
+        cells = json.load(f)["cells"]
+    statements: List[Statement] = []
+    jobs: List[Job] = []
+    cwd = "."
+    for icell, cell in enumerate(cells):
+        if cell["cell_type"] != "code":
+            continue
+        # Blank out magics and shell commands, noting directory changes
+        lines = "".join(cell["source"]).splitlines()
+        cwds = []
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            if stripped.startswith("%cd "):
+                cwd = os.path.normpath(os.path.join(cwd, stripped[4:].strip()))
+            if stripped.startswith(("%", "!")):
+                lines[i] = ""
+            cwds.append(cwd)
+        source = "\n".join(lines)
+        tree = ast.parse(source)
+        first = len(statements)
+        outputs = []
+        for node in tree.body:
+            defines, uses = _names(node)
+            segment = ast.get_source_segment(source, node)
+            statements.append(
+                Statement(
+                    icell,
+                    "\n" * (node.lineno - 1) + segment,
+                    cwds[node.lineno - 1],
+                    defines,
+                    uses,
+                    _binds(node),
+                )
+            )
+            outputs.extend(
+                os.path.normpath(os.path.join(cwds[node.lineno - 1], name))
+                for name in _savefig_outputs(node)
+            )
+        if outputs:
+            cell = range(first, len(statements))
+            jobs.append(Job(icell, outputs, _dependencies(statements, cell)))
+    return jobs
+
+
+def _dependencies(
+    statements: List[Statement], targets: Iterable[int]
+) -> List[Statement]:
+    # The target statements and the earlier statements that define the
+    # names they use, recursively, in their original order. For each name,
+    # statements are taken back to the latest that binds it unconditionally,
+    # as a conditional definition (e.g., an override in an if statement)
+    # relies on an earlier one.
+    needed = set(targets)
+    todo = [(i, name) for i in needed for name in statements[i].uses]
+    while todo:
+        end, name = todo.pop()
+        for i in range(end - 1, -1, -1):
+            if name in statements[i].defines:
+                if i not in needed:
+                    needed.add(i)
+                    todo.extend((i, used) for used in statements[i].uses)
+                if name in statements[i].binds:
+                    break
+    return [statements[i] for i in sorted(needed)]
+
+
+def _inputs(directory: str, job: Job) -> List[str]:
+    # Existing files referenced by string literals in the statements of a job
+    paths = set()
+    for statement in job.statements:
+        for node in ast.walk(ast.parse(statement.source)):
+            if not (isinstance(node, ast.Constant) and isinstance(node.value, str)):
+                continue
+            path = os.path.normpath(os.path.join(directory, statement.cwd, node.value))
+            if os.path.isfile(path):
+                paths.add(path)
+            stem, ext = os.path.splitext(path)
+            if ext == ".nc":
+                # Ensemble results: member files and consolidated store
+                paths.update(glob.glob(f"{stem}_[0-9][0-9][0-9][0-9]{ext}"))
+                store = shared.ensemble_store_path(path)
+                if os.path.isfile(store):
+                    paths.add(store)
+    paths.difference_update(os.path.join(directory, o) for o in job.outputs)
+    return sorted(paths)
+
+
+def fingerprint(directory: str, job: Job) -> str:
+    """Hash of everything a figure depends on: the code that produces it,
+    shared.py, and the modification time and size of its input files"""
+    h = hashlib.sha256()
+    for statement in job.statements:
+        h.update(f"{statement.cwd}\n{statement.source}\n".encode())
+    with open(os.path.join(ROOT, "shared.py"), "rb") as f:
+        h.update(f.read())
+    for path in _inputs(directory, job):
+        st = os.stat(path)
+        relpath = os.path.relpath(path, directory)
+        h.update(f"{relpath} {st.st_mtime_ns} {st.st_size}\n".encode())
+    return h.hexdigest()
+
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+    sys.path.insert(0, ROOT)
+
+
+def render(directory: str, notebook: str, job: Job) -> float:
+    """Execute the statements of a job (in a worker process) to save its
+    figures. Returns the time taken."""
+    from matplotlib import pyplot
+
+    start = time.perf_counter()
+    namespace = {"__name__": "__main__"}
+    try:
+        for statement in job.statements:
+            os.chdir(os.path.join(directory, statement.cwd))
+            code = compile(statement.source, f"{notebook}[{statement.cell}]", "exec")
+            exec(code, namespace)
+    finally:
+        pyplot.close("all")
+        os.chdir(directory)
+    return time.perf_counter() - start
+
+
+def run(
+    directory: str,
+    notebook: str = "experiment.ipynb",
+    max_workers: Optional[int] = None,
+    force: bool = False,
+) -> Mapping[str, Optional[str]]:
+    """Render all figures of an application that are out of date. Returns
+    the error message for each job that failed, or None if it succeeded
+    or was up to date, by output file names."""
+    directory = os.path.abspath(directory)
+    jobs = parse_notebook(os.path.join(directory, notebook))
+    manifest_path = os.path.join(directory, MANIFEST)
+    manifest = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    results = {}
+    todo = {}
+    for job in jobs:
+        name = ", ".join(job.outputs)
+        key = fingerprint(directory, job)
+        current = all(
+            manifest.get(output) == key
+            and os.path.isfile(os.path.join(directory, output))
+            for output in job.outputs
+        )
+        if current and not force:
+            print(f"{name}: up to date")
+            results[name] = None
+        else:
+            todo[name] = (job, key)
+
+    if todo:
+        max_workers = max_workers or min(len(todo), os.cpu_count() or 1)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers, initializer=_init_worker
+        ) as executor:
+            futures = {
+                executor.submit(render, directory, notebook, job): name
+                for name, (job, _) in todo.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                job, key = todo[name]
+                try:
+                    elapsed = future.result()
+                except Exception:
+                    results[name] = traceback.format_exc()
+                    print(f"{name}: failed\n{results[name]}", file=sys.stderr)
+                    continue
+                print(f"{name}: rendered in {elapsed:.1f} s")
+                results[name] = None
+                manifest.update({output: key for output in job.outputs})
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return results
+
+
+def main(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument("directory", help="application directory")
+    parser.add_argument(
+        "--notebook",
+        default="experiment.ipynb",
+        help="notebook in the application directory (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--jobs", type=int, help="number of worker processes (default: all cores)"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="render figures even if up to date"
+    )
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="list the figures and the statements that produce them",
+    )
+    args = parser.parse_args(args)
+
+    if args.list:
+        path = os.path.join(args.directory, args.notebook)
+        for job in parse_notebook(path):
+            cells = sorted({s.cell for s in job.statements})
+            print(f"{', '.join(job.outputs)} (cells {', '.join(map(str, cells))})")
+        return
+    results = run(args.directory, args.notebook, args.jobs, args.force)
+    if any(error is not None for error in results.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
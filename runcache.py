@@ -0,0 +1,337 @@
+"""Cache of free-running simulations, keyed by the content of their inputs.
+
+A run directory is identified by a hash of its inputs: gotm.yaml, every
+file referenced from it (forcing, observations, fabm.yaml and any other
+YAML file, recursively), the restart file, the command used to run the
+model and the installed eatpy version. If a run with the same key was
+done before, its outputs (result.nc and any other file the run created or
+changed) are copied into the directory instead of running the model again.
+
+Restored files are ordinary, writable copies, so the model can later be run
+in the directory directly (e.g., with eat-gotm or mpiexec) without
+affecting the cache. Files in the cache itself are read-only. Before a new
+run through this module, files restored earlier are removed from the run
+directory, so that all outputs of the new run are detected.
+
+Usage from the command line, e.g., in a reference directory:
+
+    python ../../runcache.py run            # eat-gotm, or reuse its results
+    python ../../runcache.py run -- eat-gotm --separate_gotm_yaml
+    python ../../runcache.py key            # show the key and its inputs
+    python ../../runcache.py invalidate     # drop the entry for these inputs
+    python ../../runcache.py evict --max-size 10G
+
+The cache lives in the directory given by the environment variable
+EAT_RUN_CACHE, by default ~/.cache/eat/runs.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import time
+from typing import Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import yaml
+
+DEFAULT_COMMAND = ("eat-gotm",)
+DEFAULT_MAX_SIZE = 20 * 2**30
+
+# Written to a run directory to record the files restored from the cache
+MANIFEST = ".runcache.json"
+
+# Files read by GOTM and FABM without being referenced in gotm.yaml
+_IMPLICIT_INPUTS = ("gotm.yaml", "fabm.yaml", "restart.nc")
+
+
+def cache_dir() -> str:
+    return os.environ.get(
+        "EAT_RUN_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "eat", "runs")
+    )
+
+
+def _eatpy_version() -> str:
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+
+        return version("eatpy")
+    except (ImportError, PackageNotFoundError):
+        return "unknown"
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _strings(node) -> Iterable[str]:
+    # All string values in a parsed YAML document
+    if isinstance(node, str):
+        yield node
+    elif isinstance(node, Mapping):
+        for value in node.values():
+            yield from _strings(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _strings(value)
+
+
+def find_inputs(directory: str) -> List[str]:
+    """Paths (relative to ``directory``) of all existing input files.
+    Values in YAML files that name an existing file are followed, also into
+    other YAML files."""
+    inputs = []
+    todo = [name for name in _IMPLICIT_INPUTS]
+    while todo:
+        name = todo.pop(0)
+        path = os.path.normpath(os.path.join(directory, name))
+        relpath = os.path.relpath(path, directory)
+        if relpath in inputs or not os.path.isfile(path):
+            continue
+        inputs.append(relpath)
+        if path.endswith((".yaml", ".yml")):
+            with open(path) as f:
+                document = yaml.safe_load(f)
+            base = os.path.dirname(relpath)
+            for value in _strings(document):
+                value = value.strip()
+                if value and os.path.isfile(os.path.join(directory, base, value)):
+                    todo.append(os.path.join(base, value))
+    return sorted(inputs)
+
+
+def compute_key(
+    directory: str, command: Sequence[str] = DEFAULT_COMMAND
+) -> Tuple[str, Mapping[str, str]]:
+    """Return the cache key of a run and the content hash of each input"""
+    hashes = {
+        path: _hash_file(os.path.join(directory, path))
+        for path in find_inputs(directory)
+    }
+    description = dict(inputs=hashes, command=list(command), eatpy=_eatpy_version())
+    key = hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+    return key, description
+
+
+def _snapshot(directory: str) -> Mapping[str, Tuple[int, int]]:
+    result = {}
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name != MANIFEST:
+            info = entry.stat()
+            result[entry.name] = (info.st_mtime_ns, info.st_size)
+    return result
+
+
+def _remove(path: str):
+    # Remove a file, even if read-only (needed on Windows)
+    try:
+        os.remove(path)
+    except PermissionError:
+        os.chmod(path, stat.S_IWRITE | stat.S_IREAD)
+        os.remove(path)
+
+
+def _rmtree(path: str):
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in files:
+                _remove(os.path.join(root, name))
+        shutil.rmtree(path)
+
+
+def _copy(source: str, target: str):
+    # Copy a cached file to a writable file. Hard links would share the
+    # read-only cached file: later runs could not overwrite it, or would
+    # write through into the cache on filesystems that ignore permissions.
+    if os.path.lexists(target):
+        _remove(target)
+    shutil.copyfile(source, target)
+
+
+def _remove_restored(directory: str):
+    # Remove files restored from the cache by an earlier run, so the
+    # outputs of a new run are detected even if it leaves some unchanged
+    manifest = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(manifest):
+        return
+    with open(manifest) as f:
+        for name in json.load(f)["outputs"]:
+            path = os.path.join(directory, name)
+            if os.path.lexists(path):
+                _remove(path)
+    os.remove(manifest)
+
+
+def _entry_size(entry: str) -> int:
+    return sum(e.stat().st_size for e in os.scandir(entry) if e.is_file())
+
+
+def restore(directory: str, key: str) -> Optional[List[str]]:
+    """Copy the outputs of a cached run into ``directory``. Returns the
+    names of the restored files, or None if there is no such run."""
+    entry = os.path.join(cache_dir(), key)
+    meta_path = os.path.join(entry, "meta.json")
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    _remove_restored(directory)
+    restored = []
+    for name in meta["outputs"]:
+        _copy(os.path.join(entry, "outputs", name), os.path.join(directory, name))
+        # Outputs that are also inputs (e.g., restart.nc) are kept before a
+        # new run, as the user may have modified them
+        if name not in meta["inputs"]:
+            restored.append(name)
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(dict(key=key, outputs=restored), f)
+    os.utime(meta_path)  # records use for least-recently-used eviction
+    return meta["outputs"]
+
+
+def store(directory: str, key: str, description: Mapping, outputs: Iterable[str]):
+    """Move the outputs of a run into the cache and restore them"""
+    outputs = sorted(outputs)
+    entry = os.path.join(cache_dir(), key)
+    tmp = f"{entry}.{os.getpid()}.tmp"
+    os.makedirs(os.path.join(tmp, "outputs"))
+    for name in outputs:
+        target = os.path.join(tmp, "outputs", name)
+        shutil.move(os.path.join(directory, name), target)
+        os.chmod(target, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(dict(description, outputs=outputs, created=time.time()), f, indent=1)
+    _rmtree(entry)
+    os.replace(tmp, entry)
+    restore(directory, key)
+
+
+def run(
+    directory: str = ".",
+    command: Sequence[str] = DEFAULT_COMMAND,
+    max_size: Optional[int] = DEFAULT_MAX_SIZE,
+    force: bool = False,
+) -> bool:
+    """Run ``command`` in ``directory`` unless a cached run with the same
+    inputs exists. Returns whether cached results were used."""
+    key, description = compute_key(directory, command)
+    if not force and restore(directory, key) is not None:
+        print(f"Reusing cached results {key[:12]} in {cache_dir()}")
+        return True
+    _remove_restored(directory)
+    before = _snapshot(directory)
+    subprocess.run(command, cwd=directory, check=True)
+    after = _snapshot(directory)
+    outputs = [name for name, info in after.items() if before.get(name) != info]
+    store(directory, key, description, outputs)
+    if max_size is not None:
+        evict(max_size)
+    return False
+
+
+def invalidate(
+    directory: Optional[str] = ".", command: Sequence[str] = DEFAULT_COMMAND
+):
+    """Remove the cached run for the current inputs of ``directory``, or all
+    cached runs if ``directory`` is None"""
+    if directory is None:
+        _rmtree(cache_dir())
+        return
+    key, _ = compute_key(directory, command)
+    _rmtree(os.path.join(cache_dir(), key))
+
+
+def entries() -> List[Tuple[str, float, int]]:
+    """Cached runs as (key, last use, size in bytes), least recently used first"""
+    result = []
+    root = cache_dir()
+    if os.path.isdir(root):
+        for entry in os.scandir(root):
+            meta = os.path.join(entry.path, "meta.json")
+            if entry.is_dir() and os.path.isfile(meta):
+                size = _entry_size(os.path.join(entry.path, "outputs"))
+                result.append((entry.name, os.path.getmtime(meta), size))
+    return sorted(result, key=lambda e: e[1])
+
+
+def evict(max_size: int):
+    """Remove least recently used runs until the cache is at most ``max_size`` bytes"""
+    cached = entries()
+    total = sum(size for _, _, size in cached)
+    for key, _, size in cached:
+        if total <= max_size:
+            break
+        _rmtree(os.path.join(cache_dir(), key))
+        total -= size
+
+
+def _parse_size(value: str) -> int:
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    p = subparsers.add_parser("run", help="run the model or reuse cached results")
+    p.add_argument("-C", "--directory", default=".", help="run directory")
+    p.add_argument("--force", action="store_true", help="run even if cached")
+    p.add_argument(
+        "--max-size",
+        type=_parse_size,
+        default=DEFAULT_MAX_SIZE,
+        help="cache size limit, e.g., 20G (default: %(default)s bytes)",
+    )
+    p.add_argument("command", nargs="*", help="command to run (default: eat-gotm)")
+    p = subparsers.add_parser("key", help="show the cache key and its inputs")
+    p.add_argument("-C", "--directory", default=".", help="run directory")
+    p.add_argument("command", nargs="*")
+    p = subparsers.add_parser("invalidate", help="remove cached results")
+    p.add_argument("-C", "--directory", default=".", help="run directory")
+    p.add_argument("--all", action="store_true", help="remove all cached runs")
+    p.add_argument("command", nargs="*")
+    p = subparsers.add_parser("evict", help="limit the size of the cache")
+    p.add_argument("--max-size", type=_parse_size, required=True)
+    subparsers.add_parser("list", help="list cached runs")
+    args = parser.parse_args(args)
+
+    command = tuple(getattr(args, "command", None) or DEFAULT_COMMAND)
+    if args.action == "run":
+        try:
+            run(args.directory, command, args.max_size, args.force)
+        except subprocess.CalledProcessError as e:
+            sys.exit(e.returncode)
+    elif args.action == "key":
+        key, description = compute_key(args.directory, command)
+        print(key)
+        for path, digest in description["inputs"].items():
+            print(f"  {digest[:12]}  {path}")
+        print(f"  command: {' '.join(description['command'])}")
+        print(f"  eatpy: {description['eatpy']}")
+    elif args.action == "invalidate":
+        invalidate(None if args.all else args.directory, command)
+    elif args.action == "evict":
+        evict(args.max_size)
+    else:
+        for key, used, size in entries():
+            print(
+                f"{key[:12]}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}  {size / 2**20:10.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
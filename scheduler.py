@@ -0,0 +1,231 @@
+"""Run several experiments of an application concurrently.
+
+Each experiment is a directory. A directory with a run.py script is a data
+assimilation experiment, run as
+
+    mpiexec -n 1 python run.py : -n N eat-gotm [--separate_gotm_yaml]
+
+which takes N + 1 processes. N is the number of member configurations
+(gotm_0001.yaml, ...) in the directory, or 1 if there are none, in which
+case the single gotm.yaml is used. Any other directory is a free run
+(e.g., the reference), executed with eat-gotm in a single process.
+
+Experiments are started largest first, as long as their processes fit in
+the available cores. An experiment that needs more cores than available
+runs when nothing else is running. The output of all experiments is
+streamed to the terminal with the experiment name as prefix, and saved to
+scheduler.log in each experiment directory. Experiments that fail are
+retried without affecting the others. A retried data assimilation
+experiment that has written checkpoints (see checkpoint.py) is resumed from
+the latest one with run.py --resume.
+
+Usage, e.g., from the Ensemble directory:
+
+    python ../scheduler.py reference da_phys da_bgc da_phys_bgc
+"""
+
+import argparse
+import datetime
+import glob
+import os
+import queue
+import subprocess
+import sys
+import threading
+from typing import Iterable, List, Mapping, Optional, Sequence
+
+
+class Experiment:
+    """An experiment directory with the command that runs it"""
+
+    def __init__(self, directory: str, command: Sequence[str], nprocs: int):
+        self.directory = directory
+        # Normalized path rather than the base name, which is not unique
+        # across applications (e.g., Parameters/da and Variational/da)
+        self.name = os.path.normpath(directory)
+        self.command = list(command)
+        self.nprocs = nprocs
+        self.attempts = 0
+        self.returncode: Optional[int] = None
+
+    @classmethod
+    def from_directory(
+        cls,
+        directory: str,
+        members: Optional[int] = None,
+        mpiexec: str = "mpiexec",
+        python: str = sys.executable,
+    ) -> "Experiment":
+        if not os.path.isfile(os.path.join(directory, "run.py")):
+            return cls(directory, ["eat-gotm"], 1)
+        member_files = glob.glob(
+            os.path.join(directory, "gotm_[0-9][0-9][0-9][0-9].yaml")
+        )
+        N = members or len(member_files) or 1
+        command = [mpiexec, "-n", "1", python, "run.py", ":", "-n", str(N), "eat-gotm"]
+        if member_files:
+            command.append("--separate_gotm_yaml")
+        return cls(directory, command, N + 1)
+
+    def resume(self):
+        """Make the next attempt resume from the latest checkpoint, if any"""
+        if "run.py" in self.command and "--resume" not in self.command:
+            pattern = os.path.join(self.directory, "checkpoints", "checkpoint_*.pkl")
+            if glob.glob(pattern):
+                self.command.insert(self.command.index("run.py") + 1, "--resume")
+
+    def __repr__(self) -> str:
+        return f"{self.name} ({self.nprocs} processes): {' '.join(self.command)}"
+
+
+def _stream(
+    experiment: Experiment,
+    process: subprocess.Popen,
+    log,
+    lock: threading.Lock,
+    done: queue.Queue,
+):
+    # Copy the output of a process to the terminal and the log file,
+    # then report its completion
+    for line in process.stdout:
+        with lock:
+            sys.stdout.write(f"[{experiment.name}] {line}")
+            sys.stdout.flush()
+        log.write(line)
+    experiment.returncode = process.wait()
+    log.close()
+    done.put(experiment)
+
+
+def run(
+    experiments: Iterable[Experiment], cores: Optional[int] = None, retries: int = 1
+) -> Mapping[str, int]:
+    """Run experiments concurrently on at most ``cores`` processes (default:
+    all cores), retrying each failed experiment up to ``retries`` times.
+    Returns the final return code of each experiment by its name, the
+    normalized path of its directory. Each directory may occur only once."""
+    cores = cores or os.cpu_count() or 1
+    experiments = list(experiments)
+    directories = {}
+    for experiment in experiments:
+        path = os.path.realpath(experiment.directory)
+        if path in directories:
+            raise ValueError(
+                f"{experiment.directory} is the same directory as"
+                f" {directories[path]}; each experiment can be run only once."
+            )
+        directories[path] = experiment.directory
+    pending: List[Experiment] = sorted(experiments, key=lambda e: -e.nprocs)
+    running: List[Experiment] = []
+    finished: List[Experiment] = []
+    done = queue.Queue()
+    lock = threading.Lock()
+
+    def say(message: str):
+        with lock:
+            print(f"[scheduler] {message}", flush=True)
+
+    while pending or running:
+        # Start all pending experiments that fit in the free cores
+        free = cores - sum(e.nprocs for e in running)
+        for experiment in list(pending):
+            if experiment.nprocs <= free or not running:
+                pending.remove(experiment)
+                experiment.attempts += 1
+                log = open(
+                    os.path.join(experiment.directory, "scheduler.log"),
+                    "a" if experiment.attempts > 1 else "w",
+                )
+                log.write(
+                    f"# attempt {experiment.attempts} started"
+                    f" {datetime.datetime.now():%Y-%m-%d %H:%M:%S}:"
+                    f" {' '.join(experiment.command)}\n"
+                )
+                log.flush()
+                running.append(experiment)
+                try:
+                    process = subprocess.Popen(
+                        experiment.command,
+                        cwd=experiment.directory,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT,
+                        text=True,
+                        bufsize=1,
+                    )
+                except OSError as e:
+                    log.write(f"{e}\n")
+                    log.close()
+                    experiment.returncode = 127
+                    done.put(experiment)
+                else:
+                    threading.Thread(
+                        target=_stream,
+                        args=(experiment, process, log, lock, done),
+                        daemon=True,
+                    ).start()
+                free -= experiment.nprocs
+                say(f"started {experiment!r} (attempt {experiment.attempts})")
+
+        experiment = done.get()
+        running.remove(experiment)
+        if experiment.returncode == 0:
+            say(f"{experiment.name} finished")
+            finished.append(experiment)
+        elif experiment.attempts <= retries:
+            say(f"{experiment.name} failed with code {experiment.returncode}, retrying")
+            experiment.resume()
+            pending.append(experiment)
+            pending.sort(key=lambda e: -e.nprocs)
+        else:
+            say(f"{experiment.name} failed with code {experiment.returncode}")
+            finished.append(experiment)
+
+    return {e.name: e.returncode for e in finished}
+
+
+def main(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument("directories", nargs="+", help="experiment directories")
+    parser.add_argument(
+        "--cores", type=int, help="number of processes to use (default: all cores)"
+    )
+    parser.add_argument(
+        "--members",
+        type=int,
+        help="ensemble size (default: number of gotm_NNNN.yaml files)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=1,
+        help="number of times to retry a failed experiment (default: %(default)s)",
+    )
+    parser.add_argument("--mpiexec", default="mpiexec", help="MPI launcher")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only show the commands to run"
+    )
+    args = parser.parse_args(args)
+
+    experiments = [
+        Experiment.from_directory(d, args.members, args.mpiexec)
+        for d in args.directories
+    ]
+    if args.dry_run:
+        print("\n".join(repr(e) for e in experiments))
+        return
+    try:
+        results = run(experiments, args.cores, args.retries)
+    except ValueError as e:
+        parser.error(str(e))
+    failed = [name for name, code in results.items() if code != 0]
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
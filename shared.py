@@ -1,65 +1,1028 @@
 import datetime
 import os.path
-from typing import Tuple, List, Optional
+from typing import (
+    TYPE_CHECKING,
+    Tuple,
+    List,
+    Optional,
+    Iterable,
+    Mapping,
+    NamedTuple,
+    Union,
+)
 import pickle
+import concurrent.futures
+import collections
+import hashlib
+import json
+import shutil
+import glob
 
 import numpy as np
 
-import netCDF4
-import matplotlib.dates
-
-
-def read_0d_observations(path: str) -> np.ndarray:
-    obs = []
-    for l in open(os.path.join(path)):
-        if not l.startswith("#"):
-            dt, value, sd = l.rstrip().rsplit(maxsplit=2)
-            mu = float(value)
-            sigma = float(sd)
-            p25 = mu - 0.67448 * sigma
-            p75 = mu + 0.67448 * sigma
-            obs.append(
-                [datetime.datetime.strptime(dt, "%Y-%m-%d %H:%M:%S"), mu, p25, p75]
+# netCDF4 and matplotlib are imported where needed, so that importing this
+# module (e.g., in worker processes that only read results) is fast
+if TYPE_CHECKING:
+    import netCDF4
+    import matplotlib.colors
+
+
+class Observations(NamedTuple):
+    """Time series of observations, with the 25th and 75th percentiles
+    derived from the reported standard deviation."""
+
+    time: np.ndarray
+    value: np.ndarray
+    p25: np.ndarray
+    p75: np.ndarray
+
+    def transform(self, fn) -> "Observations":
+        """Apply a monotonically increasing transformation such as
+        ``lambda x: 10.0**x`` to the observed values and percentiles."""
+        return self._replace(value=fn(self.value), p25=fn(self.p25), p75=fn(self.p75))
+
+
+# Number of standard deviations between median and quartiles
+# of a normal distribution
+_QUARTILE_SD = 0.67448
+
+_OBSERVATION_DTYPE = [
+    ("date", "U10"),
+    ("time", "U8"),
+    ("value", "f8"),
+    ("sd", "f8"),
+]
+
+
+def parse_0d_observations(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Parse a file with lines "YYYY-MM-DD hh:mm:ss value sd" (comment lines
+    start with #) into arrays of time (datetime64[s]), value and standard
+    deviation."""
+    data = np.loadtxt(path, dtype=_OBSERVATION_DTYPE, comments="#", ndmin=1)
+    time = np.char.add(np.char.add(data["date"], "T"), data["time"])
+    return time.astype("datetime64[s]"), data["value"], data["sd"]
+
+
+def _load_0d_observations(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Use the binary sidecar file if it was written for the current version
+    # of the observation file, as identified by its modification time and size
+    st = os.stat(path)
+    cache_path = f"{path}.cache.npz"
+    try:
+        with np.load(cache_path) as cache:
+            if cache["mtime_ns"] == st.st_mtime_ns and cache["size"] == st.st_size:
+                return cache["time"], cache["value"], cache["sd"]
+    except (OSError, KeyError, ValueError):
+        pass
+    time, value, sd = parse_0d_observations(path)
+    try:
+        with open(cache_path, "wb") as f:
+            np.savez(
+                f,
+                time=time,
+                value=value,
+                sd=sd,
+                mtime_ns=st.st_mtime_ns,
+                size=st.st_size,
             )
-    return np.array(obs).reshape(-1, 4)
+    except OSError:
+        pass
+    return time, value, sd
+
+
+def read_0d_observations(path: str) -> Observations:
+    time, value, sd = _load_0d_observations(path)
+    p25 = value - _QUARTILE_SD * sd
+    p75 = value + _QUARTILE_SD * sd
+    return Observations(time, value, p25, p75)
+
+
+# Variables that are identical across ensemble members. A consolidated
+# ensemble store keeps a single copy of these.
+_SHARED_VARIABLES = ("time", "z", "zi", "lat", "lon")
+
+
+_TIME_UNITS = {
+    "seconds": "s",
+    "second": "s",
+    "minutes": "m",
+    "minute": "m",
+    "hours": "h",
+    "hour": "h",
+    "days": "D",
+    "day": "D",
+}
+
+Level = Union[None, int, slice]
+TimeLike = Union[None, str, datetime.datetime, np.datetime64]
+
+
+def _decode_time(nctime: "netCDF4.Variable") -> np.ndarray:
+    """Decode a CF time variable to datetime64[s] without creating
+    Python datetime objects (only standard calendars)."""
+    import netCDF4
+
+    values = nctime[:]
+    unit, _, reference = nctime.units.partition(" since ")
+    calendar = getattr(nctime, "calendar", "standard").lower()
+    if unit.strip().lower() in _TIME_UNITS and calendar in (
+        "standard",
+        "gregorian",
+        "proleptic_gregorian",
+    ):
+        try:
+            ref = np.datetime64(reference.strip().replace(" ", "T"), "s")
+        except ValueError:
+            pass
+        else:
+            code = _TIME_UNITS[unit.strip().lower()]
+            seconds = np.asarray(values, dtype=float) * (
+                np.timedelta64(1, code) / np.timedelta64(1, "s")
+            )
+            return ref + np.round(seconds).astype("timedelta64[s]")
+    time = netCDF4.num2date(
+        values,
+        nctime.units,
+        calendar=calendar,
+        only_use_cftime_datetimes=False,
+        only_use_python_datetimes=True,
+    )
+    return np.asarray(time, dtype="datetime64[s]")
+
+
+def _time_window(time: np.ndarray, start: TimeLike, stop: TimeLike) -> slice:
+    # Indices of all times with start <= time <= stop
+    istart, istop = 0, time.size
+    if start is not None:
+        istart = np.searchsorted(time, np.datetime64(start, "s"), side="left")
+    if stop is not None:
+        istop = np.searchsorted(time, np.datetime64(stop, "s"), side="right")
+    return slice(istart, istop)
+
+
+def _read_time_and_z(
+    nc: "netCDF4.Dataset",
+    start: TimeLike = None,
+    stop: TimeLike = None,
+    level: Level = None,
+) -> Tuple[np.ndarray, np.ndarray, slice]:
+    time = _decode_time(nc["time"])
+    window = _time_window(time, start, stop)
+    z = -nc["z"][window, slice(None) if level is None else level, 0, 0]
+    return time[window], z, window
+
+
+def _index(ncvar: "netCDF4.Variable", window: slice, level: Level) -> tuple:
+    # Hyperslab for a time window and depth level of a (time, [z,] lat, lon)
+    # variable
+    index = (window,)
+    if "z" in ncvar.dimensions or "zi" in ncvar.dimensions:
+        index += (slice(None) if level is None else level,)
+    return index + (0, 0)
+
+
+def ensemble_store_path(path: str) -> str:
+    """Path of the consolidated ensemble store for results named like
+    ``path``, e.g., result_ensemble.nc for result.nc"""
+    pathname, pathext = os.path.splitext(path)
+    return f"{pathname}_ensemble{pathext}"
+
+
+def _member_paths(path: str, N: int) -> List[str]:
+    pathname, pathext = os.path.splitext(path)
+    return [f"{pathname}_{i:04}{pathext}" for i in range(1, N + 1)]
+
+
+def _use_store(store: str, member_path: str) -> bool:
+    # Use the store if it exists and is not older than the member files
+    if not os.path.isfile(store):
+        return False
+    if not os.path.isfile(member_path):
+        return True
+    return os.path.getmtime(store) >= os.path.getmtime(member_path)
+
+
+def _member_in_store(path: str) -> Optional[Tuple[str, int]]:
+    # Map result_NNNN.nc to the store and zero-based member index,
+    # if the store should be used instead of the member file
+    pathname, pathext = os.path.splitext(path)
+    base, _, number = pathname.rpartition("_")
+    if not (base and len(number) == 4 and number.isdigit()):
+        return None
+    store = ensemble_store_path(base + pathext)
+    if _use_store(store, path):
+        return store, int(number) - 1
+    return None
+
+
+# Result of reading a single variable: time, depth, values, long name, units
+_Result = Tuple[np.ndarray, np.ndarray, np.ndarray, str, str]
+
+
+class ResultCache:
+    """Memoizes variables read from result files.
+
+    Entries are identified by the reader arguments and the modification
+    time and size of every file the result depends on, so they become
+    invalid as soon as any of these files changes. Recently used entries
+    are kept in memory up to ``max_bytes``. If ``directory`` is set,
+    entries are also saved there as .npy files, up to ``max_disk_bytes``,
+    and memory-mapped when read back, e.g., in a later session.
+
+    Cached arrays are shared between callers and therefore read-only.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 2**30,
+        directory: Optional[str] = None,
+        max_disk_bytes: int = 10 * 2**30,
+    ):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def key(*args, paths: Iterable[str]) -> str:
+        """Key for reader arguments and the current state of the given files"""
+        signature = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signature.append((os.path.abspath(path), st.st_mtime_ns, st.st_size))
+        return repr((args, signature))
+
+    def get(self, key: str) -> Optional[_Result]:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+        if self.directory is not None:
+            result = self._load(key)
+            if result is not None:
+                return self._remember(key, result)
+        return None
+
+    def put(self, key: str, result: _Result) -> _Result:
+        """Add a result and return it with arrays made read-only"""
+        for array in result[:3]:
+            array.setflags(write=False)
+            if np.ma.getmask(array) is not np.ma.nomask:
+                np.ma.getmask(array).setflags(write=False)
+        if self.directory is not None:
+            self._save(key, result)
+        return self._remember(key, result)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _remember(self, key: str, result: _Result) -> _Result:
+        size = sum(np.asarray(a).nbytes for a in result[:3])
+        if size > self.max_bytes:
+            return result
+        self._entries[key] = (result, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, old_size) = self._entries.popitem(last=False)
+            self._bytes -= old_size
+        return result
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def _save(self, key: str, result: _Result):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        masked = []
+        for name, array in zip(("time", "z", "values"), result[:3]):
+            np.save(os.path.join(tmp, f"{name}.npy"), np.ma.getdata(array))
+            if np.ma.isMaskedArray(array):
+                masked.append(name)
+                if np.ma.getmask(array) is not np.ma.nomask:
+                    np.save(os.path.join(tmp, f"{name}.mask.npy"), array.mask)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(dict(key=key, masked=masked, attrs=result[3:]), f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        self._evict_disk()
+
+    def _load(self, key: str) -> Optional[_Result]:
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta["key"] != key:
+            return None
+        arrays = []
+        for name in ("time", "z", "values"):
+            array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            if name in meta["masked"]:
+                mask_path = os.path.join(path, f"{name}.mask.npy")
+                mask = np.ma.nomask
+                if os.path.isfile(mask_path):
+                    mask = np.load(mask_path, mmap_mode="r")
+                array = np.ma.MaskedArray(array, mask=mask, copy=False)
+            arrays.append(array)
+        os.utime(os.path.join(path, "meta.json"))  # for least-recently-used eviction
+        return (*arrays, *meta["attrs"])
+
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            meta = os.path.join(entry.path, "meta.json")
+            if entry.is_dir() and os.path.isfile(meta):
+                size = sum(e.stat().st_size for e in os.scandir(entry.path))
+                entries.append((os.path.getmtime(meta), size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+# Cache used by read_result, read_ensemble_result and read_ensemble_results
+result_cache = ResultCache()
+
+
+def configure_result_cache(
+    max_bytes: int = 2**30,
+    directory: Optional[str] = None,
+    max_disk_bytes: int = 10 * 2**30,
+):
+    """Set the memory budget of the result cache and, optionally, a directory
+    for cached results to persist across sessions. A budget of 0 disables
+    the memory tier."""
+    global result_cache
+    result_cache = ResultCache(max_bytes, directory, max_disk_bytes)
 
 
 def read_result(
-    path: str, name: str
-) -> Tuple[List[datetime.datetime], np.ndarray, np.ndarray, str, str]:
+    path: str,
+    name: str,
+    start: TimeLike = None,
+    stop: TimeLike = None,
+    level: Level = None,
+) -> _Result:
+    """Read a variable from a GOTM result file.
+
+    Optionally, only times between ``start`` and ``stop`` (inclusive) and a
+    depth index or slice ``level`` (e.g., -1 for the surface) are read.
+    These selections are passed on to the NetCDF library, so only the
+    requested part of the variable is read from disk.
+
+    Results are memoized in :data:`result_cache` until the file changes.
+    The returned arrays are read-only.
+
+    Returns time (datetime64), depth, values, long name and units.
+    """
+    member = _member_in_store(path)
+    paths = [path] if member is None else [path, member[0]]
+    key = ResultCache.key("result", path, name, start, stop, level, paths=paths)
+    result = result_cache.get(key)
+    if result is None:
+        result = result_cache.put(key, _read_result(path, name, start, stop, level))
+    return result
+
+
+def _read_result(
+    path: str,
+    name: str,
+    start: TimeLike = None,
+    stop: TimeLike = None,
+    level: Level = None,
+) -> _Result:
+    import netCDF4
+
+    member = _member_in_store(path)
+    if member is not None:
+        path, imember = member
     with netCDF4.Dataset(path) as nc:
-        nctime = nc["time"]
-        time = netCDF4.num2date(
-            nctime,
-            nctime.units,
-            only_use_cftime_datetimes=False,
-            only_use_python_datetimes=True,
-        )
-        z = -nc["z"][:, :, 0, 0]
+        time, z, window = _read_time_and_z(nc, start, stop, level)
         ncvar = nc[name]
-        values = ncvar[..., 0, 0]
+        index = _index(ncvar, window, level)
+        if member is not None:
+            index = (imember,) + index
+        values = ncvar[index]
         return time, z, values, ncvar.long_name, ncvar.units
 
 
-def read_ensemble_result(
-    path: str, name: str, N: int
-) -> Tuple[List[datetime.datetime], np.ndarray, np.ndarray, str, str]:
+def consolidate_ensemble(
+    path: str,
+    N: int,
+    time_chunk: int = 256,
+    complevel: int = 4,
+    remove_members: bool = False,
+) -> str:
+    """Merge the results of all ensemble members into a single compressed
+    NetCDF file with a leading "member" dimension.
+
+    Variables in ``_SHARED_VARIABLES`` and variables without time dimension
+    are stored once. All others are chunked as (1 member, time_chunk times,
+    all levels), which serves reads of a single member as well as reads of
+    a time window across all members. The readers in this module detect
+    and use the resulting store automatically. Returns its path.
+    """
+    import netCDF4
+
+    paths = _member_paths(path, N)
+    store = ensemble_store_path(path)
+    tmp = f"{store}.{os.getpid()}.tmp"
+    with netCDF4.Dataset(paths[0]) as src, netCDF4.Dataset(tmp, "w") as dst:
+        dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+        dst.createDimension("member", N)
+        for dimname, dim in src.dimensions.items():
+            dst.createDimension(dimname, None if dim.isunlimited() else len(dim))
+        member_vars = []
+        for name, var in src.variables.items():
+            per_member = name not in _SHARED_VARIABLES and "time" in var.dimensions
+            dims = var.dimensions
+            chunks = None
+            if per_member:
+                dims = ("member",) + dims
+                chunks = [1] + [
+                    (
+                        min(time_chunk, len(src.dimensions[d]))
+                        if d == "time"
+                        else len(src.dimensions[d])
+                    )
+                    for d in var.dimensions
+                ]
+                member_vars.append(name)
+            fill_value = (
+                var.getncattr("_FillValue") if "_FillValue" in var.ncattrs() else None
+            )
+            ncvar = dst.createVariable(
+                name,
+                var.dtype,
+                dims,
+                zlib=True,
+                complevel=complevel,
+                chunksizes=chunks,
+                fill_value=fill_value,
+            )
+            ncvar.setncatts(
+                {k: var.getncattr(k) for k in var.ncattrs() if k != "_FillValue"}
+            )
+            if not per_member:
+                ncvar[...] = var[...]
+        for i, member_path in enumerate(paths):
+            with netCDF4.Dataset(member_path) as member:
+                for name in member_vars:
+                    dst[name][i, ...] = member[name][...]
+    os.replace(tmp, store)
+    if remove_members:
+        for member_path in paths:
+            os.remove(member_path)
+    return store
+
+
+def ensemble_size(path: str) -> int:
+    """Number of ensemble members with results named like ``path``: the
+    member dimension of the consolidated store if the readers in this
+    module would use it, otherwise the number of member files (e.g.,
+    result_0001.nc, ...). The store remains usable after its member files
+    were removed."""
+    import netCDF4
+
     pathname, pathext = os.path.splitext(path)
-    results = []
-    for i in range(1, N + 1):
-        time, z, values, long_name, units = read_result(
-            f"{pathname}_{i:04}{pathext}", name
+    members = sorted(glob.glob(f"{pathname}_[0-9][0-9][0-9][0-9]{pathext}"))
+    store = ensemble_store_path(path)
+    if members and not _use_store(store, members[0]):
+        return len(members)
+    if os.path.isfile(store):
+        with netCDF4.Dataset(store) as nc:
+            return len(nc.dimensions["member"])
+    return 0
+
+
+def _read_member(
+    path: str, names: Iterable[str], window: slice = slice(None), level: Level = None
+) -> List[np.ndarray]:
+    import netCDF4
+
+    with netCDF4.Dataset(path) as nc:
+        return [nc[name][_index(nc[name], window, level)] for name in names]
+
+
+def read_ensemble_results(
+    path: str,
+    names: Iterable[str],
+    N: int,
+    max_workers: Optional[int] = None,
+    start: TimeLike = None,
+    stop: TimeLike = None,
+    level: Level = None,
+    processes: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, Mapping[str, Tuple[np.ndarray, str, str]]]:
+    """Read one or more variables from all ensemble members.
+
+    If a consolidated store created by :func:`consolidate_ensemble` is
+    present and holds at least ``N`` members, all variables are read from
+    that single file. A store with fewer members is ignored in favour of
+    the member files; if these are missing too, ValueError is raised. Otherwise, each
+    member file is opened only once, no matter how many variables are
+    requested. Time and depth are decoded from the first member only.
+    Remaining members are read in a pool of threads (``max_workers=1``
+    reads serially) and stored in one preallocated array per variable with
+    shape (member, time, ...). netCDF4 releases the GIL while reading, so
+    threads overlap the I/O without the start-up cost of processes, which
+    re-import numpy and netCDF4 on platforms that spawn them (macOS,
+    Windows). With ``processes=True``, a pool of processes is used instead,
+    which may pay off for many large, compressed member files. Arguments ``start``,
+    ``stop`` and ``level`` select a time window and depth level as in
+    :func:`read_result`.
+
+    Results are memoized per variable in :data:`result_cache` until any
+    member file or the store changes, so only variables not read before are
+    read from disk. The returned arrays are read-only.
+
+    Returns time, depth and a dictionary that maps each variable name to
+    a tuple with values, long name and units.
+    """
+    names = list(names)
+    paths = _member_paths(path, N)
+    files = paths + [ensemble_store_path(path)]
+    keys = {
+        name: ResultCache.key(
+            "ensemble", path, name, N, start, stop, level, paths=files
+        )
+        for name in names
+    }
+    cached = {name: result_cache.get(key) for name, key in keys.items()}
+    missing = [name for name, result in cached.items() if result is None]
+    if missing:
+        time, z, results = _read_ensemble_results(
+            path, missing, N, max_workers, start, stop, level, processes
         )
-        results.append(values)
-    return time, z, np.array(results), long_name, units
+        for name, (values, long_name, units) in results.items():
+            entry = (time, z, values, long_name, units)
+            cached[name] = result_cache.put(keys[name], entry)
+    time, z = cached[names[0]][:2]
+    return time, z, {name: cached[name][2:] for name in names}
+
+
+def _read_ensemble_results(
+    path: str,
+    names: List[str],
+    N: int,
+    max_workers: Optional[int] = None,
+    start: TimeLike = None,
+    stop: TimeLike = None,
+    level: Level = None,
+    processes: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, Mapping[str, Tuple[np.ndarray, str, str]]]:
+    import netCDF4
 
+    paths = _member_paths(path, N)
 
-def plot_0d_timeseries(ax, time, values, obs, label: str = "model", extra_series=[]):
-    low = obs[:, 1] - obs[:, 2]
-    high = obs[:, 3] - obs[:, 1]
+    store = ensemble_store_path(path)
+    if _use_store(store, paths[0]):
+        results = {}
+        with netCDF4.Dataset(store) as nc:
+            size = len(nc.dimensions["member"])
+            if size >= N:
+                time, z, window = _read_time_and_z(nc, start, stop, level)
+                for name in names:
+                    ncvar = nc[name]
+                    values = ncvar[(slice(N),) + _index(ncvar, window, level)]
+                    results[name] = (np.asarray(values), ncvar.long_name, ncvar.units)
+                return time, z, results
+
+        # The store was consolidated from a smaller ensemble
+        missing = [p for p in paths if not os.path.isfile(p)]
+        if missing:
+            raise ValueError(
+                f"{store} holds {size} members, fewer than the {N} requested,"
+                f" and {len(missing)} member files (e.g., {missing[0]}) are missing."
+            )
+
+    results = {}
+    with netCDF4.Dataset(paths[0]) as nc:
+        time, z, window = _read_time_and_z(nc, start, stop, level)
+        for name in names:
+            ncvar = nc[name]
+            values = ncvar[_index(ncvar, window, level)]
+            all_values = np.empty((N,) + values.shape, dtype=values.dtype)
+            all_values[0] = values
+            results[name] = (all_values, ncvar.long_name, ncvar.units)
+
+    if N > 1:
+        if max_workers is None:
+            max_workers = min(N - 1, os.cpu_count() or 1)
+        if max_workers > 1:
+            if processes:
+                pool = concurrent.futures.ProcessPoolExecutor
+            else:
+                pool = concurrent.futures.ThreadPoolExecutor
+            with pool(max_workers) as executor:
+                members = executor.map(
+                    _read_member,
+                    paths[1:],
+                    [names] * (N - 1),
+                    [window] * (N - 1),
+                    [level] * (N - 1),
+                )
+                for i, member in enumerate(members, start=1):
+                    for name, values in zip(names, member):
+                        results[name][0][i] = values
+        else:
+            for i, p in enumerate(paths[1:], start=1):
+                for name, values in zip(names, _read_member(p, names, window, level)):
+                    results[name][0][i] = values
+
+    return time, z, results
+
+
+def read_ensemble_result(
+    path: str,
+    name: str,
+    N: int,
+    max_workers: Optional[int] = None,
+    start: TimeLike = None,
+    stop: TimeLike = None,
+    level: Level = None,
+    processes: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, str, str]:
+    time, z, results = read_ensemble_results(
+        path, [name], N, max_workers, start, stop, level, processes
+    )
+    values, long_name, units = results[name]
+    return time, z, values, long_name, units
+
+
+class EnsembleStatistics(NamedTuple):
+    """Summary statistics of an ensemble, computed across members."""
+
+    min: np.ndarray
+    p25: np.ndarray
+    median: np.ndarray
+    p75: np.ndarray
+    max: np.ndarray
+    mean: np.ndarray
+    std: np.ndarray
+
+
+# Quantiles tracked by the ensemble statistics: min, quartiles and max
+_QUANTILES = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+
+
+def ensemble_statistics(ens: np.ndarray) -> EnsembleStatistics:
+    """Compute ensemble statistics across the first (member) axis.
+
+    All order statistics come from a single partition of the data, which is
+    much cheaper than separate calls to np.percentile, np.median, np.min and
+    np.max. Quantiles are linearly interpolated as in np.percentile.
+    """
+    ens = np.asarray(ens)
+    N = ens.shape[0]
+    pos = _QUANTILES * (N - 1)
+    lo = np.floor(pos).astype(int)
+    hi = np.ceil(pos).astype(int)
+    part = np.partition(ens, np.union1d(lo, hi), axis=0)
+    w = (pos - lo).reshape((-1,) + (1,) * (ens.ndim - 1))
+    q = (1.0 - w) * part[lo] + w * part[hi]
+    mean = ens.mean(axis=0)
+    return EnsembleStatistics(*q, mean, ens.std(axis=0))
+
+
+class EnsembleStatisticsAccumulator:
+    """Streaming ensemble statistics with memory use independent of
+    ensemble size. Members are added one at a time with :meth:`add`.
+
+    Minimum, maximum, mean and standard deviation are exact (the latter two
+    use Welford's algorithm). Quartiles are estimated with the P² algorithm
+    of Jain & Chlamtac (1985), which tracks five markers per value
+    (min, 1st quartile, median, 3rd quartile, max). The first five members
+    are buffered, so for ensembles of up to five members all statistics
+    are exact.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._buffer: List[np.ndarray] = []
+
+    def add(self, values: np.ndarray):
+        x = np.asarray(values, dtype=float)
+        self.count += 1
+        if self.count == 1:
+            self._mean = x.copy()
+            self._m2 = np.zeros_like(x)
+        else:
+            delta = x - self._mean
+            self._mean += delta / self.count
+            self._m2 += delta * (x - self._mean)
+
+        if self.count <= _QUANTILES.size:
+            self._buffer.append(x.copy())
+            if self.count == _QUANTILES.size:
+                self._q = np.sort(np.stack(self._buffer, axis=-1), axis=-1)
+                self._n = np.broadcast_to(
+                    np.arange(1.0, _QUANTILES.size + 1), self._q.shape
+                ).copy()
+                self._buffer = []
+            return
+
+        q, n = self._q, self._n
+
+        # Find the cell k with q[k] <= x < q[k + 1], extending the extremes
+        # if needed, and shift the positions of all markers above it.
+        k = (x[..., np.newaxis] >= q[..., 1:4]).sum(axis=-1)
+        np.minimum(q[..., 0], x, out=q[..., 0])
+        np.maximum(q[..., 4], x, out=q[..., 4])
+        n[..., 1:] += np.arange(1, 5) > k[..., np.newaxis]
+
+        # Move interior markers towards their desired positions
+        desired = 1.0 + (self.count - 1) * _QUANTILES
+        for i in (1, 2, 3):
+            d = desired[i] - n[..., i]
+            up = (d >= 1.0) & (n[..., i + 1] - n[..., i] > 1.0)
+            down = (d <= -1.0) & (n[..., i - 1] - n[..., i] < -1.0)
+            move = up | down
+            if not move.any():
+                continue
+            d = np.where(up, 1.0, -1.0)
+            qm, qi, qp = q[..., i - 1], q[..., i], q[..., i + 1]
+            nm, ni, np_ = n[..., i - 1], n[..., i], n[..., i + 1]
+            parabolic = qi + d / (np_ - nm) * (
+                (ni - nm + d) * (qp - qi) / (np_ - ni)
+                + (np_ - ni - d) * (qi - qm) / (ni - nm)
+            )
+            linear = qi + d * np.where(
+                up, (qp - qi) / (np_ - ni), (qm - qi) / (nm - ni)
+            )
+            ok = (qm < parabolic) & (parabolic < qp)
+            q[..., i] = np.where(move, np.where(ok, parabolic, linear), qi)
+            n[..., i] += np.where(move, d, 0.0)
+
+    def result(self) -> EnsembleStatistics:
+        if self.count == 0:
+            raise ValueError("No ensemble members have been added.")
+        std = np.sqrt(self._m2 / self.count)
+        if self.count < _QUANTILES.size:
+            stats = ensemble_statistics(np.stack(self._buffer))
+            return stats._replace(mean=self._mean.copy(), std=std)
+        q = np.moveaxis(self._q, -1, 0)
+        return EnsembleStatistics(*q, self._mean.copy(), std)
+
+
+def stream_ensemble_statistics(
+    path: str,
+    name: str,
+    N: int,
+    filter_period: int = 1,
+    start: TimeLike = None,
+    stop: TimeLike = None,
+    level: Level = None,
+) -> Tuple[np.ndarray, np.ndarray, EnsembleStatistics, str, str]:
+    """Compute ensemble statistics for a single variable while reading one
+    member at a time. Memory use therefore does not grow with ensemble size.
+    If ``filter_period`` is not 1, each member is first median-filtered in
+    time, as in :func:`plot_0d_ensemble_timeseries`.
+    """
+    acc = EnsembleStatisticsAccumulator()
+    for member_path in _member_paths(path, N):
+        # Bypass the result cache: members are only needed once here
+        time, z, values, long_name, units = _read_result(
+            member_path, name, start, stop, level
+        )
+        if filter_period != 1:
+            import scipy.signal
+
+            kernel = (filter_period,) + (1,) * (values.ndim - 1)
+            values = scipy.signal.medfilt(values, kernel)
+        acc.add(values)
+    return time, z, acc.result(), long_name, units
+
+
+class _LevelOfDetail:
+    """Keeps artists of an axes aggregated to its pixel resolution.
+
+    Each registered update function receives the visible x range (in
+    Matplotlib date numbers) and the axes width in pixels, and is called
+    again whenever the x range changes, e.g., when zooming or panning.
+    """
+
+    def __init__(self, ax):
+        self.ax = ax
+        self.updaters = []
+        ax.callbacks.connect("xlim_changed", self._on_xlim_changed)
+
+    @classmethod
+    def get(cls, ax) -> "_LevelOfDetail":
+        lod = getattr(ax, "_level_of_detail", None)
+        if lod is None:
+            lod = ax._level_of_detail = cls(ax)
+        return lod
+
+    @property
+    def nbins(self) -> int:
+        return max(int(self.ax.bbox.width), 1)
+
+    def add(self, update):
+        self.updaters.append(update)
+
+    def _on_xlim_changed(self, ax):
+        xmin, xmax = ax.get_xlim()
+        # Replacing artists should not trigger rescaling of the axes
+        autoscale = ax.get_autoscalex_on(), ax.get_autoscaley_on()
+        ax.set_autoscale_on(False)
+        try:
+            for update in self.updaters:
+                update(xmin, xmax, self.nbins)
+        finally:
+            ax.set_autoscalex_on(autoscale[0])
+            ax.set_autoscaley_on(autoscale[1])
+
+
+def _bins(
+    x: np.ndarray, xmin: Optional[float], xmax: Optional[float], nbins: int
+) -> Tuple[slice, Optional[np.ndarray]]:
+    """Return the visible range of x (including one point beyond either
+    side) and, if it contains more points than there are bins, the start
+    index of each non-empty bin within that range."""
+    i0 = 0 if xmin is None else max(np.searchsorted(x, xmin) - 1, 0)
+    i1 = x.size if xmax is None else min(np.searchsorted(x, xmax, "right") + 1, x.size)
+    visible = slice(i0, i1)
+    xs = x[visible]
+    if xs.size <= 2 * nbins:
+        return visible, None
+    edges = np.linspace(xs[0], xs[-1], nbins + 1)[:-1]
+    return visible, np.unique(np.searchsorted(xs, edges))
+
+
+def _minmax(x: np.ndarray, low: np.ndarray, high: np.ndarray, xmin, xmax, nbins: int):
+    """Min/max-preserving aggregation: within each bin, the lowest value of
+    ``low`` and the highest value of ``high`` are kept, at the first and
+    last x of the bin. Returns x, low and high, and whether any aggregation
+    was done."""
+    visible, starts = _bins(x, xmin, xmax, nbins)
+    xs = x[visible]
+    if starts is None:
+        return xs, low[visible], high[visible], False
+    ends = np.append(starts[1:], xs.size) - 1
+    lowb = np.minimum.reduceat(low[visible], starts)
+    highb = np.maximum.reduceat(high[visible], starts)
+    xb = np.column_stack((xs[starts], xs[ends])).ravel()
+    return xb, np.repeat(lowb, 2), np.repeat(highb, 2), True
+
+
+def _as_float(values) -> np.ndarray:
+    return np.ma.filled(np.ma.asarray(values, dtype=float), np.nan)
+
+
+def _plot_line(ax, time, values, fmt: str, lod: bool, **kwargs):
+    import matplotlib.dates
+
+    if not lod:
+        return ax.plot_date(time, values, fmt, **kwargs)[0]
+    x = matplotlib.dates.date2num(time)
+    y = _as_float(values)
+    lod = _LevelOfDetail.get(ax)
+
+    def points(xmin, xmax, nbins):
+        # Each bin becomes a vertical segment from its minimum to its maximum
+        xb, low, high, aggregated = _minmax(x, y, y, xmin, xmax, nbins)
+        if aggregated:
+            low[1::2] = high[1::2]
+        return xb, low
+
+    (line,) = ax.plot_date(*points(None, None, lod.nbins), fmt, **kwargs)
+    lod.add(lambda *view: line.set_data(*points(*view)))
+    return line
+
+
+def _fill_between(ax, time, low, high, lod: bool, **kwargs):
+    import matplotlib.dates
+
+    if not lod:
+        return ax.fill_between(time, low, high, **kwargs)
+    x = matplotlib.dates.date2num(time)
+    low, high = _as_float(low), _as_float(high)
+    lod = _LevelOfDetail.get(ax)
+    poly = ax.fill_between(*_minmax(x, low, high, None, None, lod.nbins)[:3], **kwargs)
+
+    def update(xmin, xmax, nbins):
+        xb, lowb, highb, _ = _minmax(x, low, high, xmin, xmax, nbins)
+        upper = np.column_stack((xb, highb))
+        lower = np.column_stack((xb[::-1], lowb[::-1]))
+        poly.set_verts([np.concatenate((upper, lower))])
+
+    lod.add(update)
+    return poly
+
+
+def _contour_norm(values, args, kwargs) -> Optional["matplotlib.colors.Normalize"]:
+    # Discrete color normalization matching the levels contourf would use
+    import matplotlib.cm
+    import matplotlib.colors
+    import matplotlib.ticker
+
+    levels = args[0] if args else kwargs.pop("levels", None)
+    extend = kwargs.pop("extend", "neither")
+    if levels is None:
+        return None
+    if np.ndim(levels) == 0:
+        locator = matplotlib.ticker.MaxNLocator(int(levels) + 1)
+        levels = locator.tick_values(np.nanmin(values), np.nanmax(values))
+    cmap = matplotlib.cm.ScalarMappable(cmap=kwargs.get("cmap")).get_cmap()
+    # Like contourf, leave values beyond levels that are not extended blank
+    transparent = (0.0, 0.0, 0.0, 0.0)
+    if extend not in ("min", "both"):
+        cmap = cmap.with_extremes(under=transparent)
+    if extend not in ("max", "both"):
+        cmap = cmap.with_extremes(over=transparent)
+    kwargs["cmap"] = cmap
+    return matplotlib.colors.BoundaryNorm(levels, cmap.N, extend=extend)
+
+
+def _cell_edges(a: np.ndarray) -> np.ndarray:
+    # Edges of cells centred on the points of a 2D coordinate array
+    for axis in (0, 1):
+        a = np.moveaxis(a, axis, 0)
+        if a.shape[0] > 1:
+            mid = 0.5 * (a[1:] + a[:-1])
+            first, last = 2 * a[:1] - mid[:1], 2 * a[-1:] - mid[-1:]
+        else:
+            mid, first, last = a[:0], a - 0.5, a + 0.5
+        a = np.moveaxis(np.concatenate((first, mid, last)), 0, axis)
+    return a
+
+
+def _plot_field(ax, time, z, values, args, kwargs, lod: bool):
+    import matplotlib.collections
+    import matplotlib.dates
+
+    if not lod:
+        time_2d = np.broadcast_to(time[:, np.newaxis], z.shape)
+        return ax.contourf(time_2d, z, values, *args, **kwargs)
+
+    # Fast path: pcolormesh of the field averaged over time bins that
+    # match the pixel resolution of the axes
+    x = matplotlib.dates.date2num(time)
+    z = _as_float(z)
+    values = _as_float(values)
+    kwargs = dict(kwargs)
+    norm = _contour_norm(values, args, kwargs)
+    if norm is not None:
+        kwargs["norm"] = norm
+    lod = _LevelOfDetail.get(ax)
+
+    def mesh(xmin, xmax, nbins, autolim=False, **kwargs):
+        visible, starts = _bins(x, xmin, xmax, nbins)
+        xb, zb, vb = x[visible], z[visible], values[visible]
+        if starts is not None:
+            counts = np.diff(np.append(starts, xb.size))
+            xb = np.add.reduceat(xb, starts) / counts
+            zb = np.add.reduceat(zb, starts, axis=0) / counts[:, np.newaxis]
+            vb = np.add.reduceat(vb, starts, axis=0) / counts[:, np.newaxis]
+        # Build the QuadMesh directly rather than through ax.pcolormesh,
+        # which would request rescaling of the axes on every zoom.
+        xb = np.broadcast_to(xb, zb.T.shape)
+        coordinates = np.stack((_cell_edges(xb), _cell_edges(zb.T)), axis=-1)
+        pc = matplotlib.collections.QuadMesh(coordinates, **kwargs)
+        pc.set_array(np.ma.masked_invalid(vb.T))
+        return ax.add_collection(pc, autolim=autolim)
+
+    pc = mesh(None, None, lod.nbins, autolim=True, **kwargs)
+    current = [pc]
+
+    def update(xmin, xmax, nbins):
+        old = current[0]
+        current[0] = mesh(
+            xmin, xmax, nbins, cmap=old.cmap, norm=old.norm, zorder=old.zorder
+        )
+        old.remove()
+
+    lod.add(update)
+    return pc
+
+
+def plot_0d_timeseries(
+    ax,
+    time,
+    values,
+    obs,
+    label: str = "model",
+    extra_series=[],
+    lod: bool = False,
+):
+    import matplotlib.dates
+
+    low = obs.value - obs.p25
+    high = obs.p75 - obs.value
     ax.errorbar(
-        obs[:, 0],
-        obs[:, 1],
+        obs.time,
+        obs.value,
         yerr=[low, high],
         ecolor="k",
         elinewidth=1.0,
@@ -70,9 +1033,11 @@ def plot_0d_timeseries(ax, time, values, obs, label: str = "model", extra_series
     )
     icolor = 0
     for extra_label, extra_values in extra_series:
-        ax.plot_date(time, extra_values, "-", color=f"C{icolor}", label=extra_label)
+        _plot_line(
+            ax, time, extra_values, "-", lod, color=f"C{icolor}", label=extra_label
+        )
         icolor += 1
-    (series,) = ax.plot_date(time, values, "-", color=f"C{icolor}", label=label)
+    series = _plot_line(ax, time, values, "-", lod, color=f"C{icolor}", label=label)
     ax.set_xlim(time[0], time[-1])
     ax.xaxis.set_major_formatter(
         matplotlib.dates.ConciseDateFormatter(ax.xaxis.get_major_locator())
@@ -82,10 +1047,11 @@ def plot_0d_timeseries(ax, time, values, obs, label: str = "model", extra_series
     return series
 
 
-def plot_1d_timeseries(ax, time, z, values, *args, cax=None, **kwargs):
+def plot_1d_timeseries(ax, time, z, values, *args, cax=None, lod=False, **kwargs):
+    import matplotlib.dates
+
     fig = ax.figure
-    time_2d = np.broadcast_to(time[:, np.newaxis], z.shape)
-    pc = ax.contourf(time_2d, z, values, *args, **kwargs)
+    pc = _plot_field(ax, time, z, values, args, kwargs, lod)
     cb = fig.colorbar(pc, cax=cax)
     ax.set_ylabel("depth (m)")
     ax.xaxis.axis_date()
@@ -101,25 +1067,37 @@ def plot_1d_timeseries(ax, time, z, values, *args, cax=None, **kwargs):
 def plot_0d_ensemble_timeseries(
     ax,
     time,
-    ens,
+    ens: Union[np.ndarray, EnsembleStatistics],
     ref={},
     obs=None,
     filter_period: int = 1,
     plot_spread: bool = True,
     label: Optional[str] = None,
+    lod: bool = False,
 ):
-    if filter_period != 1:
-        import scipy.signal
+    import matplotlib.dates
+
+    if isinstance(ens, EnsembleStatistics):
+        if filter_period != 1:
+            raise ValueError(
+                "For precomputed ensemble statistics, filter_period must be"
+                " passed to stream_ensemble_statistics instead."
+            )
+        stats = ens
+    else:
+        if filter_period != 1:
+            import scipy.signal
 
-        ens = scipy.signal.medfilt(ens, (1, filter_period))
+            ens = scipy.signal.medfilt(ens, (1, filter_period))
+        stats = ensemble_statistics(ens)
 
     if obs is not None:
-        low = obs[:, 1] - obs[:, 2]
-        high = obs[:, 3] - obs[:, 1]
-        # ax.plot_date(obs[:,0], obs[:,1], '.k', alpha=0.4, label='observations')
+        low = obs.value - obs.p25
+        high = obs.p75 - obs.value
+        # ax.plot_date(obs.time, obs.value, '.k', alpha=0.4, label='observations')
         ax.errorbar(
-            obs[:, 0],
-            obs[:, 1],
+            obs.time,
+            obs.value,
             yerr=[low, high],
             ecolor="k",
             elinewidth=1.0,
@@ -131,36 +1109,37 @@ def plot_0d_ensemble_timeseries(
     label = label or "model"
     icolor = 0
     for reflabel, refvalues in ref:
-        ax.plot_date(time, refvalues, "-", color=f"C{icolor}", label=reflabel)
+        _plot_line(ax, time, refvalues, "-", lod, color=f"C{icolor}", label=reflabel)
         icolor += 1
     if plot_spread:
-        p25 = np.percentile(ens, 25.0, axis=0)
-        p75 = np.percentile(ens, 75.0, axis=0)
-        pmin = np.min(ens, axis=0)
-        pmax = np.max(ens, axis=0)
-        ax.fill_between(
+        p25, p75 = stats.p25, stats.p75
+        pmin, pmax = stats.min, stats.max
+        _fill_between(
+            ax,
             time,
             pmin,
             pmax,
+            lod,
             alpha=0.2,
             label=f"{label}, ensemble min to max",
             fc=f"C{icolor}",
         )
-        ax.fill_between(time, p25, p75, fc="w")
-        ax.fill_between(
+        _fill_between(ax, time, p25, p75, lod, fc="w")
+        _fill_between(
+            ax,
             time,
             p25,
             p75,
+            lod,
             alpha=0.5,
             label=f"{label}, 1st to 3rd ensemble quartile",
             fc=f"C{icolor}",
         )
         for p in (pmin, pmax, p25, p75):
-            ax.plot_date(time, p, "-k", lw=0.2)
+            _plot_line(ax, time, p, "-k", lod, lw=0.2)
         label = f"{label}, ensemble median"
 
-    median = np.median(ens, axis=0)
-    ax.plot_date(time, median, "-", color=f"C{icolor}", label=label)
+    _plot_line(ax, time, stats.median, "-", lod, color=f"C{icolor}", label=label)
     ax.grid()
     ax.legend()
     ax.set_xlim(time[0], time[-1])
@@ -169,10 +1148,24 @@ def plot_0d_ensemble_timeseries(
     )
 
 
-def plot_1d_ensemble_timeseries(ax, time, z, ens, *args, cax=None, **kwargs):
+def plot_1d_ensemble_timeseries(
+    ax,
+    time,
+    z,
+    ens: Union[np.ndarray, EnsembleStatistics],
+    *args,
+    cax=None,
+    lod: bool = False,
+    **kwargs,
+):
+    import matplotlib.dates
+
+    if isinstance(ens, EnsembleStatistics):
+        median = ens.median
+    else:
+        median = np.median(ens, axis=0)
     fig = ax.figure
-    time_2d = np.broadcast_to(time[:, np.newaxis], z.shape)
-    pc = ax.contourf(time_2d, z, np.median(ens, axis=0), *args, **kwargs)
+    pc = _plot_field(ax, time, z, median, args, kwargs, lod)
     cb = fig.colorbar(pc, cax=cax)
     ax.set_ylabel("depth (m)")
     ax.grid()
@@ -0,0 +1,212 @@
+"""Thin observation files by combining observations into super-observations.
+
+Observations are binned into fixed time windows. All observations in a
+window are replaced by their inverse-variance weighted mean, with the
+combined error standard deviation. Input and output use the format read by
+``experiment.add_observations``: lines "YYYY-MM-DD hh:mm:ss value sd".
+
+Errors of observations within a window are often correlated (e.g., the same
+retrieval bias on consecutive days). This is described by a single
+correlation coefficient r between the errors of any two observations in a
+window. With normalized weights w, the error variance of the weighted mean
+then is (1 - r) sum(w² sd²) + r (sum(w sd))². For r = 0 (the default) this
+is the familiar 1 / sum(1 / sd²); for r = 1 errors do not average out.
+
+Chlorophyll is often approximately log-normally distributed. If its values
+are stored in linear space, --log10 combines them in log10 space instead,
+using sd_log10 = sd / (value ln 10) to convert the errors, and converts the
+result back. Files that already contain log10 values (e.g., cci_chl.dat)
+are combined as they are.
+
+Usage:
+
+    python superobs.py INFILE OUTFILE --window 5D
+    python superobs.py nrt_chlsat.obs nrt_chlsat_7d.obs --window 7D --log10 --correlation 0.3
+"""
+
+import argparse
+import datetime
+from typing import Iterable, NamedTuple, Optional, Union
+
+import numpy as np
+
+import shared
+
+TimeDeltaLike = Union[str, datetime.timedelta, np.timedelta64]
+
+_LN10 = np.log(10.0)
+
+
+class SuperObservations(NamedTuple):
+    time: np.ndarray
+    value: np.ndarray
+    sd: np.ndarray
+    count: np.ndarray  # number of (unique) observations combined
+
+
+def _timedelta(value: TimeDeltaLike) -> np.timedelta64:
+    # Accept numpy-style strings such as "5D" or "12h". Months and years
+    # have no fixed length, so they cannot be used as window length.
+    if isinstance(value, str):
+        value = value.strip()
+        number = value.rstrip("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+        unit = value[len(number) :] or "s"
+        if unit in ("M", "Y"):
+            raise ValueError(
+                f"Window {value!r}: months and years have no fixed length;"
+                " use days instead, e.g., 30D."
+            )
+        try:
+            return np.timedelta64(int(number or 1), unit).astype("timedelta64[s]")
+        except (TypeError, ValueError):
+            raise ValueError(
+                f"Window {value!r} must be a number with a unit such as W, D, h,"
+                " m or s."
+            ) from None
+    return np.timedelta64(value, "s")
+
+
+def combine(
+    time: np.ndarray,
+    value: np.ndarray,
+    sd: np.ndarray,
+    window: TimeDeltaLike,
+    origin: Optional[np.datetime64] = None,
+    correlation: float = 0.0,
+    log10: bool = False,
+    time_mode: str = "mean",
+) -> SuperObservations:
+    """Combine observations into one super-observation per time window.
+
+    Windows start at ``origin`` (default: midnight before the first
+    observation) and have length ``window``. Exact duplicates (same time
+    and value) are counted once. The time of a super-observation is the mean
+    time of its observations (``time_mode="mean"``) or the centre of the
+    window (``time_mode="center"``).
+    """
+    if not 0.0 <= correlation <= 1.0:
+        raise ValueError(f"correlation must be between 0 and 1, not {correlation}")
+    if time_mode not in ("mean", "center"):
+        raise ValueError(f"time_mode must be 'mean' or 'center', not {time_mode!r}")
+    time = np.asarray(time, dtype="datetime64[s]")
+    value = np.asarray(value, dtype=float)
+    sd = np.asarray(sd, dtype=float)
+    if np.any(sd <= 0.0):
+        raise ValueError("All standard deviations must be positive.")
+    window = _timedelta(window)
+
+    # Drop duplicates: repeated records add no information
+    records = np.rec.fromarrays([time.astype(np.int64), value])
+    _, unique = np.unique(records, return_index=True)
+    unique.sort()
+    time, value, sd = time[unique], value[unique], sd[unique]
+
+    if log10:
+        sd = sd / (value * _LN10)
+        value = np.log10(value)
+
+    if origin is None:
+        origin = time.min().astype("datetime64[D]")
+    origin = np.datetime64(origin, "s")
+    ibin = (time - origin) // window
+    bins, inverse, count = np.unique(ibin, return_inverse=True, return_counts=True)
+
+    # Inverse-variance weights, normalized within each window
+    weight = 1.0 / sd**2
+    weight /= np.bincount(inverse, weight)[inverse]
+    mean = np.bincount(inverse, weight * value)
+    variance = (1.0 - correlation) * np.bincount(inverse, (weight * sd) ** 2)
+    variance += correlation * np.bincount(inverse, weight * sd) ** 2
+    combined_sd = np.sqrt(variance)
+
+    if time_mode == "mean":
+        offset = (time - origin).astype(float)
+        new_time = origin + np.round(np.bincount(inverse, offset) / count).astype(
+            "timedelta64[s]"
+        )
+    else:
+        new_time = origin + bins * window + window // 2
+
+    if log10:
+        mean = 10.0**mean
+        combined_sd = combined_sd * mean * _LN10
+    return SuperObservations(new_time, mean, combined_sd, count)
+
+
+def write(path: str, obs: SuperObservations, header: Optional[str] = None):
+    """Write observations in the format read by experiment.add_observations"""
+    with open(path, "w") as f:
+        if header:
+            for line in header.splitlines():
+                f.write(f"# {line}\n")
+        for time, value, sd in zip(obs.time, obs.value, obs.sd):
+            f.write(f"{str(time).replace('T', ' ')}\t{value:.6g}\t{sd:.6g}\n")
+
+
+def thin_file(
+    path: str, outpath: str, window: TimeDeltaLike, **kwargs
+) -> SuperObservations:
+    """Combine the observations in ``path`` and write the result to
+    ``outpath``. Keyword arguments are passed to :func:`combine`."""
+    time, value, sd = shared.parse_0d_observations(path)
+    obs = combine(time, value, sd, window, **kwargs)
+    settings = ", ".join(f"{k}={v}" for k, v in kwargs.items())
+    header = (
+        f"super-observations from {path}: {time.size} observations in"
+        f" {obs.time.size} windows of {window}"
+    )
+    if settings:
+        header += f" ({settings})"
+    write(outpath, obs, header + "\ntime\tvalue\tsd")
+    return obs
+
+
+def main(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument("infile", help="observation file")
+    parser.add_argument("outfile", help="file to write super-observations to")
+    parser.add_argument(
+        "--window", required=True, help="window length, e.g., 5D, 12h (default unit: s)"
+    )
+    parser.add_argument(
+        "--origin", help="start of the first window, e.g., 2020-01-01T12:00"
+    )
+    parser.add_argument(
+        "--correlation",
+        type=float,
+        default=0.0,
+        help="error correlation between observations in a window (default: 0)",
+    )
+    parser.add_argument(
+        "--log10",
+        action="store_true",
+        help="combine linear values in log10 space (e.g., chlorophyll)",
+    )
+    parser.add_argument(
+        "--time",
+        choices=("mean", "center"),
+        default="mean",
+        help="time of super-observations: mean of observations or window centre",
+    )
+    args = parser.parse_args(args)
+    try:
+        _timedelta(args.window)
+    except ValueError as e:
+        parser.error(str(e))
+
+    kwargs = dict(correlation=args.correlation, log10=args.log10, time_mode=args.time)
+    if args.origin:
+        kwargs["origin"] = np.datetime64(args.origin)
+    obs = thin_file(args.infile, args.outfile, args.window, **kwargs)
+    print(
+        f"{args.infile}: {obs.count.sum()} unique observations combined into"
+        f" {obs.time.size} super-observations in {args.outfile}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""Make the modules under test importable, with the eatpy stand-in of the
+benchmarks if eatpy is not installed."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmarks  # noqa: E402
+
+benchmarks.setup_paths()
@@ -0,0 +1,79 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import checkpoint
+
+START = datetime.datetime(2020, 1, 1)
+DAY = datetime.timedelta(days=1)
+
+
+class _Plugin:
+    month = 1
+
+
+def _run(plugin, state, times):
+    plugin.initialize(dict(x=dict(start=0, length=state.shape[1])), state.shape[0])
+    for time in times:
+        plugin.before_analysis(time, state, None, None, None, None)
+        state += 1.0
+    plugin.finalize()
+
+
+def _saved(tmp_path, every=2):
+    # Checkpoints on days 1 and 3 of an analysis every day, with the state
+    # increasing by one per analysis
+    plugin = checkpoint.Checkpoint(str(tmp_path / "checkpoints"), every=every, keep=5)
+    plugin.register("other", _Plugin(), "month")
+    _run(plugin, np.zeros((3, 4)), [START + i * DAY for i in range(5)])
+    return plugin
+
+
+def test_resume(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _saved(tmp_path)
+    (tmp_path / "result_0001.nc").write_text("interrupted")
+
+    other = _Plugin()
+    plugin = checkpoint.Checkpoint("checkpoints", resume=True)
+    plugin.register("other", other, "month")
+    assert plugin.start == START + 3 * DAY
+    assert (tmp_path / "result_0001.before_20200104000000.nc").read_text() == (
+        "interrupted"
+    )
+    assert not (tmp_path / "result_0001.nc").exists()
+
+    # A slightly later first analysis restores the checkpoint
+    state = np.full((3, 4), -1.0)
+    _run(plugin, state, [plugin.start + datetime.timedelta(seconds=30)])
+    np.testing.assert_array_equal(state, 4.0)
+    assert other.month == 1
+
+
+def test_resume_before_analysis(tmp_path, monkeypatch):
+    # Without a checkpoint at the first analysis, the latest one before it
+    # is restored; analyses before all checkpoints change nothing
+    monkeypatch.chdir(tmp_path)
+    _saved(tmp_path)
+    plugin = checkpoint.Checkpoint("checkpoints", resume=True)
+    plugin.register("other", _Plugin(), "month")
+    state = np.full((3, 4), -1.0)
+    _run(plugin, state, [START, START + 2 * DAY + datetime.timedelta(hours=12)])
+    np.testing.assert_array_equal(state, 2.0)
+
+
+def test_archive_outputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for _ in range(2):
+        (tmp_path / "result.nc").write_text("run")
+        checkpoint.archive_outputs(START)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "result.before_20200101000000.1.nc",
+        "result.before_20200101000000.nc",
+    ]
+
+
+def test_resume_without_checkpoints(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        checkpoint.Checkpoint(str(tmp_path), resume=True)
@@ -0,0 +1,88 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks import synthetic
+from myPlugins import cvt_operator, ogs3dvar_base
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_adjoint(seed):
+    variables, pvars, state, Vmat_p = cvt_operator.synthetic_layout(seed=seed)
+    operator = cvt_operator.CvtOperator(variables, pvars, state, Vmat_p)
+    rng = np.random.default_rng(seed)
+    assert cvt_operator.dot_product_test(operator, rng) < 1e-10
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_gradient(seed):
+    variables, pvars, state, Vmat_p = cvt_operator.synthetic_layout(seed=seed)
+    operator = cvt_operator.CvtOperator(variables, pvars, state, Vmat_p)
+    steps = 10.0 ** -np.arange(1, 7)
+    ratios = cvt_operator.gradient_test(operator, np.random.default_rng(seed), steps)
+    errors = np.abs(ratios - 1.0)
+
+    # First-order convergence: the error drops tenfold with the step
+    assert errors[-1] < 1e-5
+    np.testing.assert_allclose(errors[1:] / errors[:-1], 0.1, rtol=0.05)
+
+
+def _plugin(tmp_path, nz=50, **kwargs):
+    # Chl plugin on a BFM-like state, before its first analysis
+    eofs = synthetic.write_eofs(str(tmp_path / "eofs"))
+    variables = {}
+    names = ["z", "total_chlorophyll"]
+    names += [f"P{i}_{c}" for i in range(1, 5) for c in ("c", "n", "p", "Chl", "s")]
+    state = np.random.default_rng(0).uniform(0.01, 1.0, (1, len(names) * nz))
+    for i, name in enumerate(names):
+        start = i * nz
+        variables[name] = dict(
+            start=start, length=nz, stop=start + nz, data=state[:, start : start + nz]
+        )
+    variables["z"]["data"][...] = np.linspace(-200.0, 0.0, nz)
+    plugin = ogs3dvar_base.Chl(
+        eofs_filestring=eofs,
+        z_file=os.path.join(os.path.dirname(eofs), "z.txt"),
+        **kwargs,
+    )
+    plugin.initialize(variables, 1)
+    return plugin, state
+
+
+def test_plugin_adjoint(tmp_path):
+    # The same check through the cvt and cvt_adj methods PDAF calls
+    nz = 50
+    plugin, state = _plugin(tmp_path, nz)
+    plugin.before_analysis(datetime.datetime(2020, 1, 1), state, None, None, None, None)
+
+    rng = np.random.default_rng(1)
+    x = rng.standard_normal(plugin.dim_cvec)
+    x *= 0.1 / np.abs(x @ plugin.Vmat_p / state[0, nz : 2 * nz]).max()
+    y = rng.standard_normal(state.shape[1])
+    lhs = np.dot(plugin.cvt(1, state[0], x), y)
+    rhs = np.dot(x, plugin.cvt_adj(2, state[0], y))
+    assert abs(lhs - rhs) <= 1e-10 * max(abs(lhs), abs(rhs))
+
+
+def test_truncation_report(tmp_path, caplog):
+    caplog.set_level("INFO")
+    plugin, state = _plugin(tmp_path, explained_variance=1.0)
+    assert plugin.dim_cvec == 26
+    assert "No reduction" in caplog.text
+    assert "Upper-bound" not in caplog.text
+
+    caplog.clear()
+    plugin, state = _plugin(tmp_path, explained_variance=0.5)
+    assert plugin.dim_cvec < 26
+    assert "Upper-bound estimates" in caplog.text
+
+    # Measured times of the operator at the first analysis, and iterations
+    plugin.before_analysis(datetime.datetime(2020, 1, 1), state, None, None, None, None)
+    v_p = np.zeros(plugin.dim_cvec)
+    for iteration in (1, 2, 3):
+        plugin.cvt(iteration, state[0], v_p)
+    plugin.after_analysis(state)
+    assert "Measured cvt + cvt_adj" in caplog.text
+    assert f"took 3 iterations with {plugin.dim_cvec} EOFs" in caplog.text
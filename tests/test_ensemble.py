@@ -0,0 +1,88 @@
+import difflib
+import os
+
+import numpy as np
+import pytest
+import yaml
+
+import ensemble
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOTM = os.path.join(ROOT, "Ensemble", "reference", "gotm.yaml")
+FABM = os.path.join(ROOT, "Ensemble", "reference", "fabm.yaml")
+
+
+def _read(path):
+    with open(path) as f:
+        text = f.read()
+    return text, yaml.safe_load(text)
+
+
+def test_unperturbed_round_trip():
+    text, document = _read(GOTM)
+    assert ensemble._render(text, document, []) == text
+
+
+def test_perturbed_values_only():
+    text, document = _read(GOTM)
+    overrides = [
+        ("turbulence/turb_param/k_min", 2.0, True),
+        ("surface/u10/scale_factor", 1.25, False),
+        ("fabm/yaml_file", "fabm_0001.yaml", False),
+    ]
+    rendered = ensemble._render(text, document, overrides)
+    result = yaml.safe_load(rendered)
+    assert result["turbulence"]["turb_param"]["k_min"] == 2.0e-06
+    assert result["surface"]["u10"]["scale_factor"] == 1.25
+    assert result["fabm"]["yaml_file"] == "fabm_0001.yaml"
+
+    # Everything else, including "method: off" and comments, is unchanged
+    result["turbulence"]["turb_param"]["k_min"] = 1.0e-06
+    del result["surface"]["u10"]["scale_factor"]
+    del result["fabm"]["yaml_file"]
+    assert result == document
+    diff = list(difflib.ndiff(text.splitlines(), rendered.splitlines()))
+    assert [line[2:] for line in diff if line.startswith("- ")] == [
+        line for line in text.splitlines() if "k_min:" in line
+    ]
+    assert len([line for line in diff if line.startswith("+ ")]) == 3
+    assert rendered.count("method: off ") == text.count("method: off ")
+
+
+def test_not_a_scalar():
+    text, document = _read(GOTM)
+    with pytest.raises(ValueError):
+        ensemble._render(text, document, [("surface/u10", 1.0, False)])
+    with pytest.raises(ValueError):
+        ensemble._render(text, document, [("grid/nlev/x", 1.0, False)])
+    with pytest.raises(KeyError):
+        ensemble._render(text, document, [("surface/u10/scale_factor", 2.0, True)])
+
+
+def test_generate(tmp_path):
+    spec = tmp_path / "ensemble.yaml"
+    spec.write_text(f"""files:
+  gotm.yaml: {GOTM}
+  fabm.yaml:
+    template: {FABM}
+    referenced_by: gotm.yaml:fabm/yaml_file
+perturbations:
+- file: fabm.yaml
+  key: instances/phy/parameters/mumax0
+  distribution: uniform
+  parameters: {{low: 0.5, high: 1.5}}
+  mode: multiplicative
+""")
+    rng = np.random.default_rng(1)
+    result = ensemble.generate(str(spec), 3, rng, str(tmp_path), max_workers=1)
+    assert sorted(result.written) == [
+        f"{name}_{i:04}.yaml" for name in ("fabm", "gotm") for i in (1, 2, 3)
+    ]
+    factors = np.random.default_rng(1).uniform(0.5, 1.5, size=3)
+    for i, factor in enumerate(factors, start=1):
+        member = ensemble.read_value(
+            str(tmp_path / f"fabm_{i:04}.yaml"), "instances/phy/parameters/mumax0"
+        )
+        assert member == pytest.approx(0.8 * factor)
+        gotm = str(tmp_path / f"gotm_{i:04}.yaml")
+        assert ensemble.read_value(gotm, "fabm/yaml_file") == f"fabm_{i:04}.yaml"
@@ -0,0 +1,137 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import localization
+from benchmarks import analysis
+
+NZ, N = 50, 12
+DEPTH = (np.arange(NZ, 0, -1) - 0.5) * 2.0  # 100 m column, bottom first
+BGC = ["total_chlorophyll", "bgc00_c", "bgc01_c"]
+NAMES = ["temp", "salt", *BGC, "sum"]
+
+
+def _column(seed=0):
+    # Complete state (member, state) and eatpy-style variable info for it:
+    # profiles and a scalar parameter, with depth-correlated perturbations
+    lengths = {name: 1 if name == "sum" else NZ for name in NAMES}
+    state = np.empty((N, sum(lengths.values())))
+    variables, start = {}, 0
+    for name, length in lengths.items():
+        stop = start + length
+        variables[name] = dict(
+            start=start, length=length, stop=stop, data=state[:, start:stop]
+        )
+        start = stop
+    rng = np.random.default_rng(seed)
+    common = rng.normal(size=(N, 1))
+    state[...] = 1.0 + 0.1 * rng.normal(size=state.shape) + 0.2 * common
+    return state, variables
+
+
+def _weights(variables, taper):
+    # Taper of a surface observation for each column of the complete state
+    weights = np.zeros(sum(info["length"] for info in variables.values()))
+    profile = localization.gaspari_cohn((DEPTH - DEPTH[-1]) / taper.length)
+    for name in taper.variables:
+        info = variables[name]
+        weights[info["start"] : info["stop"]] = profile if info["length"] > 1 else 1.0
+    return weights
+
+
+def _cycle(plugin, state, variables, keys, obs, obs_sds):
+    # One analysis as eatpy runs it: plugins see the complete state, the
+    # filter a compact copy with observations indexed from the variables
+    plugin.initialize(variables, N)
+    iobs = np.array([analysis.observation_index(variables, key) for key in keys])
+    update = analysis.compact_analysis(state, variables)
+    plugin.before_analysis(
+        datetime.datetime(2020, 1, 1), state, iobs, obs, obs_sds, None
+    )
+    update(iobs, obs, obs_sds)
+    plugin.after_analysis(state)
+    return iobs
+
+
+def test_observation_index():
+    tapers = {
+        "total_chlorophyll[-1]": localization.Taper(10.0, BGC),
+        "temp[-5]": localization.Taper(5.0, ["temp"]),
+    }
+    plugin = localization.Localization(DEPTH, tapers)
+    state, variables = _column()
+    plugin.initialize(variables, N)
+
+    # Bottom levels were removed, so indices differ from the complete state
+    assert variables["temp"]["start"] > 0 and "salt" not in variables
+    expected = [analysis.observation_index(variables, key) for key in tapers]
+    np.testing.assert_array_equal(plugin.obs_index, expected)
+
+    # The observed values in the compact state are those of the configured levels
+    compact = np.concatenate([info["data"] for info in variables.values()], axis=1)
+    full = _column()[0]
+    np.testing.assert_array_equal(compact[:, expected[0]], full[:, 3 * NZ - 1])
+    np.testing.assert_array_equal(compact[:, expected[1]], full[:, NZ - 5])
+
+
+def test_level_from_bottom_rejected():
+    plugin = localization.Localization(DEPTH, {"temp[45]": localization.Taper(5.0)})
+    state, variables = _column()
+    with pytest.raises(ValueError):
+        plugin.initialize(variables, N)
+
+
+def test_unknown_observation_rejected():
+    tapers = {"total_chlorophyll[-1]": localization.Taper(10.0, BGC)}
+    plugin = localization.Localization(DEPTH, tapers)
+    state, variables = _column()
+    plugin.initialize(variables, N)
+    with pytest.raises(ValueError):
+        plugin.before_analysis(None, state, plugin.obs_index + 1, None, None, None)
+
+
+def test_tapered_increment():
+    # The localized analysis equals a full-column analysis with its
+    # increment tapered by hand
+    key, taper = "total_chlorophyll[-1]", localization.Taper(15.0, [*BGC, "sum"])
+    obs, obs_sds = np.array([1.3]), np.array([0.1])
+    prior, variables = _column()
+
+    full = prior.copy()
+    surface = variables["total_chlorophyll"]["stop"] - 1
+    analysis.etkf(full, np.array([surface]), obs, obs_sds)
+
+    weights = _weights(variables, taper)
+    expected = prior + weights * (full - prior)
+
+    state = prior.copy()
+    plugin = localization.Localization(DEPTH, {key: taper})
+    _cycle(plugin, state, variables, [key], obs, obs_sds)
+
+    np.testing.assert_allclose(state, expected, rtol=0.0, atol=1e-12)
+    outside = weights == 0.0
+    assert outside.sum() > 2 * NZ
+    np.testing.assert_array_equal(state[:, outside], prior[:, outside])
+    at_one = weights == 1.0
+    np.testing.assert_allclose(state[:, at_one], full[:, at_one], rtol=0.0, atol=1e-12)
+
+
+def test_localized_covariance():
+    # For a single observation, the analysis mean equals that of a Kalman
+    # filter with the covariances between the observation and the state
+    # multiplied by the taper
+    key, taper = "total_chlorophyll[-1]", localization.Taper(15.0, BGC)
+    obs, obs_sds = np.array([1.3]), np.array([0.1])
+    state, variables = _column(seed=1)
+    prior = state.copy()
+    surface = variables["total_chlorophyll"]["stop"] - 1
+    weights = _weights(variables, taper)
+    plugin = localization.Localization(DEPTH, {key: taper})
+    _cycle(plugin, state, variables, [key], obs, obs_sds)
+
+    perturbations = prior - prior.mean(axis=0)
+    covariance = perturbations.T @ perturbations[:, surface] / (N - 1)
+    gain = weights * covariance / (covariance[surface] + obs_sds[0] ** 2)
+    mean = prior.mean(axis=0) + gain * (obs[0] - prior[:, surface].mean())
+    np.testing.assert_allclose(state.mean(axis=0), mean, rtol=0.0, atol=1e-12)
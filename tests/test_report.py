@@ -0,0 +1,63 @@
+import json
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import report  # noqa: E402
+
+# Configuration cell of Ensemble/experiment.ipynb: a conditional override
+# of the ensemble size for CI
+CONFIGURATION = """import os
+import datetime
+
+# Experiment configuration
+N = 20   # ensemble size
+plot_start = datetime.datetime(2021,1,1)
+
+# For automated testing we reduce the ensemble size
+if "GITHUB_ACTIONS" in os.environ:
+    N = 3"""
+
+FIGURE = """from matplotlib import pyplot
+with open("size.txt", "w") as f:
+    f.write(str(N))
+fig = pyplot.figure()
+fig.savefig("size.png")"""
+
+
+def _notebook(path, *sources):
+    cells = [dict(cell_type="code", source=source) for source in sources]
+    with open(path, "w") as f:
+        json.dump(dict(cells=cells), f)
+
+
+def test_conditional_definition(tmp_path, monkeypatch):
+    notebook = tmp_path / "experiment.ipynb"
+    _notebook(notebook, CONFIGURATION, "!mpiexec run.py", FIGURE)
+    (job,) = report.parse_notebook(str(notebook))
+    assert job.outputs == ["size.png"]
+    sources = [s.source.strip() for s in job.statements]
+    assert "N = 20" in sources
+    assert any(s.startswith('if "GITHUB_ACTIONS"') for s in sources)
+    assert not any("plot_start" in s for s in sources)
+
+    # render changes the working directory; monkeypatch restores it
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("GITHUB_ACTIONS", raising=False)
+    report.render(str(tmp_path), notebook.name, job)
+    assert (tmp_path / "size.txt").read_text() == "20"
+    assert (tmp_path / "size.png").is_file()
+
+    monkeypatch.setenv("GITHUB_ACTIONS", "true")
+    report.render(str(tmp_path), notebook.name, job)
+    assert (tmp_path / "size.txt").read_text() == "3"
+
+
+def test_unconditional_definition(tmp_path):
+    # Only the latest unconditional definition of a name is needed
+    notebook = tmp_path / "experiment.ipynb"
+    _notebook(notebook, "N = 20\nN = 5", FIGURE)
+    (job,) = report.parse_notebook(str(notebook))
+    sources = [s.source.strip() for s in job.statements]
+    assert "N = 5" in sources and "N = 20" not in sources
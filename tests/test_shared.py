@@ -0,0 +1,29 @@
+import os
+
+import numpy as np
+import pytest
+
+import shared
+from benchmarks import synthetic
+
+
+def test_store_with_fewer_members(tmp_path):
+    path = synthetic.write_ensemble(str(tmp_path), 5, nt=20, nz=4)
+    _, _, expected, _, _ = shared.read_ensemble_result(path, "temp", 5)
+
+    # A store of the first 3 members, newer than the member files
+    shared.consolidate_ensemble(path, 3)
+    _, _, values, _, _ = shared.read_ensemble_result(path, "temp", 3)
+    np.testing.assert_array_equal(values, expected[:3])
+
+    # Reading 5 members falls back to the member files
+    shared.result_cache.clear()
+    _, _, values, _, _ = shared.read_ensemble_result(path, "temp", 5)
+    assert values.shape[0] == 5
+    np.testing.assert_array_equal(values, expected)
+
+    # Without member files, the store cannot provide them
+    os.remove(str(tmp_path / "result_0005.nc"))
+    shared.result_cache.clear()
+    with pytest.raises(ValueError):
+        shared.read_ensemble_result(path, "temp", 5)
@@ -0,0 +1,238 @@
+"""Score ensemble simulations against observations.
+
+Each observation is matched to the nearest model output time. Observations
+before the first or after the last output time, or further than a given
+tolerance from the nearest output time, are skipped. For the matched
+values, the following scores are computed:
+
+* bias and root-mean-square difference (RMSD) of the ensemble mean and of
+  each individual member
+* ensemble spread: the standard deviation across members
+* spread-skill ratio: root-mean-square spread divided by the RMSD of the
+  ensemble mean, with the finite-ensemble correction sqrt((N + 1) / N).
+  Values near 1 indicate a well-calibrated ensemble, values below 1 an
+  overconfident (underdispersive) one
+* continuous ranked probability score (CRPS) of the ensemble, computed
+  from the sorted members in O(N log N) per observation
+
+Chlorophyll is approximately log-normally distributed and is best scored
+in log10 space (--log10). The observations then are assumed to be in
+linear space too, unless --obs-log10 indicates they already contain
+log10 values, as in cci_chl.dat.
+
+Usage, e.g., from the Ensemble directory, for any number of experiments:
+
+    python ../verification.py da_phys da_bgc --obs observations/cci_chl.dat --variable total_chlorophyll --log10 --obs-log10
+"""
+
+import argparse
+import datetime
+import os
+from typing import Iterable, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+import shared
+
+TimeDeltaLike = Union[None, datetime.timedelta, np.timedelta64]
+
+
+class Scores(NamedTuple):
+    """Scores summarized over all matched observations"""
+
+    count: int
+    bias: float
+    rmsd: float
+    spread: float
+    spread_skill: float
+    crps: float
+    member_bias: np.ndarray
+    member_rmsd: np.ndarray
+
+
+class Verification(NamedTuple):
+    """Ensemble values matched to observations, with scores per observation.
+    Members are along the first axis of ``ensemble``."""
+
+    time: np.ndarray
+    observed: np.ndarray
+    ensemble: np.ndarray
+    mean: np.ndarray
+    spread: np.ndarray
+    crps: np.ndarray
+
+    def scores(self) -> Scores:
+        N = self.ensemble.shape[0]
+        error = self.ensemble - self.observed
+        rmsd = np.sqrt(np.mean((self.mean - self.observed) ** 2))
+        spread = np.sqrt(np.mean(self.spread**2))
+        return Scores(
+            count=self.observed.size,
+            bias=np.mean(self.mean - self.observed),
+            rmsd=rmsd,
+            spread=spread,
+            spread_skill=np.sqrt((N + 1) / N) * spread / rmsd,
+            crps=np.mean(self.crps),
+            member_bias=error.mean(axis=1),
+            member_rmsd=np.sqrt(np.mean(error**2, axis=1)),
+        )
+
+
+def match_times(
+    model_time: np.ndarray, obs_time: np.ndarray, tolerance: TimeDeltaLike = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """For each observation time, find the index of the nearest model time.
+    Model times must be increasing. Returns these indices and a boolean
+    array that is False for observations outside the model time range or
+    further than ``tolerance`` from the nearest model time."""
+    model_time = np.asarray(model_time, dtype="datetime64[s]")
+    obs_time = np.asarray(obs_time, dtype="datetime64[s]")
+    right = np.searchsorted(model_time, obs_time).clip(1, model_time.size - 1)
+    left = right - 1
+    nearer_left = obs_time - model_time[left] <= model_time[right] - obs_time
+    index = np.where(nearer_left, left, right)
+    valid = (obs_time >= model_time[0]) & (obs_time <= model_time[-1])
+    if tolerance is not None:
+        tolerance = np.timedelta64(tolerance, "s")
+        valid &= np.abs(model_time[index] - obs_time) <= tolerance
+    return index, valid
+
+
+def crps_ensemble(ensemble: np.ndarray, observed: np.ndarray) -> np.ndarray:
+    """CRPS of the empirical distribution of an ensemble, with members along
+    the first axis, for each observation.
+
+    With members x sorted in increasing order, the mean absolute difference
+    between members, sum_ij |x_i - x_j| / N², equals
+    2 sum_i (2i - N - 1) x_i / N² (i = 1, ..., N). This makes the cost
+    O(N log N) rather than O(N²) per observation.
+    """
+    ensemble = np.sort(ensemble, axis=0)
+    N = ensemble.shape[0]
+    weights = (2.0 * np.arange(1, N + 1) - N - 1) / N**2
+    skill = np.mean(np.abs(ensemble - observed), axis=0)
+    return skill - np.tensordot(weights, ensemble, axes=1)
+
+
+def verify(
+    time: np.ndarray,
+    ensemble: np.ndarray,
+    obs_time: np.ndarray,
+    obs_value: np.ndarray,
+    tolerance: TimeDeltaLike = None,
+    log10: bool = False,
+    obs_log10: bool = False,
+) -> Verification:
+    """Score an ensemble time series (member, time) against observations.
+
+    If ``log10`` is set, model values are scored in log10 space, and so are
+    the observations, which are log10-transformed first unless ``obs_log10``
+    indicates they already are. Non-finite values (e.g., masked model
+    values or the log10 of non-positive values) are skipped.
+    """
+    ensemble = np.ma.filled(np.ma.asarray(ensemble, dtype=float), np.nan)
+    if ensemble.ndim != 2:
+        raise ValueError(
+            f"Ensemble values must have shape (member, time), not {ensemble.shape}."
+            " Select a single depth level first."
+        )
+    obs_value = np.asarray(obs_value, dtype=float)
+    index, valid = match_times(time, obs_time, tolerance)
+    matched = ensemble[:, index]
+    if log10:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            matched = np.log10(matched)
+            if not obs_log10:
+                obs_value = np.log10(obs_value)
+    valid &= np.isfinite(obs_value) & np.isfinite(matched).all(axis=0)
+    matched = matched[:, valid]
+    observed = obs_value[valid]
+    return Verification(
+        time=np.asarray(obs_time)[valid],
+        observed=observed,
+        ensemble=matched,
+        mean=matched.mean(axis=0),
+        spread=(
+            matched.std(axis=0, ddof=1)
+            if matched.shape[0] > 1
+            else np.zeros_like(observed)
+        ),
+        crps=crps_ensemble(matched, observed),
+    )
+
+
+def verify_results(
+    path: str,
+    name: str,
+    N: int,
+    obs_path: str,
+    level: int = -1,
+    **kwargs,
+) -> Verification:
+    """Score a variable at depth index ``level`` (default: surface) in the
+    results of an ensemble of ``N`` members against an observation file.
+    Keyword arguments are passed to :func:`verify`."""
+    time, _, values, _, _ = shared.read_ensemble_result(path, name, N, level=level)
+    obs = shared.read_0d_observations(obs_path)
+    return verify(time, values, obs.time, obs.value, **kwargs)
+
+
+def main(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument("directories", nargs="+", help="experiment directories")
+    parser.add_argument("--obs", required=True, help="observation file")
+    parser.add_argument("--variable", required=True, help="variable to score")
+    parser.add_argument(
+        "--members",
+        type=int,
+        help="ensemble size (default: number of members in the results)",
+    )
+    parser.add_argument(
+        "--level", type=int, default=-1, help="depth index (default: surface)"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="maximum time between observation and model output (hours)",
+    )
+    parser.add_argument("--log10", action="store_true", help="score in log10 space")
+    parser.add_argument(
+        "--obs-log10", action="store_true", help="observations are log10 values"
+    )
+    args = parser.parse_args(args)
+
+    tolerance = None
+    if args.tolerance is not None:
+        tolerance = datetime.timedelta(hours=args.tolerance)
+    print(
+        f"{'experiment':<24}{'N':>5}{'obs':>6}{'bias':>10}{'RMSD':>10}"
+        f"{'spread':>10}{'ratio':>8}{'CRPS':>10}"
+    )
+    for directory in args.directories:
+        N = args.members or shared.ensemble_size(os.path.join(directory, "result.nc"))
+        if N == 0:
+            print(f"{directory:<24} no ensemble results found")
+            continue
+        result = verify_results(
+            os.path.join(directory, "result.nc"),
+            args.variable,
+            N,
+            args.obs,
+            level=args.level,
+            tolerance=tolerance,
+            log10=args.log10,
+            obs_log10=args.obs_log10,
+        )
+        s = result.scores()
+        print(
+            f"{directory:<24}{N:>5d}{s.count:>6d}{s.bias:>10.4f}{s.rmsd:>10.4f}"
+            f"{s.spread:>10.4f}{s.spread_skill:>8.3f}{s.crps:>10.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()